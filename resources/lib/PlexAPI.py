@@ -34,6 +34,7 @@ from re import compile as re_compile, sub
 from urllib import urlencode, unquote
 from os.path import basename, join
 from os import makedirs
+from functools import wraps
 
 from xbmcgui import ListItem
 from xbmcvfs import exists
@@ -41,7 +42,8 @@ from xbmcvfs import exists
 import clientinfo as client
 from downloadutils import DownloadUtils as DU
 from utils import window, settings, language as lang, try_decode, try_encode, \
-    unix_date_to_kodi, exists_dir, slugify, dialog, escape_html
+    unix_date_to_kodi, exists_dir, slugify, dialog, escape_html, \
+    wake_up_threads
 import PlexFunctions as PF
 import plexdb_functions as plexdb
 import variables as v
@@ -76,6 +78,22 @@ FANART_TV_TYPES = [
 ###############################################################################
 
 
+def memoize(method):
+    """
+    Decorator for API methods: the result is computed only once per API
+    instance and arguments. Callers must not modify the result!
+    """
+    @wraps(method)
+    def wrapper(self, *args):
+        key = (method.__name__, args)
+        try:
+            return self._memo[key]
+        except KeyError:
+            result = self._memo[key] = method(self, *args)
+            return result
+    return wrapper
+
+
 class API(object):
     """
     API(item)
@@ -89,7 +107,12 @@ class API(object):
         # which media part in the XML response shall we look at?
         self.part = 0
         self.mediastream = None
-        self.server = window('pms_server')
+        # Avoid Kodi's window properties if we can, they're slow
+        self.server = state.PMS_SERVER or window('pms_server')
+        # Tags and people of the item's child elements, see parse_children()
+        self._children = None
+        # Results of @memoize methods
+        self._memo = {}
 
     def set_part_number(self, number=None):
         """
@@ -106,11 +129,11 @@ class API(object):
 
     def checksum(self):
         """
-        Returns a string, not int.
+        Returns the PMS' updatedAt timestamp as an int (0 if not found) in
+        order to detect changed PMS items.
         WATCH OUT - time in Plex, not Kodi ;-)
         """
-        # Include a letter to prohibit saving as an int!
-        return "K%s%s" % (self.plex_id(), self.item.get('updatedAt', ''))
+        return int(self.item.get('updatedAt') or 0)
 
     def plex_id(self):
         """
@@ -222,7 +245,7 @@ class API(object):
 
     def userdata(self):
         """
-        Returns a dict with None if a value is missing
+        Returns a (new) dict with None if a value is missing
         {
             'Favorite': favorite,                  # False, because n/a in Plex
             'PlayCount': playcount,
@@ -233,6 +256,10 @@ class API(object):
             'Rating': rating
         }
         """
+        return dict(self._userdata())
+
+    @memoize
+    def _userdata(self):
         item = self.item.attrib
         # Default - attributes not found with Plex
         favorite = False
@@ -279,16 +306,73 @@ class API(object):
             'UserRating': userrating
         }
 
-    def collection_list(self):
+    def parse_children(self):
         """
-        Returns a list of PMS collection tags or an empty list
+        Walks the item's child elements ONCE and collects everything needed by
+        collection_list(), people(), people_list(), genre_list() and
+        country_list(). The result is kept with this API instance, hence it is
+        safe to call this method from another thread (e.g. the sync's parser
+        threads) before handing the API instance over.
+
+        Returns a dict
+        {
+            'Collection': list of collection tags,
+            'Genre': list of genre tags,
+            'Country': list of country tags,
+            'people': dict as returned by people(),
+            'people_list': list as returned by people_list()
+        }
         """
+        if self._children is not None:
+            return self._children
         collections = []
+        genres = []
+        countries = []
+        people = {
+            'Director': [],
+            'Writer': [],
+            'Cast': [],
+            'Producer': []
+        }
+        people_list = []
         for child in self.item:
-            if child.tag == 'Collection':
+            tag = child.tag
+            if tag == 'Collection':
                 if child.attrib['tag']:
                     collections.append(child.attrib['tag'])
-        return collections
+            elif tag == 'Genre':
+                genres.append(child.attrib['tag'])
+            elif tag == 'Country':
+                countries.append(child.attrib['tag'])
+            elif tag in PEOPLE_OF_INTEREST:
+                try:
+                    people['Cast' if tag == 'Role' else tag].append(
+                        child.attrib['tag'])
+                except KeyError:
+                    LOG.warn('Malformed PMS answer for getPeople: %s: %s',
+                             tag, child.attrib)
+                    continue
+                people_list.append({
+                    'Name': child.attrib['tag'],
+                    'Type': PEOPLE_OF_INTEREST[tag],
+                    'Id': child.get('id'),
+                    'imageurl': child.get('thumb'),
+                    'Role': child.get('role')
+                })
+        self._children = {
+            'Collection': collections,
+            'Genre': genres,
+            'Country': countries,
+            'people': people,
+            'people_list': people_list
+        }
+        return self._children
+
+    def collection_list(self):
+        """
+        Returns a list of PMS collection tags or an empty list
+        """
+        return self.parse_children()['Collection']
 
     def people(self):
         """
@@ -300,29 +384,7 @@ class API(object):
             'Producer': list
         }
         """
-        director = []
-        writer = []
-        cast = []
-        producer = []
-        for child in self.item:
-            try:
-                if child.tag == 'Director':
-                    director.append(child.attrib['tag'])
-                elif child.tag == 'Writer':
-                    writer.append(child.attrib['tag'])
-                elif child.tag == 'Role':
-                    cast.append(child.attrib['tag'])
-                elif child.tag == 'Producer':
-                    producer.append(child.attrib['tag'])
-            except KeyError:
-                LOG.warn('Malformed PMS answer for getPeople: %s: %s',
-                         child.tag, child.attrib)
-        return {
-            'Director': director,
-            'Writer': writer,
-            'Cast': cast,
-            'Producer': producer
-        }
+        return self.parse_children()['people']
 
     def people_list(self):
         """
@@ -335,27 +397,13 @@ class API(object):
             ('Role': xxx for cast/actors only, None if not found)
         }
         """
-        people = []
-        for child in self.item:
-            if child.tag in PEOPLE_OF_INTEREST:
-                people.append({
-                    'Name': child.attrib['tag'],
-                    'Type': PEOPLE_OF_INTEREST[child.tag],
-                    'Id': child.attrib['id'],
-                    'imageurl': child.get('thumb'),
-                    'Role': child.get('role')
-                })
-        return people
+        return self.parse_children()['people_list']
 
     def genre_list(self):
         """
         Returns a list of genres found. (Not a string)
         """
-        genre = []
-        for child in self.item:
-            if child.tag == 'Genre':
-                genre.append(child.attrib['tag'])
-        return genre
+        return self.parse_children()['Genre']
 
     def guid_html_escaped(self):
         """
@@ -447,6 +495,7 @@ class API(object):
             resume = 0.0
         return int(resume * v.PLEX_TO_KODI_TIMEFACTOR)
 
+    @memoize
     def resume_runtime(self):
         """
         Resume point of time and runtime/totaltime in rounded to seconds.
@@ -487,11 +536,7 @@ class API(object):
         """
         Returns a list of all countries found in item.
         """
-        country = []
-        for child in self.item:
-            if child.tag == 'Country':
-                country.append(child.attrib['tag'])
-        return country
+        return self.parse_children()['Country']
 
     def premiere_date(self):
         """
@@ -576,12 +621,14 @@ class API(object):
 
         url may or may not already contain a '?'
         """
-        if window('pms_token') == '':
+        token = (state.PMS_TOKEN if state.PMS_TOKEN is not None
+                 else window('pms_token'))
+        if not token:
             return url
         if '?' not in url:
-            url = "%s?X-Plex-Token=%s" % (url, window('pms_token'))
+            url = "%s?X-Plex-Token=%s" % (url, token)
         else:
-            url = "%s&X-Plex-Token=%s" % (url, window('pms_token'))
+            url = "%s&X-Plex-Token=%s" % (url, token)
         return url
 
     def item_id(self):
@@ -655,9 +702,10 @@ class API(object):
                     continue
                 return extra.get('ratingKey')
 
+    @memoize
     def mediastreams(self):
         """
-        Returns the media streams for metadata purposes
+        Returns the media streams for metadata purposes. Don't modify them!
 
         Output: each track contains a dictionaries
         {
@@ -671,6 +719,7 @@ class API(object):
         videotracks = []
         audiotracks = []
         subtitlelanguages = []
+        _, runtime = self.resume_runtime()
         try:
             # Sometimes, aspectratio is on the "toplevel"
             aspect = self.item[0].get('aspectRatio')
@@ -705,7 +754,7 @@ class API(object):
                     track['width'] = stream.get('width')
                     # track['Video3DFormat'] = item.get('Video3DFormat')
                     track['aspect'] = stream.get('aspectRatio', aspect)
-                    track['duration'] = self.resume_runtime()[1]
+                    track['duration'] = runtime
                     track['video3DFormat'] = None
                     videotracks.append(track)
                 elif media_type == 2:  # Audio streams
@@ -756,7 +805,14 @@ class API(object):
             'Disc'
             'Backdrop' : LIST with the first entry xml key "art"
         }
+        A new dict is returned every time, so feel free to modify it
         """
+        allartworks = dict(self._artwork(parent_info))
+        allartworks['Backdrop'] = list(allartworks['Backdrop'])
+        return allartworks
+
+    @memoize
+    def _artwork(self, parent_info):
         allartworks = {
             'Primary': self._one_artwork('thumb'),
             'Art': "",
@@ -1512,6 +1568,7 @@ class API(object):
                 # Validate the path is correct with user intervention
                 if self.ask_to_validate(path):
                     state.STOP_SYNC = True
+                    wake_up_threads()
                     path = None
                 state.PATH_VERIFIED = True
             else:
@@ -5,8 +5,11 @@ from ast import literal_eval
 from urlparse import urlparse, parse_qsl
 from re import compile as re_compile
 from copy import deepcopy
+from StringIO import StringIO
 from time import time
 from threading import Thread
+from Queue import Queue, Empty
+import xml.etree.ElementTree as etree
 
 from xbmc import sleep
 
@@ -19,8 +22,22 @@ import plex_tv
 LOG = getLogger("PLEX." + __name__)
 
 CONTAINERSIZE = int(settings('limitindex'))
+# Number of chunks of CONTAINERSIZE items to download from the PMS in parallel
+CHUNK_THREADS = int(settings('chunkDownloadThreads'))
 REGEX_PLEX_KEY = re_compile(r'''/(.+)/(\d+)$''')
 
+# Query parameters for GetPlexMetadata() - only ask the PMS for the elements
+# the caller actually needs. Reviews are never used
+METADATA_PROFILES = {
+    # Playback, Plex Companion and anything else
+    'playback': {'checkFiles': 0, 'includeExtras': 1, 'includeRelated': 0},
+    # Library sync, additional fanart, timestamps etc. - the item without any
+    # optional elements. Only movies need the extras to find their trailer
+    'sync': {'checkFiles': 0, 'includeRelated': 0},
+    'sync_trailers': {'checkFiles': 0, 'includeExtras': 1,
+                      'includeRelated': 0}
+}
+
 # For discovery of PMS in the local LAN
 PLEX_GDM_IP = '239.0.0.250'  # multicast to PMS
 PLEX_GDM_PORT = 32414
@@ -29,6 +46,13 @@ PLEX_GDM_MSG = 'M-SEARCH * HTTP/1.0'
 ###############################################################################
 
 
+class DownloadChunksError(Exception):
+    """
+    Raised by stream_chunks() if the PMS items could not be downloaded
+    """
+    pass
+
+
 def ConvertPlexToKodiTime(plexTime):
     """
     Converts Plextime to Koditime. Returns an int (in seconds).
@@ -335,7 +359,6 @@ def _pms_list_from_plex_tv(token):
         LOG.error('Could not get list of PMS from plex.tv')
         return
 
-    from Queue import Queue
     queue = Queue()
     thread_queue = []
 
@@ -454,13 +477,16 @@ def _poke_pms(pms, queue):
              url, pms['uuid'], xml.get('machineIdentifier'))
 
 
-def GetPlexMetadata(key):
+def GetPlexMetadata(key, profile='playback'):
     """
     Returns raw API metadata for key as an etree XML.
 
     Can be called with either Plex key '/library/metadata/xxxx'metadata
     OR with the digits 'xxxx' only.
 
+    profile: key of METADATA_PROFILES, e.g. 'sync'. Determines what
+             elements the PMS includes, e.g. Extras for trailers
+
     Returns None or 401 if something went wrong
     """
     key = str(key)
@@ -468,18 +494,7 @@ def GetPlexMetadata(key):
         url = "{server}" + key
     else:
         url = "{server}/library/metadata/" + key
-    arguments = {
-        'checkFiles': 0,
-        'includeExtras': 1,         # Trailers and Extras => Extras
-        'includeReviews': 1,
-        'includeRelated': 0,        # Similar movies => Video -> Related
-        # 'includeRelatedCount': 0,
-        # 'includeOnDeck': 1,
-        # 'includeChapters': 1,
-        # 'includePopularLeaves': 1,
-        # 'includeConcerts': 1
-    }
-    url = url + '?' + urlencode(arguments)
+    url = url + '?' + urlencode(METADATA_PROFILES[profile])
     xml = DU().downloadUrl(url)
     if xml == 401:
         # Either unauthorized (taken care of by doUtils) or PMS under strain
@@ -494,6 +509,73 @@ def GetPlexMetadata(key):
     return xml
 
 
+def get_metadata_batch(plex_ids, profile='sync'):
+    """
+    Downloads the metadata for all Plex ratingKeys in the list plex_ids with
+    ONE single PMS request, see GetPlexMetadata (also for profile)
+
+    Returns a dict {plex_id: xml} where xml is an etree MediaContainer (with
+    the original attributes) holding only the one element for plex_id.
+    plex_ids that the PMS did not return are missing in the dict. Returns
+    None or 401 if something went wrong
+    """
+    xml = GetPlexMetadata(','.join(plex_ids), profile)
+    if xml is None or xml == 401:
+        return xml
+    answ = {}
+    for child in xml:
+        container = etree.Element(xml.tag, xml.attrib)
+        container.append(child)
+        answ[child.get('ratingKey')] = container
+    return answ
+
+
+def trim_metadata(xml):
+    """
+    Removes the subtrees of the PMS items in the etree xml that library sync
+    does not need, in order to save memory: reviews, related items and all
+    extras except for the first trailer (of which only the attributes are
+    kept). Returns xml
+    """
+    for item in xml:
+        for child in list(item):
+            if child.tag in ('Review', 'Related'):
+                item.remove(child)
+            elif child.tag == 'Extras':
+                trailer = None
+                for extra in child:
+                    try:
+                        typus = int(extra.attrib['extraType'])
+                    except (KeyError, ValueError):
+                        continue
+                    if typus == 1:
+                        trailer = extra
+                        break
+                for extra in list(child):
+                    child.remove(extra)
+                if trailer is not None:
+                    for element in list(trailer):
+                        trailer.remove(element)
+                    child.append(trailer)
+    return xml
+
+
+def xml_size(xml):
+    """
+    Returns a rough estimate of the memory in bytes an etree xml takes up,
+    based on its number of elements and the length of their attributes.
+    Includes what PlexAPI.API caches for the item later on
+    """
+    size = 0
+    for element in xml.iter():
+        # Overhead of an element and its attrib dict
+        size += 300
+        for key, value in element.attrib.iteritems():
+            # Overhead of the dict entry and of both strings
+            size += 120 + len(key) + len(value)
+    return size
+
+
 def GetAllPlexChildren(key):
     """
     Returns a list (raw xml API dump) of all Plex children for the key.
@@ -505,25 +587,127 @@ def GetAllPlexChildren(key):
     return DownloadChunks("{server}/library/metadata/%s/children?" % key)
 
 
-def GetPlexSectionResults(viewId, args=None):
+def GetPlexSectionResults(viewId, args=None, updatedAt=None, stream=False):
     """
     Returns a list (XML API dump) of all Plex items in the Plex
     section with key = viewId.
 
     Input:
         args:       optional dict to be urlencoded
+        updatedAt:  Unix timestamp; only retrieves PMS items updated (or
+                    added) by the PMS since that point of time until now.
+        stream:     if True, returns a generator yielding the PMS items one by
+                    one, see stream_chunks()
 
     Returns None if something went wrong
     """
     url = "{server}/library/sections/%s/all?" % viewId
     if args:
         url += urlencode(args) + '&'
+    if updatedAt:
+        url += 'updatedAt>=%s&' % updatedAt
+    if stream is True:
+        return stream_chunks(url)
     return DownloadChunks(url)
 
 
+def GetPlexSectionKeys(viewId, args=None):
+    """
+    Returns a set of the ratingKeys (as strings) of ALL Plex items in the Plex
+    section with key = viewId. Lightweight compared to GetPlexSectionResults
+    as the PMS is asked to only include the ratingKey attribute - use it to
+    detect deletions on the PMS.
+
+    Input:
+        args:       optional dict to be urlencoded, e.g. {'type': 3}
+
+    Returns None if something went wrong
+    """
+    arguments = {'includeFields': 'ratingKey'}
+    if args:
+        arguments.update(args)
+    try:
+        return set(item.get('ratingKey') for item in
+                   GetPlexSectionResults(viewId, args=arguments, stream=True)
+                   if item.get('ratingKey') is not None)
+    except DownloadChunksError:
+        LOG.error('Could not get the ratingKeys of section %s', viewId)
+        return None
+
+
+def _chunk_url(url, pos):
+    """
+    Returns the url for the chunk of CONTAINERSIZE PMS items starting at pos
+    """
+    return url + urlencode({
+        'X-Plex-Container-Size': CONTAINERSIZE,
+        'X-Plex-Container-Start': pos
+    })
+
+
+def _next_positions(pos, total_size):
+    """
+    Returns the list of chunk positions to download next, starting with pos.
+    As long as we don't know the PMS' totalSize, that's just the one chunk;
+    afterwards up to CHUNK_THREADS chunks that can be downloaded in parallel
+    """
+    if total_size is None:
+        return [pos]
+    return range(pos, total_size, CONTAINERSIZE)[:CHUNK_THREADS]
+
+
+def _download_chunks(url, positions, return_response=False):
+    """
+    Downloads the chunks of url starting at positions using at most
+    CHUNK_THREADS threads on the shared DownloadUtils session.
+
+    Returns a list of the answers of DownloadUtils().downloadUrl, in the same
+    order as positions
+    """
+    if len(positions) == 1:
+        return [DU().downloadUrl(_chunk_url(url, positions[0]),
+                                 return_response=return_response)]
+    answers = {}
+    queue = Queue()
+    for pos in positions:
+        queue.put(pos)
+
+    def download():
+        while True:
+            try:
+                pos = queue.get(block=False)
+            except Empty:
+                break
+            answers[pos] = DU().downloadUrl(_chunk_url(url, pos),
+                                            return_response=return_response)
+    threads = []
+    for _ in range(min(CHUNK_THREADS, len(positions))):
+        thread = Thread(target=download)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return [answers.get(pos) for pos in positions]
+
+
+def _total_size(container):
+    """
+    Returns the PMS' totalSize attribute of the xml container as an int or
+    None if we should keep downloading chunks one after another
+    """
+    if CHUNK_THREADS < 2:
+        return None
+    try:
+        return int(container.get('totalSize'))
+    except (TypeError, ValueError):
+        return None
+
+
 def DownloadChunks(url):
     """
-    Downloads PMS url in chunks of CONTAINERSIZE.
+    Downloads PMS url in chunks of CONTAINERSIZE. Once the first chunk told
+    us the PMS' totalSize, the remaining chunks are downloaded in parallel,
+    CHUNK_THREADS at a time.
 
     url MUST end with '?' (if no other url encoded args are present) or '&'
 
@@ -531,45 +715,116 @@ def DownloadChunks(url):
     """
     xml = None
     pos = 0
+    total_size = None
     error_counter = 0
     while error_counter < 10:
-        args = {
-            'X-Plex-Container-Size': CONTAINERSIZE,
-            'X-Plex-Container-Start': pos
-        }
-        xmlpart = DU().downloadUrl(url + urlencode(args))
-        # If something went wrong - skip in the hope that it works next time
-        try:
-            xmlpart.attrib
-        except AttributeError:
-            LOG.error('Error while downloading chunks: %s',
-                      url + urlencode(args))
-            pos += CONTAINERSIZE
-            error_counter += 1
-            continue
-
-        # Very first run: starting xml (to retain data in xml's root!)
-        if xml is None:
-            xml = deepcopy(xmlpart)
+        positions = _next_positions(pos, total_size)
+        if not positions:
+            break
+        pos = positions[-1] + CONTAINERSIZE
+        done = False
+        for chunk_pos, xmlpart in zip(
+                positions, _download_chunks(url, positions)):
+            # If something went wrong - skip in the hope that it works next
+            # time
+            try:
+                xmlpart.attrib
+            except AttributeError:
+                LOG.error('Error while downloading chunks: %s',
+                          _chunk_url(url, chunk_pos))
+                error_counter += 1
+                if error_counter == 10:
+                    break
+                continue
+            # Very first run: starting xml (to retain data in xml's root!)
+            if xml is None:
+                xml = deepcopy(xmlpart)
+                total_size = _total_size(xmlpart)
+            else:
+                # Build answer xml - containing the entire library
+                for child in xmlpart:
+                    xml.append(child)
+            # Done as soon as we don't receive a full complement of items
             if len(xmlpart) < CONTAINERSIZE:
+                done = True
                 break
-            else:
-                pos += CONTAINERSIZE
-                continue
-        # Build answer xml - containing the entire library
-        for child in xmlpart:
-            xml.append(child)
-        # Done as soon as we don't receive a full complement of items
-        if len(xmlpart) < CONTAINERSIZE:
+        if done:
             break
-        pos += CONTAINERSIZE
     if error_counter == 10:
         LOG.error('Fatal error while downloading chunks for %s', url)
         return None
     return xml
 
 
-def GetAllPlexLeaves(viewId, lastViewedAt=None, updatedAt=None):
+def stream_chunks(url):
+    """
+    Generator version of DownloadChunks: downloads PMS url in chunks of
+    CONTAINERSIZE, parses every chunk incrementally and yields the PMS items
+    (the children of the MediaContainer) one by one. An item is cleared as
+    soon as the next one is requested, hence memory use stays flat no matter
+    how big the PMS library is. Don't keep references to yielded items!
+    Once the PMS' totalSize is known, CHUNK_THREADS chunks are downloaded in
+    parallel ahead of parsing them.
+
+    url MUST end with '?' (if no other url encoded args are present) or '&'
+
+    Raises DownloadChunksError if the download failed.
+    """
+    pos = 0
+    total_size = None
+    error_counter = 0
+    while error_counter < 10:
+        positions = _next_positions(pos, total_size)
+        if not positions:
+            return
+        pos = positions[-1] + CONTAINERSIZE
+        for chunk_pos, response in zip(
+                positions,
+                _download_chunks(url, positions, return_response=True)):
+            try:
+                content = response.content
+            except AttributeError:
+                content = None
+            number = 0
+            if content is not None:
+                depth = 0
+                root = None
+                try:
+                    for event, elem in etree.iterparse(
+                            StringIO(content), events=('start', 'end')):
+                        if event == 'start':
+                            if root is None:
+                                root = elem
+                                if total_size is None:
+                                    total_size = _total_size(root)
+                            depth += 1
+                            continue
+                        depth -= 1
+                        if depth == 1:
+                            number += 1
+                            yield elem
+                            # Done with this item, free the memory
+                            root.clear()
+                except etree.ParseError:
+                    content = None
+            # If something went wrong - skip in the hope that it works next
+            # time
+            if content is None:
+                LOG.error('Error while downloading chunks: %s',
+                          _chunk_url(url, chunk_pos))
+                error_counter += 1
+                if error_counter == 10:
+                    break
+                continue
+            # Done as soon as we don't receive a full complement of items
+            if number < CONTAINERSIZE:
+                return
+    LOG.error('Fatal error while downloading chunks for %s', url)
+    raise DownloadChunksError('Could not download %s' % url)
+
+
+def GetAllPlexLeaves(viewId, lastViewedAt=None, updatedAt=None,
+                     stream=False):
     """
     Returns a list (raw XML API dump) of all Plex subitems for the key.
     (e.g. /library/sections/2/allLeaves pointing to all TV shows)
@@ -585,6 +840,9 @@ def GetAllPlexLeaves(viewId, lastViewedAt=None, updatedAt=None):
 
     Warning: lastViewedAt and updatedAt are combined with AND by the PMS!
 
+    stream=True returns a generator yielding the PMS items one by one, see
+    stream_chunks()
+
     Relevant "master time": PMS server. I guess this COULD lead to problems,
     e.g. when server and client are in different time zones.
     """
@@ -599,6 +857,8 @@ def GetAllPlexLeaves(viewId, lastViewedAt=None, updatedAt=None):
         url += '?' + '&'.join(args) + '&'
     else:
         url += '?'
+    if stream is True:
+        return stream_chunks(url)
     return DownloadChunks(url)
 
 
@@ -2,7 +2,7 @@
 
 ###############################################################################
 from logging import getLogger
-from Queue import Queue, Empty
+from Queue import Queue
 from shutil import rmtree
 from urllib import quote_plus, unquote
 from threading import Thread
@@ -55,6 +55,10 @@ class Image_Cache_Thread(Thread):
         queue = self.queue
         sleep_between = self.sleep_between
         while not stopped():
+            # Blocks until there is an url in the queue
+            url = self.get_item(queue)
+            if url is None:
+                continue
             # In the event the server goes offline
             while suspended():
                 # Set in service.py
@@ -63,11 +67,6 @@ class Image_Cache_Thread(Thread):
                     LOG.info("---===### Stopped Image_Cache_Thread ###===---")
                     return
                 sleep(1000)
-            try:
-                url = queue.get(block=False)
-            except Empty:
-                sleep(1000)
-                continue
             sleeptime = 0
             while True:
                 try:
@@ -5,7 +5,7 @@ from threading import Thread
 
 from xbmc import sleep
 
-from utils import window, thread_methods
+from utils import window, thread_methods, wake_up_threads
 import state
 
 ###############################################################################
@@ -33,10 +33,13 @@ class Monitor_Window(Thread):
                     queue.put(value.replace('PLAY-', ''))
                 elif value == 'SUSPEND_LIBRARY_THREAD-True':
                     state.SUSPEND_LIBRARY_THREAD = True
+                    wake_up_threads()
                 elif value == 'SUSPEND_LIBRARY_THREAD-False':
                     state.SUSPEND_LIBRARY_THREAD = False
+                    wake_up_threads()
                 elif value == 'STOP_SYNC-True':
                     state.STOP_SYNC = True
+                    wake_up_threads()
                 elif value == 'STOP_SYNC-False':
                     state.STOP_SYNC = False
                 elif value == 'PMS_STATUS-Auth':
@@ -49,11 +52,15 @@ class Monitor_Window(Thread):
                     state.SUSPEND_USER_CLIENT = False
                 elif value.startswith('PLEX_TOKEN-'):
                     state.PLEX_TOKEN = value.replace('PLEX_TOKEN-', '') or None
+                    # E.g. the Alexa websocket waits for a token
+                    wake_up_threads()
                 elif value.startswith('PLEX_USERNAME-'):
                     state.PLEX_USERNAME = \
                         value.replace('PLEX_USERNAME-', '') or None
                 elif value.startswith('RUN_LIB_SCAN-'):
                     state.RUN_LIB_SCAN = value.replace('RUN_LIB_SCAN-', '')
+                    # Let the library sync thread start the scan right away
+                    wake_up_threads()
                 elif value.startswith('CONTEXT_menu?'):
                     queue.put('dummy?mode=context_menu&%s'
                               % value.replace('CONTEXT_menu?', ''))
@@ -2,6 +2,7 @@
 
 ###############################################################################
 from logging import getLogger
+from threading import Lock
 import xml.etree.ElementTree as etree
 import requests
 
@@ -18,9 +19,24 @@ requests.packages.urllib3.disable_warnings()
 
 LOG = getLogger("PLEX." + __name__)
 
+# Number of HTTP requests made and bytes received so far, e.g. to measure a
+# sync
+REQUEST_COUNT = 0
+BYTE_COUNT = 0
+COUNT_LOCK = Lock()
+
 ###############################################################################
 
 
+def transfer_stats():
+    """
+    Returns the tuple (number of HTTP requests, bytes received) for all
+    downloads of DownloadUtils since startup
+    """
+    with COUNT_LOCK:
+        return REQUEST_COUNT, BYTE_COUNT
+
+
 class DownloadUtils():
     """
     Manages any up/downloads with PKC. Careful to initiate correctly
@@ -116,6 +132,9 @@ class DownloadUtils():
         return header
 
     def _doDownload(self, s, action_type, **kwargs):
+        global REQUEST_COUNT, BYTE_COUNT
+        with COUNT_LOCK:
+            REQUEST_COUNT += 1
         if action_type == "GET":
             r = s.get(**kwargs)
         elif action_type == "POST":
@@ -126,6 +145,9 @@ class DownloadUtils():
             r = s.options(**kwargs)
         elif action_type == "PUT":
             r = s.put(**kwargs)
+        received = len(r.content)
+        with COUNT_LOCK:
+            BYTE_COUNT += received
         return r
 
     def downloadUrl(self, url, action_type="GET", postBody=None,
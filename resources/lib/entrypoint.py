@@ -437,7 +437,7 @@ def getVideoFiles(plexId, params):
         log.info('No Plex ID found, abort getting Extras')
         return xbmcplugin.endOfDirectory(HANDLE)
 
-    item = GetPlexMetadata(plexId)
+    item = GetPlexMetadata(plexId, 'sync')
     try:
         path = item[0][0][0].attrib['file']
     except:
@@ -495,7 +495,7 @@ def getExtraFanArt(plexid, plexPath):
     if not exists_dir(fanartDir):
         # Download the images to the cache directory
         makedirs(fanartDir)
-        xml = GetPlexMetadata(plexid)
+        xml = GetPlexMetadata(plexid, 'sync')
         if xml is None:
             log.error('Could not download metadata for %s' % plexid)
             return xbmcplugin.endOfDirectory(HANDLE)
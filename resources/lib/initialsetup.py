@@ -34,7 +34,8 @@ WINDOW_PROPERTIES = (
     "pms_server", "plex_machineIdentifier", "plex_servername",
     "plex_authenticated", "PlexUserImage", "useDirectPaths", "countError",
     "countUnauthorized", "plex_restricteduser", "plex_allows_mediaDeletion",
-    "plex_command", "plex_result", "plex_force_transcode_pix"
+    "plex_command", "plex_result", "plex_force_transcode_pix",
+    "plex_sync_telemetry"
 )
 
 
@@ -58,10 +59,13 @@ def reload_pkc():
         if settings('sslcert') != 'None' else None
     state.FULL_SYNC_INTERVALL = int(settings('fullSyncInterval')) * 60
     state.SYNC_THREAD_NUMBER = int(settings('syncThreadNumber'))
+    state.SYNC_METADATA_BATCH_SIZE = int(settings('syncMetadataBatchSize'))
     state.SYNC_DIALOG = settings('dbSyncIndicator') == 'true'
+    state.SYNC_TELEMETRY_FILE = settings('syncTelemetryFile') == 'true'
     state.ENABLE_MUSIC = settings('enableMusic') == 'true'
     state.BACKGROUND_SYNC = settings(
         'enableBackgroundSync') == 'true'
+    state.DELTA_SYNC = settings('deltaSync') == 'true'
     state.BACKGROUNDSYNC_SAFTYMARGIN = int(
         settings('backgroundsync_saftyMargin'))
     state.REPLACE_SMB_PATH = settings('replaceSMB') == 'true'
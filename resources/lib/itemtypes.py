@@ -4,9 +4,10 @@ from logging import getLogger
 from urllib import urlencode
 from ntpath import dirname
 from datetime import datetime
+from time import time
 
 from artwork import Artwork
-from utils import window, kodi_sql, catch_exceptions
+from utils import window, kodi_sql, catch_exceptions, BufferedCursor
 import plexdb_functions as plexdb
 import kodidb_functions as kodidb
 
@@ -28,25 +29,35 @@ class Items(object):
 
     Input:
         kodiType:       optional argument; e.g. 'video' or 'music'
+
+    All add_update methods optionally accept api=PlexAPI.API(item), e.g. an
+    instance already prepared by library_sync's parser threads
+
+    DB writes are buffered (see utils.BufferedCursor) and committed on exit.
+    Call item_done() after every item to write the item's buffered changes
+    and to commit every state.DB_COMMIT_INTERVAL items instead
     """
     def __init__(self):
         self.artwork = Artwork()
-        self.server = window('pms_server')
+        self.server = state.PMS_SERVER or window('pms_server')
         self.plexconn = None
         self.plexcursor = None
         self.kodiconn = None
         self.kodicursor = None
         self.plex_db = None
         self.kodi_db = None
+        self.uncommitted = 0
+        # Seconds spent committing to the DBs
+        self.commit_time = 0.0
 
     def __enter__(self):
         """
         Open DB connections and cursors
         """
         self.plexconn = kodi_sql('plex')
-        self.plexcursor = self.plexconn.cursor()
+        self.plexcursor = BufferedCursor(self.plexconn.cursor())
         self.kodiconn = kodi_sql('video')
-        self.kodicursor = self.kodiconn.cursor()
+        self.kodicursor = BufferedCursor(self.kodiconn.cursor())
         self.plex_db = plexdb.Plex_DB_Functions(self.plexcursor)
         self.kodi_db = kodidb.Kodidb_Functions(self.kodicursor)
         return self
@@ -55,12 +66,89 @@ class Items(object):
         """
         Make sure DB changes are committed and connection to DB is closed.
         """
-        self.plexconn.commit()
-        self.kodiconn.commit()
-        self.plexconn.close()
-        self.kodiconn.close()
+        try:
+            self.commit()
+        finally:
+            self.plexconn.close()
+            self.kodiconn.close()
         return self
 
+    def commit(self):
+        """
+        Writes all buffered changes to the DBs and commits them. Rolls back
+        if that fails
+        """
+        try:
+            self.plexcursor.flush()
+            self.kodicursor.flush()
+            started = time()
+            self.plexconn.commit()
+            self.kodiconn.commit()
+            self.commit_time += time() - started
+        except Exception:
+            self.rollback()
+            raise
+        self.kodi_db.after_commit()
+        self.uncommitted = 0
+
+    def rollback(self):
+        """
+        Discards all DB changes since the last commit
+        """
+        self.plexcursor.discard()
+        self.kodicursor.discard()
+        self.plexconn.rollback()
+        self.kodiconn.rollback()
+        self.kodi_db.after_rollback()
+        self.uncommitted = 0
+
+    @property
+    def statements(self):
+        """
+        Number of SQL statements issued so far against both DBs
+        """
+        return self.plexcursor.statements + self.kodicursor.statements
+
+    @property
+    def sql_time(self):
+        """
+        Seconds spent in SQLite so far, including commits
+        """
+        return (self.plexcursor.sql_time + self.kodicursor.sql_time +
+                self.commit_time)
+
+    def flush(self):
+        """
+        Executes the buffered writes of the current item. Raises the SQL error
+        if one of them fails - also if one failed earlier on and the item's
+        method swallowed the error. The item's remaining writes are discarded
+        then, as if the item had crashed half-way, and the lookup caches
+        forget the names that the item failed to add to the Kodi DB
+        """
+        try:
+            self.plexcursor.flush()
+            self.kodicursor.flush()
+            self.plexcursor.raise_error()
+            self.kodicursor.raise_error()
+        except Exception:
+            self.plexcursor.discard()
+            self.kodicursor.discard()
+            self.kodi_db.after_item_failed()
+            raise
+        self.kodi_db.after_item()
+
+    def item_done(self):
+        """
+        Call after every processed item. Writes the item's changes and commits
+        the DB changes every state.DB_COMMIT_INTERVAL items so that
+        transactions stay small. Raises the SQL error if the item's writes
+        fail
+        """
+        self.flush()
+        self.uncommitted += 1
+        if self.uncommitted >= state.DB_COMMIT_INTERVAL:
+            self.commit()
+
     @catch_exceptions(warnuser=True)
     def getfanart(self, plex_id, refresh=False):
         """
@@ -93,7 +181,7 @@ class Items(object):
                 LOG.debug('Already got all fanart for Plex id %s', plex_id)
                 return True
 
-        xml = GetPlexMetadata(plex_id)
+        xml = GetPlexMetadata(plex_id, 'sync')
         if xml is None:
             # Did not receive a valid XML - skip that item for now
             LOG.error("Could not get metadata for %s. Skipping that item "
@@ -180,14 +268,14 @@ class Movies(Items):
     Used for plex library-type movies
     """
     @catch_exceptions(warnuser=True)
-    def add_update(self, item, viewtag=None, viewid=None):
+    def add_update(self, item, viewtag=None, viewid=None, api=None):
         """
         Process single movie
         """
         kodicursor = self.kodicursor
         plex_db = self.plex_db
         artwork = self.artwork
-        api = API(item)
+        api = api or API(item)
 
         # If the item already exist in the local Kodi DB we'll perform a full
         # item update
@@ -207,8 +295,7 @@ class Movies(Items):
         except TypeError:
             # movieid
             update_item = False
-            kodicursor.execute("select coalesce(max(idMovie),0) from movie")
-            movieid = kodicursor.fetchone()[0] + 1
+            movieid = self.kodi_db.new_id('movie', 'idMovie')
 
         else:
             # Verification the item is still in Kodi
@@ -507,14 +594,14 @@ class TVShows(Items):
     For Plex library-type TV shows
     """
     @catch_exceptions(warnuser=True)
-    def add_update(self, item, viewtag=None, viewid=None):
+    def add_update(self, item, viewtag=None, viewid=None, api=None):
         """
         Process a single show
         """
         kodicursor = self.kodicursor
         plex_db = self.plex_db
         artwork = self.artwork
-        api = API(item)
+        api = api or API(item)
 
         update_item = True
         itemid = api.plex_id()
@@ -529,8 +616,7 @@ class TVShows(Items):
             pathid = plex_dbitem[2]
         except TypeError:
             update_item = False
-            kodicursor.execute("select coalesce(max(idShow),0) from tvshow")
-            showid = kodicursor.fetchone()[0] + 1
+            showid = self.kodi_db.new_id('tvshow', 'idShow')
 
         else:
             # Verification the item is still in Kodi
@@ -740,11 +826,11 @@ class TVShows(Items):
         self.kodi_db.addTags(showid, tags, "tvshow")
 
     @catch_exceptions(warnuser=True)
-    def add_updateSeason(self, item, viewtag=None, viewid=None):
+    def add_updateSeason(self, item, viewtag=None, viewid=None, api=None):
         """
         Process a single season of a certain tv show
         """
-        api = API(item)
+        api = api or API(item)
         plex_id = api.plex_id()
         if not plex_id:
             LOG.error('Error getting plex_id for season, skipping')
@@ -788,14 +874,14 @@ class TVShows(Items):
                                  checksum=checksum)
 
     @catch_exceptions(warnuser=True)
-    def add_updateEpisode(self, item, viewtag=None, viewid=None):
+    def add_updateEpisode(self, item, viewtag=None, viewid=None, api=None):
         """
         Process single episode
         """
         kodicursor = self.kodicursor
         plex_db = self.plex_db
         artwork = self.artwork
-        api = API(item)
+        api = api or API(item)
 
         # If the item already exist in the local Kodi DB we'll perform a full
         # item update
@@ -813,8 +899,7 @@ class TVShows(Items):
         except TypeError:
             update_item = False
             # episodeid
-            kodicursor.execute("select coalesce(max(idEpisode),0) from episode")
-            episodeid = kodicursor.fetchone()[0] + 1
+            episodeid = self.kodi_db.new_id('episode', 'idEpisode')
         else:
             # Verification the item is still in Kodi
             query = "SELECT * FROM episode WHERE idEpisode = ?"
@@ -1245,23 +1330,23 @@ class Music(Items):
         Open DB connections and cursors
         """
         self.plexconn = kodi_sql('plex')
-        self.plexcursor = self.plexconn.cursor()
+        self.plexcursor = BufferedCursor(self.plexconn.cursor())
         # Here it is, not 'video' but 'music'
         self.kodiconn = kodi_sql('music')
-        self.kodicursor = self.kodiconn.cursor()
+        self.kodicursor = BufferedCursor(self.kodiconn.cursor())
         self.plex_db = plexdb.Plex_DB_Functions(self.plexcursor)
         self.kodi_db = kodidb.Kodidb_Functions(self.kodicursor)
         return self
 
     @catch_exceptions(warnuser=True)
-    def add_updateArtist(self, item, viewtag=None, viewid=None):
+    def add_updateArtist(self, item, viewtag=None, viewid=None, api=None):
         """
         Adds a single artist
         """
         kodicursor = self.kodicursor
         plex_db = self.plex_db
         artwork = self.artwork
-        api = API(item)
+        api = api or API(item)
 
         update_item = True
         itemid = api.plex_id()
@@ -1341,7 +1426,7 @@ class Music(Items):
 
     @catch_exceptions(warnuser=True)
     def add_updateAlbum(self, item, viewtag=None, viewid=None, children=None,
-                        scan_children=True):
+                        scan_children=True, api=None):
         """
         Adds a single music album
             children: list of child xml's, so in this case songs
@@ -1349,7 +1434,7 @@ class Music(Items):
         kodicursor = self.kodicursor
         plex_db = self.plex_db
         artwork = self.artwork
-        api = API(item)
+        api = api or API(item)
 
         update_item = True
         itemid = api.plex_id()
@@ -1477,7 +1562,7 @@ class Music(Items):
             except TypeError:
                 LOG.info('Artist %s does not exist in plex database',
                          parent_id)
-                artist = GetPlexMetadata(parent_id)
+                artist = GetPlexMetadata(parent_id, 'sync')
                 # Item may not be an artist, verification necessary.
                 if artist is not None and artist != 401:
                     if artist[0].attrib.get('type') == v.PLEX_TYPE_ARTIST:
@@ -1501,7 +1586,7 @@ class Music(Items):
         except TypeError:
             # Artist does not exist in plex database, create the reference
             LOG.info('Artist %s does not exist in Plex database', artist_id)
-            artist = GetPlexMetadata(artist_id)
+            artist = GetPlexMetadata(artist_id, 'sync')
             if artist is not None and artist != 401:
                 self.add_updateArtist(artist[0])
                 plex_dbartist = plex_db.getItem_byId(artist_id)
@@ -1537,14 +1622,14 @@ class Music(Items):
                 self.add_updateSong(child, viewtag, viewid)
 
     @catch_exceptions(warnuser=True)
-    def add_updateSong(self, item, viewtag=None, viewid=None):
+    def add_updateSong(self, item, viewtag=None, viewid=None, api=None):
         """
         Process single song
         """
         kodicursor = self.kodicursor
         plex_db = self.plex_db
         artwork = self.artwork
-        api = API(item)
+        api = api or API(item)
 
         update_item = True
         itemid = api.plex_id()
@@ -1559,8 +1644,7 @@ class Music(Items):
         except TypeError:
             # Songid not found
             update_item = False
-            kodicursor.execute("select coalesce(max(idSong),0) from song")
-            songid = kodicursor.fetchone()[0] + 1
+            songid = self.kodi_db.new_id('song', 'idSong')
 
         # The song details #####
         checksum = api.checksum()
@@ -1697,7 +1781,7 @@ class Music(Items):
                 # No album found. Let's create it
                 LOG.info("Album database entry missing.")
                 plex_album_id = item.attrib.get('parentRatingKey')
-                album = GetPlexMetadata(plex_album_id)
+                album = GetPlexMetadata(plex_album_id, 'sync')
                 if album is None or album == 401:
                     LOG.error('Could not download album, abort')
                     return
@@ -1711,9 +1795,7 @@ class Music(Items):
                 except TypeError:
                     # No album found, create a single's album
                     LOG.info("Failed to add album. Creating singles.")
-                    kodicursor.execute(
-                        "select coalesce(max(idAlbum),0) from album")
-                    albumid = kodicursor.fetchone()[0] + 1
+                    albumid = self.kodi_db.new_id('album', 'idAlbum')
                     if v.KODIVERSION >= 16:
                         # Kodi Jarvis
                         query = '''
@@ -1790,7 +1872,7 @@ class Music(Items):
                 artistid = artist_edb[0]
             except TypeError:
                 # Artist is missing from plex database, add it.
-                artist_xml = GetPlexMetadata(artist_eid)
+                artist_xml = GetPlexMetadata(artist_eid, 'sync')
                 if artist_xml is None or artist_xml == 401:
                     LOG.error('Error getting artist, abort')
                     return
@@ -3,6 +3,7 @@
 ###############################################################################
 from logging import getLogger
 from ntpath import dirname
+from threading import Lock
 
 import artwork
 from utils import kodi_sql, try_decode
@@ -12,6 +13,116 @@ import variables as v
 
 log = getLogger("PLEX."+__name__)
 
+# Kodi video DB tables with a name column that we look up on every item:
+# table: (id column, name comparison case insensitive?)
+LOOKUP_TABLES = {
+    'actor': ('actor_id', False),
+    'country': ('country_id', True),
+    'genre': ('genre_id', True),
+    'studio': ('studio_id', True),
+    'tag': ('tag_id', True)
+}
+# LOOKUP_TABLES that LookupCaches must not cache: Kodi's delete_tag trigger
+# deletes a tag as soon as its last tag_link is gone, e.g. when we replace an
+# item's tags. A cached tag_id would then point to a deleted tag
+UNCACHED_TABLES = ('tag',)
+
+###############################################################################
+
+
+def _nocase(name):
+    """
+    Folds name like SQLite's COLLATE NOCASE does - ASCII characters only
+    """
+    return ''.join(c.lower() if 'A' <= c <= 'Z' else c for c in name)
+
+
+class LookupCache(object):
+    """
+    name -> id cache for one of the Kodi video DB tables in LOOKUP_TABLES,
+    preloaded with the entire table
+    """
+    def __init__(self, table):
+        self.table = table
+        self.id_column, self.nocase = LOOKUP_TABLES[table]
+        self.ids = {}
+
+    def key(self, name):
+        return _nocase(name) if self.nocase else name
+
+    def preload(self, cursor):
+        query = 'SELECT %s, name FROM %s ORDER BY %s' % (
+            self.id_column, self.table, self.id_column)
+        cursor.execute(query)
+        for kodi_id, name in cursor.fetchall():
+            # Like SQL, return the first entry if several names match
+            self.ids.setdefault(self.key(name), kodi_id)
+        log.debug('Cached %s Kodi %s entries' % (len(self.ids), self.table))
+
+    def get(self, name, new_id):
+        """
+        Returns the tuple (id, new) with new=True if the name was not yet
+        known and the caller thus needs to INSERT it into the Kodi DB. The
+        id for a new name is obtained by calling new_id() - outside of the
+        lock, as it queries the Kodi DB. Should another thread have added the
+        same name in the meantime, its id wins and ours stays unused
+        """
+        key = self.key(name)
+        with LOOKUP_CACHES.lock:
+            try:
+                return self.ids[key], False
+            except KeyError:
+                pass
+        kodi_id = new_id()
+        with LOOKUP_CACHES.lock:
+            cached_id = self.ids.setdefault(key, kodi_id)
+        return cached_id, cached_id == kodi_id
+
+    def forget(self, name):
+        """
+        The entry for name never made it into the Kodi DB, e.g. on rollback
+        """
+        with LOOKUP_CACHES.lock:
+            self.ids.pop(self.key(name), None)
+
+
+class LookupCaches(object):
+    """
+    The LookupCaches for all LOOKUP_TABLES. Only active during a full sync,
+    because others - like Kodi itself - might change these tables as well
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.caches = {}
+
+    def enable(self):
+        """
+        Preloads all caches from the Kodi video DB
+        """
+        if v.KODIVERSION < 15:
+            # Kodi Helix uses other table layouts
+            return
+        caches = {}
+        with GetKodiDB('video') as kodi_db:
+            for table in LOOKUP_TABLES:
+                if table in UNCACHED_TABLES:
+                    continue
+                caches[table] = LookupCache(table)
+                caches[table].preload(kodi_db.cursor)
+        self.caches = caches
+
+    def disable(self):
+        self.caches = {}
+
+    def get(self, table):
+        """
+        Returns the LookupCache for table or None if caching is not active
+        """
+        return self.caches.get(table)
+
+
+LOOKUP_CACHES = LookupCaches()
+
 ###############################################################################
 
 
@@ -39,10 +150,150 @@ class GetKodiDB():
         self.kodiconn.close()
 
 
+class IdAllocator(object):
+    """
+    Hands out new ids (primary keys) for the tables of one Kodi DB connection,
+    instead of asking the DB for max(id) + 1 for every new row. Reads max(id)
+    only once per table and transaction. Before doing so, our transaction
+    grabs SQLite's write lock; nobody else, e.g. Kodi's own library scanner,
+    may thus insert rows and cause id conflicts until we commit.
+
+    Call reset() after every commit or rollback of the connection!
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+        # A BufferedCursor would delay our write lock statement
+        self.raw_cursor = getattr(cursor, 'cursor', cursor)
+        # {table: last id handed out in this transaction}
+        self.last_ids = {}
+        # {table: last id handed out in a previous transaction}
+        self.previous_ids = {}
+        self.locked = False
+
+    def reset(self):
+        """
+        Our transaction has ended; forget everything we know
+        """
+        self.previous_ids.update(self.last_ids)
+        self.last_ids = {}
+        self.locked = False
+
+    def next_id(self, table, id_column, floor=0):
+        """
+        Returns a new id for table's id_column, at least floor + 1
+        """
+        try:
+            self.last_ids[table] += 1
+        except KeyError:
+            if not self.locked:
+                # A write that changes nothing still starts a write
+                # transaction and thus acquires SQLite's RESERVED lock
+                self.raw_cursor.execute('UPDATE %s SET %s = %s WHERE 0'
+                                        % (table, id_column, id_column))
+                self.locked = True
+            self.cursor.execute('select coalesce(max(%s),%s) from %s'
+                                % (id_column, floor, table))
+            last_id = self.cursor.fetchone()[0]
+            if last_id > self.previous_ids.get(table, last_id):
+                log.debug('Someone else added %s entries between our '
+                          'transactions, continuing with id %s'
+                          % (table, last_id + 1))
+            self.last_ids[table] = last_id + 1
+        return self.last_ids[table]
+
+
 class Kodidb_Functions():
     def __init__(self, cursor):
         self.cursor = cursor
         self.artwork = artwork.Artwork()
+        self.id_allocator = IdAllocator(cursor)
+        # (LookupCache, name, id) that we added but did not yet commit
+        self.uncommitted_names = []
+        # Number of uncommitted_names added by the items before the current
+        self.item_start = 0
+
+    def after_commit(self):
+        """
+        Call after committing the DB connection of self.cursor
+        """
+        self.uncommitted_names = []
+        self.item_start = 0
+        self.id_allocator.reset()
+
+    def after_rollback(self):
+        """
+        Call after rolling back the DB connection of self.cursor. Removes the
+        entries we added to the LookupCaches in the meantime
+        """
+        for cache, name, _ in self.uncommitted_names:
+            cache.forget(name)
+        self.uncommitted_names = []
+        self.item_start = 0
+        self.id_allocator.reset()
+
+    def after_item(self):
+        """
+        Call once all writes of an item made it into the DB
+        """
+        self.item_start = len(self.uncommitted_names)
+
+    def after_item_failed(self):
+        """
+        Call if the writes of an item failed half-way and its remaining writes
+        were discarded. Removes the entries that the item added to the
+        LookupCaches but that never made it into the DB.
+
+        The ids that the item got from the IdAllocator remain used: the
+        transaction continues, and the item's rows that were written, e.g.
+        in the Plex DB, might refer to them
+        """
+        names = self.uncommitted_names[self.item_start:]
+        del self.uncommitted_names[self.item_start:]
+        for cache, name, kodi_id in names:
+            query = 'SELECT COUNT(*) FROM %s WHERE %s = ?' % (cache.table,
+                                                              cache.id_column)
+            self.cursor.execute(query, (kodi_id,))
+            if self.cursor.fetchone()[0]:
+                self.uncommitted_names.append((cache, name, kodi_id))
+            else:
+                cache.forget(name)
+        self.item_start = len(self.uncommitted_names)
+
+    def new_id(self, table, id_column, floor=0):
+        """
+        Returns a new id for a row in the Kodi DB table, e.g.
+        new_id('movie', 'idMovie'). Ids up to floor are reserved, even if the
+        table is empty
+        """
+        return self.id_allocator.next_id(table, id_column, floor)
+
+    def _get_id(self, table, name):
+        """
+        Returns the id for name from the Kodi video DB table (see
+        LOOKUP_TABLES), e.g. for a genre. Creates the entry if necessary.
+
+        Only use with Kodi Isengard and later
+        """
+        id_column, nocase = LOOKUP_TABLES[table]
+        cache = LOOKUP_CACHES.get(table)
+        if cache is not None:
+            kodi_id, new = cache.get(name,
+                                     lambda: self.new_id(table, id_column))
+            if not new:
+                return kodi_id
+            self.uncommitted_names.append((cache, name, kodi_id))
+        else:
+            query = 'SELECT %s FROM %s WHERE name = ?%s LIMIT 1' % (
+                id_column, table, ' COLLATE NOCASE' if nocase else '')
+            self.cursor.execute(query, (name,))
+            try:
+                return self.cursor.fetchone()[0]
+            except TypeError:
+                kodi_id = self.new_id(table, id_column)
+        query = 'INSERT INTO %s(%s, name) VALUES (?, ?)' % (table, id_column)
+        self.cursor.execute(query, (kodi_id, name))
+        log.debug('Added %s %s: %s' % (table, kodi_id, name))
+        return kodi_id
 
     def setup_path_table(self):
         """
@@ -55,8 +306,7 @@ class Kodidb_Functions():
         """
         path_id = self.getPath('plugin://%s.movies/' % v.ADDON_ID)
         if path_id is None:
-            self.cursor.execute("select coalesce(max(idPath),0) from path")
-            path_id = self.cursor.fetchone()[0] + 1
+            path_id = self.new_id('path', 'idPath')
             query = '''
                 INSERT INTO path(idPath,
                                  strPath,
@@ -75,8 +325,7 @@ class Kodidb_Functions():
         # And TV shows
         path_id = self.getPath('plugin://%s.tvshows/' % v.ADDON_ID)
         if path_id is None:
-            self.cursor.execute("select coalesce(max(idPath),0) from path")
-            path_id = self.cursor.fetchone()[0] + 1
+            path_id = self.new_id('path', 'idPath')
             query = '''
                 INSERT INTO path(idPath,
                                  strPath,
@@ -106,8 +355,7 @@ class Kodidb_Functions():
             parentpath = "%s/" % dirname(dirname(path))
         pathid = self.getPath(parentpath)
         if pathid is None:
-            self.cursor.execute("select coalesce(max(idPath),0) from path")
-            pathid = self.cursor.fetchone()[0] + 1
+            pathid = self.new_id('path', 'idPath')
             query = ' '.join((
                 "INSERT INTO path(idPath, strPath)",
                 "VALUES (?, ?)"
@@ -136,8 +384,7 @@ class Kodidb_Functions():
         try:
             pathid = self.cursor.fetchone()[0]
         except TypeError:
-            self.cursor.execute("select coalesce(max(idPath),0) from path")
-            pathid = self.cursor.fetchone()[0] + 1
+            pathid = self.new_id('path', 'idPath')
             if strHash is None:
                 query = (
                     '''
@@ -190,8 +437,7 @@ class Kodidb_Functions():
         try:
             fileid = self.cursor.fetchone()[0]
         except TypeError:
-            self.cursor.execute("select coalesce(max(idFile),0) from files")
-            fileid = self.cursor.fetchone()[0] + 1
+            fileid = self.new_id('files', 'idFile')
             query = (
                 '''
                 INSERT INTO files(
@@ -237,37 +483,17 @@ class Kodidb_Functions():
         if v.KODIVERSION > 14:
             # Kodi Isengard, Jarvis, Krypton
             for country in countries:
-                query = ' '.join((
-
-                    "SELECT country_id",
-                    "FROM country",
-                    "WHERE name = ?",
-                    "COLLATE NOCASE"
-                ))
-                self.cursor.execute(query, (country,))
-
-                try:
-                    country_id = self.cursor.fetchone()[0]
-
-                except TypeError:
-                    # Country entry does not exists
-                    self.cursor.execute("select coalesce(max(country_id),0) from country")
-                    country_id = self.cursor.fetchone()[0] + 1
-
-                    query = "INSERT INTO country(country_id, name) values(?, ?)"
-                    self.cursor.execute(query, (country_id, country))
-                    log.debug("Add country to media, processing: %s" % country)
-
-                finally: # Assign country to content
-                    query = (
-                        '''
-                        INSERT OR REPLACE INTO country_link(
-                            country_id, media_id, media_type)
-                        
-                        VALUES (?, ?, ?)
-                        '''
-                    )
-                    self.cursor.execute(query, (country_id, kodiid, mediatype))
+                country_id = self._get_id('country', country)
+                # Assign country to content
+                query = (
+                    '''
+                    INSERT OR REPLACE INTO country_link(
+                        country_id, media_id, media_type)
+                    
+                    VALUES (?, ?, ?)
+                    '''
+                )
+                self.cursor.execute(query, (country_id, kodiid, mediatype))
         else:
             # Kodi Helix
             for country in countries:
@@ -285,8 +511,7 @@ class Kodidb_Functions():
                 
                 except TypeError:
                     # Country entry does not exists
-                    self.cursor.execute("select coalesce(max(idCountry),0) from country")
-                    idCountry = self.cursor.fetchone()[0] + 1
+                    idCountry = self.new_id('country', 'idCountry')
 
                     query = "INSERT INTO country(idCountry, strCountry) values(?, ?)"
                     self.cursor.execute(query, (idCountry, country))
@@ -309,22 +534,7 @@ class Kodidb_Functions():
         """
         Crucial für sync speed!
         """
-        query = ' '.join((
-            "SELECT actor_id",
-            "FROM actor",
-            "WHERE name = ?",
-            "LIMIT 1"
-        ))
-        self.cursor.execute(query, (name,))
-        try:
-            actorid = self.cursor.fetchone()[0]
-        except TypeError:
-            # Cast entry does not exists
-            self.cursor.execute("select coalesce(max(actor_id),0) from actor")
-            actorid = self.cursor.fetchone()[0] + 1
-            query = "INSERT INTO actor(actor_id, name) VALUES (?, ?)"
-            self.cursor.execute(query, (actorid, name))
-        return actorid
+        return self._get_id('actor', name)
 
     def _addPerson(self, role, person_type, actorid, kodiid, mediatype,
                    castorder):
@@ -435,39 +645,17 @@ class Kodidb_Functions():
 
             # Add genres
             for genre in genres:
-                
-                query = ' '.join((
+                genre_id = self._get_id('genre', genre)
+                # Assign genre to item
+                query = (
+                    '''
+                    INSERT OR REPLACE INTO genre_link(
+                        genre_id, media_id, media_type)
 
-                    "SELECT genre_id",
-                    "FROM genre",
-                    "WHERE name = ?",
-                    "COLLATE NOCASE"
-                ))
-                self.cursor.execute(query, (genre,))
-                
-                try:
-                    genre_id = self.cursor.fetchone()[0]
-                
-                except TypeError:
-                    # Create genre in database
-                    self.cursor.execute("select coalesce(max(genre_id),0) from genre")
-                    genre_id = self.cursor.fetchone()[0] + 1
-                    
-                    query = "INSERT INTO genre(genre_id, name) values(?, ?)"
-                    self.cursor.execute(query, (genre_id, genre))
-                    log.debug("Add Genres to media, processing: %s" % genre)
-                
-                finally:
-                    # Assign genre to item
-                    query = (
-                        '''
-                        INSERT OR REPLACE INTO genre_link(
-                            genre_id, media_id, media_type)
-
-                        VALUES (?, ?, ?)
-                        '''
-                    )
-                    self.cursor.execute(query, (genre_id, kodiid, mediatype))
+                    VALUES (?, ?, ?)
+                    '''
+                )
+                self.cursor.execute(query, (genre_id, kodiid, mediatype))
         else:
             # Kodi Helix
             # Delete current genres for clean slate
@@ -495,8 +683,7 @@ class Kodidb_Functions():
                 
                 except TypeError:
                     # Create genre in database
-                    self.cursor.execute("select coalesce(max(idGenre),0) from genre")
-                    idGenre = self.cursor.fetchone()[0] + 1
+                    idGenre = self.new_id('genre', 'idGenre')
 
                     query = "INSERT INTO genre(idGenre, strGenre) values(?, ?)"
                     self.cursor.execute(query, (idGenre, genre))
@@ -539,35 +726,16 @@ class Kodidb_Functions():
         for studio in studios:
             if v.KODIVERSION > 14:
                 # Kodi Isengard, Jarvis, Krypton
-                query = ' '.join((
-
-                    "SELECT studio_id",
-                    "FROM studio",
-                    "WHERE name = ?",
-                    "COLLATE NOCASE"
-                ))
-                self.cursor.execute(query, (studio,))
-                try:
-                    studioid = self.cursor.fetchone()[0]
-                
-                except TypeError:
-                    # Studio does not exists.
-                    self.cursor.execute("select coalesce(max(studio_id),0) from studio")
-                    studioid = self.cursor.fetchone()[0] + 1
-
-                    query = "INSERT INTO studio(studio_id, name) values(?, ?)"
-                    self.cursor.execute(query, (studioid, studio))
-                    log.debug("Add Studios to media, processing: %s" % studio)
-
-                finally: # Assign studio to item
-                    query = (
-                        '''
-                        INSERT OR REPLACE INTO studio_link(
-                            studio_id, media_id, media_type)
-                        
-                        VALUES (?, ?, ?)
-                        ''')
-                    self.cursor.execute(query, (studioid, kodiid, mediatype))
+                studioid = self._get_id('studio', studio)
+                # Assign studio to item
+                query = (
+                    '''
+                    INSERT OR REPLACE INTO studio_link(
+                        studio_id, media_id, media_type)
+                    
+                    VALUES (?, ?, ?)
+                    ''')
+                self.cursor.execute(query, (studioid, kodiid, mediatype))
             else:
                 # Kodi Helix
                 query = ' '.join((
@@ -583,8 +751,7 @@ class Kodidb_Functions():
 
                 except TypeError:
                     # Studio does not exists.
-                    self.cursor.execute("select coalesce(max(idstudio),0) from studio")
-                    studioid = self.cursor.fetchone()[0] + 1
+                    studioid = self.new_id('studio', 'idstudio')
 
                     query = "INSERT INTO studio(idstudio, strstudio) values(?, ?)"
                     self.cursor.execute(query, (studioid, studio))
@@ -884,9 +1051,7 @@ class Kodidb_Functions():
         self.cursor.execute(query, (playcount, dateplayed, fileid))
         # Set the resume bookmark
         if resume_seconds:
-            self.cursor.execute(
-                'select coalesce(max(idBookmark),0) from bookmark')
-            bookmark_id = self.cursor.fetchone()[0] + 1
+            bookmark_id = self.new_id('bookmark', 'idBookmark')
             query = '''
             INSERT INTO bookmark(
                 idBookmark, idFile, timeInSeconds, totalTimeInSeconds,
@@ -931,33 +1096,17 @@ class Kodidb_Functions():
     def addTag(self, kodiid, tag, mediatype):
         if v.KODIVERSION > 14:
             # Kodi Isengard, Jarvis, Krypton
-            query = ' '.join((
-
-                "SELECT tag_id",
-                "FROM tag",
-                "WHERE name = ?",
-                "COLLATE NOCASE"
-            ))
-            self.cursor.execute(query, (tag,))
-            try:
-                tag_id = self.cursor.fetchone()[0]
-            
-            except TypeError:
-                # Create the tag, because it does not exist
-                tag_id = self.createTag(tag)
-                log.debug("Adding tag: %s" % tag)
-
-            finally:
-                # Assign tag to item
-                query = (
-                    '''
-                    INSERT OR REPLACE INTO tag_link(
-                        tag_id, media_id, media_type)
-                    
-                    VALUES (?, ?, ?)
-                    '''
-                )
-                self.cursor.execute(query, (tag_id, kodiid, mediatype))
+            tag_id = self._get_id('tag', tag)
+            # Assign tag to item
+            query = (
+                '''
+                INSERT OR REPLACE INTO tag_link(
+                    tag_id, media_id, media_type)
+                
+                VALUES (?, ?, ?)
+                '''
+            )
+            self.cursor.execute(query, (tag_id, kodiid, mediatype))
         else:
             # Kodi Helix
             query = ' '.join((
@@ -992,24 +1141,7 @@ class Kodidb_Functions():
         # This will create and return the tag_id
         if v.KODIVERSION > 14:
             # Kodi Isengard, Jarvis, Krypton
-            query = ' '.join((
-
-                "SELECT tag_id",
-                "FROM tag",
-                "WHERE name = ?",
-                "COLLATE NOCASE"
-            ))
-            self.cursor.execute(query, (name,))
-            try:
-                tag_id = self.cursor.fetchone()[0]
-            
-            except TypeError:
-                self.cursor.execute("select coalesce(max(tag_id),0) from tag")
-                tag_id = self.cursor.fetchone()[0] + 1
-
-                query = "INSERT INTO tag(tag_id, name) values(?, ?)"
-                self.cursor.execute(query, (tag_id, name))
-                log.debug("Create tag_id: %s name: %s" % (tag_id, name))
+            tag_id = self._get_id('tag', name)
         else:
             # Kodi Helix
             query = ' '.join((
@@ -1024,8 +1156,7 @@ class Kodidb_Functions():
                 tag_id = self.cursor.fetchone()[0]
 
             except TypeError:
-                self.cursor.execute("select coalesce(max(idTag),0) from tag")
-                tag_id = self.cursor.fetchone()[0] + 1
+                tag_id = self.new_id('tag', 'idTag')
 
                 query = "INSERT INTO tag(idTag, strTag) values(?, ?)"
                 self.cursor.execute(query, (tag_id, name))
@@ -1149,8 +1280,7 @@ class Kodidb_Functions():
             setid = self.cursor.fetchone()[0]
 
         except TypeError:
-            self.cursor.execute("select coalesce(max(idSet),0) from sets")
-            setid = self.cursor.fetchone()[0] + 1
+            setid = self.new_id('sets', 'idSet')
 
             query = "INSERT INTO sets(idSet, strSet) values(?, ?)"
             self.cursor.execute(query, (setid, boxsetname))
@@ -1190,8 +1320,7 @@ class Kodidb_Functions():
         try:
             seasonid = self.cursor.fetchone()[0]
         except TypeError:
-            self.cursor.execute("select coalesce(max(idSeason),0) from seasons")
-            seasonid = self.cursor.fetchone()[0] + 1
+            seasonid = self.new_id('seasons', 'idSeason')
             query = "INSERT INTO seasons(idSeason, idShow, season) values(?, ?, ?)"
             self.cursor.execute(query, (seasonid, showid, seasonnumber))
 
@@ -1226,13 +1355,10 @@ class Kodidb_Functions():
             except TypeError:
                 # Krypton has a dummy first entry idArtist: 1  strArtist:
                 # [Missing Tag] strMusicBrainzArtistID: Artist Tag Missing
-                if v.KODIVERSION >= 17:
-                    self.cursor.execute(
-                        "select coalesce(max(idArtist),1) from artist")
-                else:
-                    self.cursor.execute(
-                        "select coalesce(max(idArtist),0) from artist")
-                artistid = self.cursor.fetchone()[0] + 1
+                # Hence new ids will always be 2 and higher
+                artistid = self.new_id('artist',
+                                       'idArtist',
+                                       floor=1 if v.KODIVERSION >= 17 else 0)
                 query = (
                     '''
                     INSERT INTO artist(idArtist, strArtist, strMusicBrainzArtistID)
@@ -1261,8 +1387,7 @@ class Kodidb_Functions():
             albumid = self.cursor.fetchone()[0]
         except TypeError:
             # Create the album
-            self.cursor.execute("select coalesce(max(idAlbum),0) from album")
-            albumid = self.cursor.fetchone()[0] + 1
+            albumid = self.new_id('album', 'idAlbum')
             if v.KODIVERSION > 14:
                 query = (
                     '''
@@ -1309,8 +1434,7 @@ class Kodidb_Functions():
                     genreid = self.cursor.fetchone()[0]
                 except TypeError:
                     # Create the genre
-                    self.cursor.execute("select coalesce(max(idGenre),0) from genre")
-                    genreid = self.cursor.fetchone()[0] + 1
+                    genreid = self.new_id('genre', 'idGenre')
                     query = "INSERT INTO genre(idGenre, strGenre) values(?, ?)"
                     self.cursor.execute(query, (genreid, genre))
 
@@ -1340,8 +1464,7 @@ class Kodidb_Functions():
                     genreid = self.cursor.fetchone()[0]
                 except TypeError:
                     # Create the genre
-                    self.cursor.execute("select coalesce(max(idGenre),0) from genre")
-                    genreid = self.cursor.fetchone()[0] + 1
+                    genreid = self.new_id('genre', 'idGenre')
                     query = "INSERT INTO genre(idGenre, strGenre) values(?, ?)"
                     self.cursor.execute(query, (genreid, genre))
 
@@ -1364,9 +1487,7 @@ class Kodidb_Functions():
         self.cursor.execute(query, (userrating, ID, kodi_id))
 
     def create_entry_uniqueid(self):
-        self.cursor.execute(
-            "select coalesce(max(uniqueid_id),0) from uniqueid")
-        return self.cursor.fetchone()[0] + 1
+        return self.new_id('uniqueid', 'uniqueid_id')
 
     def add_uniqueid(self, *args):
         """
@@ -1415,8 +1536,7 @@ class Kodidb_Functions():
         self.cursor.execute(query, (kodi_id, kodi_type))
 
     def create_entry_rating(self):
-        self.cursor.execute("select coalesce(max(rating_id),0) from rating")
-        return self.cursor.fetchone()[0] + 1
+        return self.new_id('rating', 'rating_id')
 
     def get_ratingid(self, kodi_id, kodi_type):
         query = '''
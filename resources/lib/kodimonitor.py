@@ -10,7 +10,8 @@ from xbmc import Monitor, Player, sleep, getCondVisibility, getInfoLabel, \
 from xbmcgui import Window
 
 import plexdb_functions as plexdb
-from utils import window, settings, plex_command, thread_methods
+from utils import window, settings, plex_command, thread_methods, \
+    wake_up_threads
 from PlexFunctions import scrobble
 from kodidb_functions import kodiid_from_filename
 from plexbmchelper.subscribers import LOCKER
@@ -36,6 +37,7 @@ WINDOW_SETTINGS = {
 # Need to use getattr and setattr!
 STATE_SETTINGS = {
     'dbSyncIndicator': 'SYNC_DIALOG',
+    'syncTelemetryFile': 'SYNC_TELEMETRY_FILE',
     'remapSMB': 'REMAP_PATH',
     'remapSMBmovieOrg': 'remapSMBmovieOrg',
     'remapSMBmovieNew': 'remapSMBmovieNew',
@@ -47,6 +49,7 @@ STATE_SETTINGS = {
     'remapSMBphotoNew': 'remapSMBphotoNew',
     'enableMusic': 'ENABLE_MUSIC',
     'enableBackgroundSync': 'BACKGROUND_SYNC',
+    'deltaSync': 'DELTA_SYNC',
     'fetch_pms_item_number': 'FETCH_PMS_ITEM_NUMBER'
 }
 
@@ -115,6 +118,8 @@ class KodiMonitor(Monitor):
         state.BACKGROUNDSYNC_SAFTYMARGIN = int(
             settings('backgroundsync_saftyMargin'))
         state.SYNC_THREAD_NUMBER = int(settings('syncThreadNumber'))
+        state.SYNC_METADATA_BATCH_SIZE = int(
+            settings('syncMetadataBatchSize'))
         state.SSL_CERT_PATH = settings('sslcert') \
             if settings('sslcert') != 'None' else None
         # Never set through the user
@@ -195,6 +200,7 @@ class KodiMonitor(Monitor):
         elif method == "System.OnQuit":
             LOG.info('Kodi OnQuit detected - shutting down')
             state.STOP_PKC = True
+            wake_up_threads()
 
     @LOCKER.lockthis
     def _playlist_onadd(self, data):
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from logging import getLogger
+from threading import Lock
+
+###############################################################################
+
+log = getLogger("PLEX."+__name__)
+
+# Stage name whose checkpoint marks a repair sync as started but unfinished.
+# Its position is the start of the sync in PMS time, the watermark for the
+# next delta sync
+REPAIR_STARTED = 'repair'
+
+###############################################################################
+
+
+class Sync_Checkpoint(object):
+    """
+    Keeps track of how far the sync threads got with the updatelist of one
+    stage of a repair sync, e.g. all episodes. Items are identified by their
+    position in the updatelist; as the download and parse threads might
+    reorder them slightly, only the low watermark (all items before position
+    are done) is persisted to the Plex DB.
+
+    The processing thread calls mark() and save() for every item written to
+    the DBs - with the Plex DB cursor of its Kodi and Plex DB transaction, so
+    the checkpoint is committed together with the items. Items that could not
+    be synced, e.g. because the PMS did not return their metadata, are never
+    marked; the checkpoint stays in front of them so a resumed sync retries
+    them
+
+    Input:
+        stage:      Name of the stage, e.g. 'TVShows.add_updateEpisode'
+        position:   Number of items of the stage already synced previously
+        total:      Total number of items of the stage
+    """
+    def __init__(self, stage, position, total):
+        self.stage = stage
+        self.position = position
+        self.total = total
+        self.saved = position
+        # Plex id of the last item before position
+        self.plex_id = None
+        # Positions of items done beyond the low watermark and their plex ids
+        self.ahead = {}
+        self.lock = Lock()
+
+    def mark(self, position, plex_id):
+        """
+        Call once the item at position with plex_id has been dealt with
+        """
+        with self.lock:
+            self.ahead[position] = plex_id
+            while self.position in self.ahead:
+                self.plex_id = self.ahead.pop(self.position)
+                self.position += 1
+
+    def save(self, plex_db):
+        """
+        Writes the low watermark using plex_db, a Plex_DB_Functions instance,
+        if it advanced since the last call
+        """
+        with self.lock:
+            if self.position == self.saved:
+                return
+            self.saved = self.position
+            plex_db.set_sync_checkpoint(self.stage,
+                                        self.position,
+                                        self.plex_id,
+                                        done=self.position >= self.total)
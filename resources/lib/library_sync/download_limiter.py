@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from logging import getLogger
+from threading import Condition
+
+###############################################################################
+
+log = getLogger("PLEX."+__name__)
+
+# Number of parallel PMS requests to start out with
+START_LIMIT = 2
+# Back off if the smoothed latency exceeds the baseline latency by this factor
+LATENCY_FACTOR = 2.0
+# Weight of a new latency sample for the smoothed latency
+LATENCY_WEIGHT = 0.2
+# Let the baseline latency rise by this factor per request, in case the PMS
+# got permanently slower
+BASELINE_DRIFT = 1.05
+
+###############################################################################
+
+
+class Download_Limiter(object):
+    """
+    Limits the number of parallel PMS requests of the download threads using
+    additive increase/multiplicative decrease (AIMD), like TCP does:
+
+    The limit is raised by one once as many requests as the current limit
+    succeeded without the latency rising. It is halved if a request fails
+    (e.g. 401 "PMS under strain" or 5xx) or if the smoothed latency rose to
+    LATENCY_FACTOR times the baseline latency. Only requests started after the
+    last decrease can decrease the limit again.
+
+    Input:
+        max_limit:      Upper bound, e.g. the number of download threads
+        min_limit:      Lower bound
+    """
+    def __init__(self, max_limit, min_limit=1):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = max(min_limit, min(START_LIMIT, self.max_limit))
+        self.active = 0
+        self.successes = 0
+        # Smoothed and baseline latency in seconds
+        self.latency = None
+        self.baseline = None
+        # Incremented with every decrease of the limit
+        self.epoch = 0
+        self.condition = Condition()
+
+    def acquire(self, stopped):
+        """
+        Blocks until the thread may start a PMS request. Pass the thread's
+        stopped method in order to return early.
+
+        Returns a token to pass to release() or None if stopped
+        """
+        with self.condition:
+            while self.active >= self.limit:
+                if stopped():
+                    return None
+                self.condition.wait(0.1)
+            self.active += 1
+            return self.epoch
+
+    def serialized(self):
+        """
+        Returns True if the PMS requests are down to one at a time
+        """
+        return self.limit <= 1
+
+    def release(self, token, seconds, success):
+        """
+        Call after every PMS request with the token from acquire(), the
+        duration of the request in seconds and whether it succeeded
+        """
+        with self.condition:
+            self.active -= 1
+            if not success:
+                self._decrease(token, 'PMS request failed')
+            else:
+                self._record_latency(token, seconds)
+            self.condition.notify_all()
+
+    def _record_latency(self, token, seconds):
+        if self.baseline is None:
+            self.baseline = seconds
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += LATENCY_WEIGHT * (seconds - self.latency)
+        self.baseline = min(self.latency, self.baseline * BASELINE_DRIFT)
+        if self.latency > LATENCY_FACTOR * self.baseline:
+            self._decrease(token, 'latency rose to %.2fs' % self.latency)
+            return
+        self.successes += 1
+        if self.successes >= self.limit and self.limit < self.max_limit:
+            self.limit += 1
+            self.successes = 0
+            log.debug('Raised parallel PMS requests to %s' % self.limit)
+
+    def _decrease(self, token, reason):
+        if token != self.epoch:
+            # Request was started at the previous, higher limit
+            return
+        self.epoch += 1
+        self.successes = 0
+        # Start measuring the latency anew at the new limit
+        self.latency = None
+        limit = max(self.min_limit, self.limit // 2)
+        if limit != self.limit:
+            log.info('%s: reducing parallel PMS requests from %s to %s'
+                     % (reason, self.limit, limit))
+            self.limit = limit
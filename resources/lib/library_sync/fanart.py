@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 from logging import getLogger
 from threading import Thread
-from Queue import Empty
 
 from xbmc import sleep
 
@@ -58,6 +57,10 @@ class Process_Fanart_Thread(Thread):
         suspended = self.suspended
         queue = self.queue
         while not stopped():
+            # Blocks until there is a Plex item in the queue
+            item = self.get_item(queue)
+            if item is None:
+                continue
             # In the event the server goes offline
             while suspended():
                 # Set in service.py
@@ -66,12 +69,6 @@ class Process_Fanart_Thread(Thread):
                     log.info("---===### Stopped FanartSync ###===---")
                     return
                 sleep(1000)
-            # grabs Plex item from queue
-            try:
-                item = queue.get(block=False)
-            except Empty:
-                sleep(200)
-                continue
 
             log.debug('Get additional fanart for Plex id %s' % item['plex_id'])
             with getattr(itemtypes,
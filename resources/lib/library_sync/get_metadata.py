@@ -2,17 +2,28 @@
 from logging import getLogger
 from threading import Thread
 from Queue import Empty
+from time import time
 
 from xbmc import sleep
 
-from utils import thread_methods, window
-from PlexFunctions import GetPlexMetadata, GetAllPlexChildren
+from utils import thread_methods, window, purge_queue, SENTINEL
+from PlexFunctions import get_metadata_batch, GetAllPlexChildren, \
+    trim_metadata, xml_size
 import sync_info
+import variables as v
+import state
 
 ###############################################################################
 
 log = getLogger("PLEX."+__name__)
 
+# How often shall we retry a failed PMS request before giving up?
+MAX_RETRIES = 4
+# Milliseconds to wait before the first retry; doubled for every retry
+BACKOFF = 1000
+# Upper bound for the wait between two retries in milliseconds
+MAX_BACKOFF = 30000
+
 ###############################################################################
 
 
@@ -20,17 +31,27 @@ log = getLogger("PLEX."+__name__)
 class Threaded_Get_Metadata(Thread):
     """
     Threaded download of Plex XML metadata for a certain library item.
-    Fills the out_queue with the downloaded etree XML objects
+    Fills the out_queue with the downloaded etree XML objects. Metadata is
+    downloaded for state.SYNC_METADATA_BATCH_SIZE items with one PMS request
+
+    Failed requests, e.g. with a PMS under strain, are retried with an
+    exponential backoff. All threads share one Download_Limiter which adapts
+    the number of parallel requests to the PMS' answers. The sync is only
+    cancelled if the PMS keeps answering 401 even to one request at a time.
 
     Input:
         queue               Queue.Queue() object that you'll need to fill up
-                            with Plex itemIds
+                            with sync_item.SyncItem objects
         out_queue           Queue() object where this thread will store
-                            the downloaded metadata XMLs as etree objects
+                            the SyncItems with the downloaded metadata XMLs
+                            as etree objects
+        limiter             download_limiter.Download_Limiter shared by all
+                            download threads
     """
-    def __init__(self, queue, out_queue):
+    def __init__(self, queue, out_queue, limiter):
         self.queue = queue
         self.out_queue = out_queue
+        self.limiter = limiter
         Thread.__init__(self)
 
     def terminate_now(self):
@@ -38,26 +59,59 @@ class Threaded_Get_Metadata(Thread):
         Needed to terminate this thread, because there might be items left in
         the queue which could cause other threads to hang
         """
-        while not self.queue.empty():
-            # Still try because remaining item might have been taken
-            try:
-                self.queue.get(block=False)
-            except Empty:
-                sleep(10)
-                continue
-            else:
-                self.queue.task_done()
+        purge_queue(self.queue)
         if self.stopped():
             # Shutdown from outside requested; purge out_queue as well
-            while not self.out_queue.empty():
-                # Still try because remaining item might have been taken
-                try:
-                    self.out_queue.get(block=False)
-                except Empty:
-                    sleep(10)
-                    continue
-                else:
-                    self.out_queue.task_done()
+            purge_queue(self.out_queue)
+
+    def _download(self, fct, *args):
+        """
+        Calls fct(*args) once the limiter allows another PMS request. Retries
+        with an exponential backoff if the PMS answers with an error.
+
+        A 401 usually means that the PMS is under strain. The limiter then
+        lowers the number of parallel requests, and we retry for as long as
+        it takes. Only 401s for requests made while the PMS had to answer
+        one request at a time count towards MAX_RETRIES.
+
+        Returns fct's result (401 or None if all attempts failed) or None if
+        the thread was stopped
+        """
+        stats = sync_info.STATS
+        attempt = 0
+        failures = 0
+        auth_failures = 0
+        while True:
+            if attempt > 0:
+                wait = min(BACKOFF * 2 ** (attempt - 1), MAX_BACKOFF)
+                log.info('Retrying PMS request in %sms' % wait)
+                while wait > 0:
+                    if self.stopped():
+                        return None
+                    sleep(100)
+                    wait -= 100
+            token = self.limiter.acquire(self.stopped)
+            if token is None:
+                return None
+            serialized = self.limiter.serialized()
+            started = time()
+            result = fct(*args)
+            elapsed = time() - started
+            success = result is not None and result != 401
+            self.limiter.release(token, elapsed, success)
+            stats.add_download(elapsed)
+            if success:
+                return result
+            attempt += 1
+            if result == 401:
+                if serialized:
+                    auth_failures += 1
+                if auth_failures > MAX_RETRIES:
+                    return result
+            else:
+                failures += 1
+                if failures > MAX_RETRIES:
+                    return result
 
     def run(self):
         """
@@ -79,53 +133,79 @@ class Threaded_Get_Metadata(Thread):
         queue = self.queue
         out_queue = self.out_queue
         stopped = self.stopped
+        batch_size = max(1, state.SYNC_METADATA_BATCH_SIZE)
         while stopped() is False:
-            # grabs Plex item from queue
-            try:
-                item = queue.get(block=False)
-            # Empty queue
-            except Empty:
-                sleep(20)
+            # Blocks until there is a Plex item in the queue
+            item = self.get_item(queue)
+            if item is None:
                 continue
-            # Download Metadata
-            xml = GetPlexMetadata(item['itemId'])
-            if xml is None:
-                # Did not receive a valid XML - skip that item for now
-                log.error("Could not get metadata for %s. Skipping that item "
-                          "for now" % item['itemId'])
-                # Increase BOTH counters - since metadata won't be processed
-                with sync_info.LOCK:
-                    sync_info.GET_METADATA_COUNT += 1
-                    sync_info.PROCESS_METADATA_COUNT += 1
-                queue.task_done()
-                continue
-            elif xml == 401:
-                log.error('HTTP 401 returned by PMS. Too much strain? '
-                          'Cancelling sync for now')
+            # Grab whatever else is there for the batch
+            items = [item]
+            while len(items) < batch_size:
+                try:
+                    item = queue.get(block=False)
+                except Empty:
+                    break
+                if item is SENTINEL:
+                    # Meant to wake up another thread - put it back
+                    queue.task_done()
+                    queue.put(item)
+                    break
+                items.append(item)
+            # Download Metadata for the entire batch at once
+            # Movies need the extras for their trailer, no one else does
+            if any(item.plex_type == v.PLEX_TYPE_MOVIE for item in items):
+                profile = 'sync_trailers'
+            else:
+                profile = 'sync'
+            xmls = self._download(get_metadata_batch,
+                                  [item.plex_id for item in items],
+                                  profile)
+            if xmls == 401:
+                log.error('HTTP 401 returned by PMS even for one request at '
+                          'a time. Cancelling sync for now')
                 window('plex_scancrashed', value='401')
                 # Kill remaining items in queue (for main thread to cont.)
-                queue.task_done()
+                for item in items:
+                    queue.task_done()
                 break
-
-            item['XML'] = xml
-            if item.get('get_children') is True:
-                children_xml = GetAllPlexChildren(item['itemId'])
+            for item in items:
                 try:
-                    children_xml[0].attrib
-                except (TypeError, IndexError, AttributeError):
-                    log.error('Could not get children for Plex id %s'
-                              % item['itemId'])
-                    item['children'] = []
-                else:
-                    item['children'] = children_xml
-
-            # place item into out queue
-            out_queue.put(item)
-            # Keep track of where we are at
-            with sync_info.LOCK:
-                sync_info.GET_METADATA_COUNT += 1
-            # signals to queue job is done
-            queue.task_done()
+                    xml = xmls[item.plex_id]
+                except (TypeError, KeyError):
+                    # Did not receive a valid XML - skip that item for now
+                    log.error("Could not get metadata for %s. Skipping that "
+                              "item for now" % item.plex_id)
+                    # Increase BOTH counters - since metadata won't be
+                    # processed
+                    with sync_info.LOCK:
+                        sync_info.GET_METADATA_COUNT += 1
+                        sync_info.PROCESS_METADATA_COUNT += 1
+                    queue.task_done()
+                    continue
+                # Only keep what we need before the xml sits in the queues
+                item.xml = trim_metadata(xml)
+                item.size = xml_size(xml)
+                if item.get_children is True:
+                    children_xml = self._download(GetAllPlexChildren,
+                                                  item.plex_id)
+                    try:
+                        children_xml[0].attrib
+                    except (TypeError, IndexError, AttributeError):
+                        log.error('Could not get children for Plex id %s'
+                                  % item.plex_id)
+                        item.children = []
+                    else:
+                        item.children = children_xml
+                        item.size += xml_size(children_xml)
+
+                # place item into out queue
+                out_queue.put(item)
+                # Keep track of where we are at
+                with sync_info.LOCK:
+                    sync_info.GET_METADATA_COUNT += 1
+                # signals to queue job is done
+                queue.task_done()
         # Empty queue in case PKC was shut down (main thread hangs otherwise)
         self.terminate_now()
         log.debug('Get metadata thread terminated')
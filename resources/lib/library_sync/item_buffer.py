@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from logging import getLogger
+from collections import OrderedDict
+
+###############################################################################
+
+log = getLogger("PLEX."+__name__)
+
+# Websocket state of a PMS item that has been deleted
+STATE_DELETED = 9
+# Give up on an item after this many attempts to process it
+MAX_ATTEMPTS = 3
+
+###############################################################################
+
+
+class Item_Buffer(object):
+    """
+    Collects the PMS library items that websocket messages told us about
+    until background sync processes them. Messages for the same Plex
+    ratingKey are coalesced into one item:
+        - a deletion wins over any other message
+        - otherwise, the item's timestamp is the one of the latest message,
+          so we wait for the PMS to finish all its work on the item
+
+    Items are dicts like this:
+        {
+            'ratingKey': Plex id as a string
+            'type':      Plex type, e.g. 'movie'
+            'state':     Websocket state of the item, e.g. 9 for deleted
+            'timestamp': Unix timestamp of the latest message for the item
+            'attempt':   Number of failed attempts to process the item
+        }
+    """
+    def __init__(self):
+        # Preserve the order in which the PMS told us about the items
+        self.items = OrderedDict()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, plex_id):
+        return plex_id in self.items
+
+    def add(self, plex_id, plex_type, status, timestamp):
+        """
+        Adds the item plex_id or merges this message with the one we already
+        got for plex_id
+        """
+        item = self.items.get(plex_id)
+        if item is None:
+            self.items[plex_id] = {
+                'ratingKey': plex_id,
+                'type': plex_type,
+                'state': status,
+                'timestamp': timestamp,
+                'attempt': 0
+            }
+        elif item['state'] == STATE_DELETED:
+            pass
+        elif status == STATE_DELETED:
+            item['state'] = status
+            item['type'] = plex_type
+            item['timestamp'] = timestamp
+        else:
+            item['timestamp'] = max(item['timestamp'], timestamp)
+
+    def due(self, now, margin):
+        """
+        Returns the tuple of lists (deletions, updates) of the items that
+        need to be processed now. Deletions are always due, all other items
+        once the PMS did not tell us about them for margin seconds
+        """
+        deletions = []
+        updates = []
+        for item in self.items.itervalues():
+            if item['state'] == STATE_DELETED:
+                deletions.append(item)
+            elif now - item['timestamp'] >= margin:
+                updates.append(item)
+        return deletions, updates
+
+    def done(self, item):
+        """
+        Call once item has been processed successfully
+        """
+        self.items.pop(item['ratingKey'], None)
+
+    def failed(self, item):
+        """
+        Call if item could not be processed. We will retry later - unless we
+        failed too often already
+        """
+        item['attempt'] += 1
+        if item['attempt'] > MAX_ATTEMPTS:
+            log.error('Repeatedly could not process item %s, abort' % item)
+            self.done(item)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from logging import getLogger
+from threading import Thread
+
+from utils import thread_methods, purge_queue
+from PlexAPI import API
+import sync_info
+import variables as v
+
+###############################################################################
+
+log = getLogger("PLEX."+__name__)
+
+# Memoized PlexAPI.API methods (and their arguments) that itemtypes calls for
+# the items of a plex_type
+PREFETCH = {
+    v.PLEX_TYPE_MOVIE: (('userdata', ()), ('artwork', ()),
+                        ('mediastreams', ())),
+    v.PLEX_TYPE_SHOW: (('artwork', ()), ),
+    v.PLEX_TYPE_SEASON: (('artwork', ()), ),
+    v.PLEX_TYPE_EPISODE: (('userdata', ()), ('resume_runtime', ()),
+                          ('mediastreams', ())),
+    v.PLEX_TYPE_ARTIST: (('artwork', (True, )), ),
+    v.PLEX_TYPE_ALBUM: (('userdata', ()), ('artwork', (True, ))),
+    v.PLEX_TYPE_SONG: (('userdata', ()), ('resume_runtime', ()))
+}
+
+###############################################################################
+
+
+@thread_methods(add_stops=['SUSPEND_LIBRARY_THREAD', 'STOP_SYNC'])
+class Threaded_Parse_Metadata(Thread):
+    """
+    Sits between Threaded_Get_Metadata and Threaded_Process_Metadata. Several
+    of these threads may run in parallel; they prefetch what can be derived
+    from the downloaded XML alone: a PlexAPI.API instance with all of its
+    child elements already parsed and the memoized values in PREFETCH.
+
+    Building the DB rows stays with the one and only processing thread, as
+    they need the Kodi ids that it allocates and the DB rows it looks up
+
+    Input:
+        queue               Queue.Queue() object filled by
+                            Threaded_Get_Metadata with downloaded items
+        out_queue           Queue() object where this thread will store
+                            the items, with item.api set, for
+                            Threaded_Process_Metadata
+    """
+    def __init__(self, queue, out_queue):
+        self.queue = queue
+        self.out_queue = out_queue
+        Thread.__init__(self)
+
+    def terminate_now(self):
+        """
+        Needed to terminate this thread, because there might be items left in
+        the queue which could cause other threads to hang
+        """
+        purge_queue(self.queue)
+        if self.stopped():
+            # Shutdown from outside requested; purge out_queue as well
+            purge_queue(self.out_queue)
+
+    def run(self):
+        """
+        Catch all exceptions and log them
+        """
+        try:
+            self.__run()
+        except Exception as e:
+            log.error('Exception %s' % e)
+            import traceback
+            log.error("Traceback:\n%s" % traceback.format_exc())
+
+    def __run(self):
+        """
+        Do the work
+        """
+        log.debug('Starting parse metadata thread')
+        # cache local variables because it's faster
+        queue = self.queue
+        out_queue = self.out_queue
+        stopped = self.stopped
+        while stopped() is False:
+            # Blocks until there is a downloaded item in the queue
+            item = self.get_item(queue)
+            if item is None:
+                continue
+            try:
+                api = API(item.xml[0])
+            except (TypeError, IndexError):
+                log.error('PMS returned an empty answer for %s. Skipping '
+                          'that item for now' % item.plex_id)
+                item.release()
+                with sync_info.LOCK:
+                    sync_info.PROCESS_METADATA_COUNT += 1
+                queue.task_done()
+                continue
+            try:
+                api.parse_children()
+                for method, args in PREFETCH.get(api.plex_type(), ()):
+                    getattr(api, method)(*args)
+            except Exception as e:
+                # Let the processing thread deal with (and report) the
+                # malformed item as it always did
+                log.warn('Could not parse metadata for %s: %s'
+                         % (item.plex_id, e))
+            item.api = api
+            out_queue.put(item)
+            queue.task_done()
+        self.terminate_now()
+        log.debug('Parse metadata thread terminated')
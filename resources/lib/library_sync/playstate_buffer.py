@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from utils import unix_timestamp, unix_date_to_kodi
+
+###############################################################################
+
+
+class Playstate_Buffer(object):
+    """
+    Keeps the latest playstate per Plex id that PMS "playing" messages told
+    us about, until LibrarySync writes them all at once. Intermediate
+    progress updates for an item thus collapse into one DB write.
+
+    Playstates are dicts like this:
+        {
+            'plex_id':      Plex id as a string
+            'kodi_type':    e.g. 'episode'
+            'file_id':      Kodi file id
+            'mark_played':  True if the item needs to be marked as played
+            'view_count':   Play count before marking the item played
+            'resume':       Resume point in seconds
+            'duration':     Duration in seconds
+            'last_played':  Kodi date of the latest message for the item
+        }
+    """
+    def __init__(self):
+        self.playstates = {}
+
+    def __len__(self):
+        return len(self.playstates)
+
+    def add(self, plex_id, kodi_type, file_id, mark_played, view_count,
+            resume, duration):
+        """
+        Replaces the playstate for plex_id we got so far - except that an
+        item that is to be marked played stays so
+        """
+        playstate = self.playstates.get(plex_id)
+        if playstate is not None and playstate['mark_played'] is True:
+            mark_played = True
+        self.playstates[plex_id] = {
+            'plex_id': plex_id,
+            'kodi_type': kodi_type,
+            'file_id': file_id,
+            'mark_played': mark_played,
+            'view_count': view_count,
+            'resume': resume,
+            'duration': duration,
+            'last_played': unix_date_to_kodi(unix_timestamp())
+        }
+
+    def pop_all(self):
+        """
+        Returns the list of all playstates and forgets about them
+        """
+        playstates = self.playstates.values()
+        self.playstates = {}
+        return playstates
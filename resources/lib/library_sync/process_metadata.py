@@ -1,11 +1,9 @@
 # -*- coding: utf-8 -*-
 from logging import getLogger
 from threading import Thread
-from Queue import Empty
+from time import time
 
-from xbmc import sleep
-
-from utils import thread_methods
+from utils import thread_methods, purge_queue, window
 import itemtypes
 import sync_info
 
@@ -19,12 +17,16 @@ log = getLogger("PLEX."+__name__)
 class Threaded_Process_Metadata(Thread):
     """
     Not yet implemented for more than 1 thread - if ever. Only to be called by
-    ONE thread!
+    ONE thread! This is the single writer to the Kodi and Plex DBs; the
+    child elements of the XML and other values that only depend on the XML
+    are prefetched by Threaded_Parse_Metadata
     Processes the XML metadata in the queue
 
     Input:
         queue:      Queue.Queue() object that you'll need to fill up with
-                    the downloaded XML eTree objects
+                    sync_item.SyncItem objects with the downloaded XML eTree
+                    objects (and, optionally, the prepared PlexAPI.API
+                    instance in item.api)
         item_type:  as used to call functions in itemtypes.py e.g. 'Movies' =>
                     itemtypes.Movies()
     """
@@ -38,15 +40,7 @@ class Threaded_Process_Metadata(Thread):
         Needed to terminate this thread, because there might be items left in
         the queue which could cause other threads to hang
         """
-        while not self.queue.empty():
-            # Still try because remaining item might have been taken
-            try:
-                self.queue.get(block=False)
-            except Empty:
-                sleep(10)
-                continue
-            else:
-                self.queue.task_done()
+        purge_queue(self.queue)
 
     def run(self):
         """
@@ -69,34 +63,58 @@ class Threaded_Process_Metadata(Thread):
         # cache local variables because it's faster
         queue = self.queue
         stopped = self.stopped
+        stats = sync_info.STATS
+        checkpoint = sync_info.CHECKPOINT
         with item_fct() as item_class:
             while stopped() is False:
-                # grabs item from queue
-                try:
-                    item = queue.get(block=False)
-                except Empty:
-                    sleep(20)
+                # Blocks until there is a parsed item in the queue
+                item = self.get_item(queue)
+                if item is None:
                     continue
+                stats.sample_queues()
                 # Do the work
-                item_method = getattr(item_class, item['method'])
-                if item.get('children') is not None:
-                    item_method(item['XML'][0],
-                                viewtag=item['viewName'],
-                                viewid=item['viewId'],
-                                children=item['children'])
+                started = time()
+                item_method = getattr(item_class, item.method)
+                if item.children is not None:
+                    item_method(item.xml[0],
+                                viewtag=item.view_name,
+                                viewid=item.view_id,
+                                children=item.children,
+                                api=item.api)
                 else:
-                    item_method(item['XML'][0],
-                                viewtag=item['viewName'],
-                                viewid=item['viewId'])
+                    item_method(item.xml[0],
+                                viewtag=item.view_name,
+                                viewid=item.view_id,
+                                api=item.api)
+                stats.add_processing(item.method, time() - started)
+                try:
+                    # Raises if the item's DB writes failed
+                    item_class.flush()
+                    if checkpoint is not None:
+                        # Commit the checkpoint together with the item
+                        checkpoint.mark(item.position, item.plex_id)
+                        checkpoint.save(item_class.plex_db)
+                    item_class.item_done()
+                except Exception as err:
+                    # The item's DB writes failed - carry on with the others
+                    log.error('Could not write %s %s to the DBs: %s'
+                              % (item.plex_type, item.plex_id, err))
+                    import traceback
+                    log.error("Traceback:\n%s" % traceback.format_exc())
+                    window('plex_scancrashed', value='true')
+                stats.set_sql(item_class.statements, item_class.sql_time)
                 # Keep track of where we are at
                 try:
                     log.debug('found child: %s'
-                              % item['children'].attrib)
+                              % item.children.attrib)
                 except:
                     pass
+                item.release()
                 with sync_info.LOCK:
                     sync_info.PROCESS_METADATA_COUNT += 1
-                    sync_info.PROCESSING_VIEW_NAME = item['title']
+                    sync_info.PROCESSING_VIEW_NAME = item.title
                 queue.task_done()
+        # Also account for the last commit
+        stats.set_sql(item_class.statements, item_class.sql_time)
         self.terminate_now()
         log.debug('Processing thread terminated')
@@ -1,11 +1,23 @@
 # -*- coding: utf-8 -*-
 from logging import getLogger
 from threading import Thread, Lock
+from time import time
+from collections import OrderedDict
+from json import dumps
+from sys import platform
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ImportError:
+    # Not available on Windows
+    getrusage = None
 
 from xbmc import sleep, Player
 from xbmcgui import DialogProgressBG
 
-from utils import thread_methods, language as lang
+from utils import thread_methods, window, unix_timestamp, language as lang
+import downloadutils
+import variables as v
+import state
 
 ###############################################################################
 
@@ -16,9 +28,199 @@ PROCESS_METADATA_COUNT = 0
 PROCESSING_VIEW_NAME = ''
 LOCK = Lock()
 
+# Sync_Stats of the sync threads currently running
+STATS = None
+# checkpoint.Sync_Checkpoint of the sync threads currently running or None if
+# we're not doing a repair sync
+CHECKPOINT = None
+# Snapshots of all runs of the sync threads during the current full sync
+RUNS = []
+# Upper bounds in milliseconds of the download latency histogram's buckets
+LATENCY_BUCKETS = (50, 100, 250, 500, 1000, 2500, 5000)
+
 ###############################################################################
 
 
+def peak_rss():
+    """
+    Returns the peak resident set size of Kodi's process in MB or None if
+    this is not supported on this platform
+    """
+    if getrusage is None:
+        return None
+    rss = getrusage(RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, but in kilobytes on Linux
+    if platform == 'darwin':
+        return rss / (1024 * 1024)
+    return rss / 1024
+
+
+def reset_telemetry():
+    """
+    Call at the start of a full sync to forget the previous sync's telemetry
+    """
+    global RUNS
+    RUNS = []
+
+
+def publish_telemetry():
+    """
+    Exposes the telemetry of all runs of the sync threads since the last
+    reset_telemetry() as JSON in the window property plex_sync_telemetry.
+    Also dumps it to v.SYNC_TELEMETRY_PATH if the user enabled this
+    """
+    telemetry = dumps({'time': unix_timestamp(), 'runs': RUNS}, indent=2)
+    window('plex_sync_telemetry', value=telemetry)
+    if state.SYNC_TELEMETRY_FILE is True:
+        try:
+            with open(v.SYNC_TELEMETRY_PATH, 'wb') as f:
+                f.write(telemetry)
+        except (IOError, OSError) as err:
+            log.warn('Could not write sync telemetry to %s: %s'
+                     % (v.SYNC_TELEMETRY_PATH, err))
+
+
+class Sync_Stats(object):
+    """
+    Measures one run of the sync threads, e.g. for a library's items. Call
+    start() before starting the threads and finish() once they are done.
+    Meanwhile, the sync threads report to sync_info.STATS
+
+    Input:
+        item_type:      e.g. 'Movies'
+        item_number:    Number of items to sync
+        mode:           Type of sync for logging
+        queues:         OrderedDict {name: Queue} whose depths to sample
+    """
+    def __init__(self, item_type, item_number, mode, queues):
+        self.item_type = item_type
+        self.item_number = item_number
+        self.mode = mode
+        self.queues = queues
+        self.lock = Lock()
+        self.started = None
+        self.transferred = (0, 0)
+        # {queue name: [max depth, sum of depths, number of samples]}
+        self.depths = OrderedDict((name, [0, 0, 0]) for name in queues)
+        # Number of downloads per bucket of LATENCY_BUCKETS, plus one for
+        # all slower downloads
+        self.latencies = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.download_time = 0.0
+        # {itemtypes method: [number of items, seconds, max seconds]}
+        self.methods = {}
+        self.sql_statements = 0
+        self.sql_time = 0.0
+
+    def start(self):
+        global STATS
+        STATS = self
+        self.transferred = downloadutils.transfer_stats()
+        self.started = time()
+
+    def sample_queues(self):
+        """
+        Records the current depths of all queues
+        """
+        with self.lock:
+            for name, queue in self.queues.iteritems():
+                depth = queue.qsize()
+                sample = self.depths[name]
+                if depth > sample[0]:
+                    sample[0] = depth
+                sample[1] += depth
+                sample[2] += 1
+
+    def add_download(self, seconds):
+        """
+        Records the duration of one PMS request
+        """
+        millis = seconds * 1000
+        bucket = 0
+        for bucket, limit in enumerate(LATENCY_BUCKETS):
+            if millis < limit:
+                break
+        else:
+            bucket = len(LATENCY_BUCKETS)
+        with self.lock:
+            self.latencies[bucket] += 1
+            self.download_time += seconds
+
+    def add_processing(self, method, seconds):
+        """
+        Records the time it took the itemtypes method to process one item
+        """
+        with self.lock:
+            stats = self.methods.setdefault(method, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            if seconds > stats[2]:
+                stats[2] = seconds
+
+    def set_sql(self, statements, seconds):
+        """
+        Sets the total number of SQL statements and seconds spent in SQLite
+        """
+        with self.lock:
+            self.sql_statements = statements
+            self.sql_time = seconds
+
+    def snapshot(self):
+        """
+        Returns the telemetry as a dict that can be dumped to JSON
+        """
+        elapsed = max(time() - self.started, 0.001)
+        requests, received = downloadutils.transfer_stats()
+        with self.lock:
+            buckets = ['<%sms' % limit for limit in LATENCY_BUCKETS]
+            buckets.append('>=%sms' % LATENCY_BUCKETS[-1])
+            return {
+                'item_type': self.item_type,
+                'mode': self.mode,
+                'items': self.item_number,
+                'seconds': round(elapsed, 3),
+                'items_per_second': round(self.item_number / elapsed, 1),
+                'queues': dict(
+                    (name, {'max': depth[0],
+                            'mean': round(float(depth[1]) /
+                                          max(depth[2], 1), 1)})
+                    for name, depth in self.depths.iteritems()),
+                'downloads': {
+                    'requests': requests - self.transferred[0],
+                    'bytes': received - self.transferred[1],
+                    'seconds': round(self.download_time, 3),
+                    'latency': OrderedDict(zip(buckets, self.latencies))
+                },
+                'processing': dict(
+                    (method, {'items': stats[0],
+                              'seconds': round(stats[1], 3),
+                              'max_seconds': round(stats[2], 3)})
+                    for method, stats in self.methods.iteritems()),
+                'sql': {
+                    'statements': self.sql_statements,
+                    'seconds': round(self.sql_time, 3)
+                },
+                'peak_rss_mb': peak_rss()
+            }
+
+    def finish(self):
+        """
+        Logs a summary and stores the telemetry of this run in RUNS
+        """
+        global STATS
+        STATS = None
+        snapshot = self.snapshot()
+        RUNS.append(snapshot)
+        log.info('Sync stats for %s (%s sync): %s items in %ss, '
+                 '%s items/s, %s PMS requests, %s bytes received, '
+                 '%.1f SQL statements per item, %ss in SQLite, peak RSS %s MB'
+                 % (self.item_type, self.mode, self.item_number,
+                    snapshot['seconds'], snapshot['items_per_second'],
+                    snapshot['downloads']['requests'],
+                    snapshot['downloads']['bytes'],
+                    float(snapshot['sql']['statements']) / self.item_number,
+                    snapshot['sql']['seconds'], snapshot['peak_rss_mb']))
+
+
 @thread_methods(add_stops=['SUSPEND_LIBRARY_THREAD', 'STOP_SYNC'])
 class Threaded_Show_Sync_Info(Thread):
     """
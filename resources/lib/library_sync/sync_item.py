@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+
+class SyncItem(object):
+    """
+    One PMS item to be synced, as collected by LibrarySync.GetUpdatelist and
+    then handed down the line of sync threads. Uses __slots__ because a full
+    sync might need hundreds of thousands of these.
+
+        plex_id:        Plex ratingKey, e.g. '246922'
+        item_type:      'Movies', 'TVShows', ... (see itemtypes.py)
+        method:         Method of item_type to call, e.g. 'add_updateSeason'
+        view_name:      Name of the Plex view (e.g. 'My TV shows')
+        view_id:        Id/Key of the Plex library (e.g. '1')
+        title:          Title of the PMS item
+        plex_type:      e.g. 'movie', 'episode'
+        get_children:   True if Threaded_Get_Metadata needs to download the
+                        item's children as well, e.g. for music albums
+        position:       Index of the item in the updatelist, see
+                        checkpoint.Sync_Checkpoint
+
+    Set by the sync threads - and released again once the item is processed:
+        xml:            The PMS metadata xml for the item
+        children:       The PMS xml for the item's children (or [])
+        api:            PlexAPI.API instance prepared from xml
+        size:           Estimated size in bytes of xml and children, see
+                        utils.ByteBoundedQueue
+    """
+    __slots__ = ('plex_id', 'item_type', 'method', 'view_name', 'view_id',
+                 'title', 'plex_type', 'get_children', 'xml', 'children',
+                 'api', 'size', 'position')
+
+    def __init__(self, plex_id, item_type, method, view_name, view_id, title,
+                 plex_type, get_children=False):
+        self.plex_id = plex_id
+        self.item_type = item_type
+        self.method = method
+        self.view_name = view_name
+        self.view_id = view_id
+        self.title = title
+        self.plex_type = plex_type
+        self.get_children = get_children
+        self.position = None
+        self.xml = None
+        self.children = None
+        self.api = None
+        self.size = 0
+
+    def release(self):
+        """
+        Frees the memory of the PMS metadata once the item has been synced
+        """
+        self.xml = None
+        self.children = None
+        self.api = None
+
+    def __repr__(self):
+        return ('SyncItem(plex_id=%s, plex_type=%s, method=%s)'
+                % (self.plex_id, self.plex_type, self.method))
@@ -3,6 +3,7 @@
 from logging import getLogger
 from threading import Thread
 import Queue
+from collections import OrderedDict
 from random import shuffle
 
 import xbmc
@@ -10,8 +11,8 @@ from xbmcvfs import exists
 
 from utils import window, settings, unix_timestamp, thread_methods, \
     create_actor_db_index, dialog, log_time, playlist_xsp, language as lang, \
-    unix_date_to_kodi, reset, try_decode, delete_playlists, delete_nodes, \
-    try_encode, compare_version
+    reset, try_decode, delete_playlists, delete_nodes, \
+    try_encode, compare_version, ByteBoundedQueue
 import downloadutils
 import itemtypes
 import plexdb_functions as plexdb
@@ -23,12 +24,19 @@ import variables as v
 
 from PlexFunctions import GetPlexMetadata, GetAllPlexLeaves, scrobble, \
     GetPlexSectionResults, GetPlexKeyNumber, GetPMSStatus, get_plex_sections, \
+    GetPlexSectionKeys, DownloadChunksError, get_metadata_batch, \
     GetAllPlexChildren
 import PlexAPI
 from library_sync.get_metadata import Threaded_Get_Metadata
+from library_sync.download_limiter import Download_Limiter
+from library_sync.checkpoint import Sync_Checkpoint, REPAIR_STARTED
+from library_sync.parse_metadata import Threaded_Parse_Metadata
 from library_sync.process_metadata import Threaded_Process_Metadata
 import library_sync.sync_info as sync_info
 from library_sync.fanart import Process_Fanart_Thread
+from library_sync.sync_item import SyncItem
+from library_sync.item_buffer import Item_Buffer
+from library_sync.playstate_buffer import Playstate_Buffer
 import music
 import state
 
@@ -36,17 +44,34 @@ import state
 
 log = getLogger("PLEX."+__name__)
 
+# Seconds to subtract from the delta sync watermark - the Kodi-PMS time
+# offset is only approximated
+DELTA_SYNC_MARGIN = 600
+
 ###############################################################################
 
 
+def new_sync_plan():
+    """
+    Returns the counters of how LibrarySync.GetUpdatelist classified the PMS
+    items of a sync stage
+    """
+    return {'new': 0, 'changed': 0, 'unchanged': 0, 'repair': 0}
+
+
 @thread_methods(add_suspends=['SUSPEND_LIBRARY_THREAD', 'STOP_SYNC'])
 class LibrarySync(Thread):
     """
     """
     def __init__(self):
-        self.itemsToProcess = []
+        # PMS items that websocket messages told us about
+        self.itemsToProcess = Item_Buffer()
+        # Latest playstates that PMS "playing" messages told us about
+        self.playstates = Playstate_Buffer()
         self.sessionKeys = {}
         self.fanartqueue = Queue.Queue()
+        # Only used to wake up this thread, see utils.wake_up_threads
+        self.wakeup_queue = Queue.Queue()
         if settings('FanartTV') == 'true':
             self.fanartthread = Process_Fanart_Thread(self.fanartqueue)
         # How long should we wait at least to process new/changed PMS items?
@@ -116,21 +141,22 @@ class LibrarySync(Thread):
                 if not view.attrib['type'] == mediatype:
                     continue
                 libraryId = view.attrib['key']
-                items = GetAllPlexLeaves(libraryId)
-                if items in (None, 401):
+                try:
+                    for item in GetAllPlexLeaves(libraryId, stream=True):
+                        if item.attrib.get('viewCount') is not None:
+                            # Don't want to mess with items that have
+                            # playcount>0
+                            continue
+                        if item.attrib.get('viewOffset') is not None:
+                            # Don't mess with items with a resume point
+                            continue
+                        plexId = item.attrib.get('ratingKey')
+                        log.info('Found an item to sync with: %s' % plexId)
+                        break
+                except DownloadChunksError:
                     log.error("Could not download section %s"
                               % view.attrib['key'])
                     continue
-                for item in items:
-                    if item.attrib.get('viewCount') is not None:
-                        # Don't want to mess with items that have playcount>0
-                        continue
-                    if item.attrib.get('viewOffset') is not None:
-                        # Don't mess with items with a resume point
-                        continue
-                    plexId = item.attrib.get('ratingKey')
-                    log.info('Found an item to sync with: %s' % plexId)
-                    break
 
         if plexId is None:
             log.error("Could not find an item to sync time with")
@@ -138,7 +164,7 @@ class LibrarySync(Thread):
             return False
 
         # Get the Plex item's metadata
-        xml = GetPlexMetadata(plexId)
+        xml = GetPlexMetadata(plexId, 'sync')
         if xml in (None, 401):
             log.error("Could not download metadata, aborting time sync")
             return False
@@ -161,18 +187,20 @@ class LibrarySync(Thread):
         # Let the PMS process this first!
         xbmc.sleep(1000)
         # Get PMS items to find the item we just changed
-        items = GetAllPlexLeaves(libraryId, lastViewedAt=timestamp)
-        # Toggle watched state back
-        scrobble(plexId, 'unwatched')
-        if items in (None, 401):
+        plextime = None
+        try:
+            for item in GetAllPlexLeaves(libraryId,
+                                         lastViewedAt=timestamp,
+                                         stream=True):
+                if item.attrib['ratingKey'] == plexId:
+                    plextime = item.attrib.get('lastViewedAt')
+                    break
+        except DownloadChunksError:
             log.error("Could not download metadata, aborting time sync")
             return False
-
-        plextime = None
-        for item in items:
-            if item.attrib['ratingKey'] == plexId:
-                plextime = item.attrib.get('lastViewedAt')
-                break
+        finally:
+            # Toggle watched state back
+            scrobble(plexId, 'unwatched')
 
         if plextime is None:
             log.error('Could not get lastViewedAt - aborting')
@@ -210,49 +238,90 @@ class LibrarySync(Thread):
                 view_name TEXT,
                 kodi_type TEXT,
                 kodi_tagid INTEGER,
-                sync_to_kodi INTEGER)
+                sync_to_kodi INTEGER,
+                last_sync INTEGER)
             ''')
             plex_db.plexcursor.execute('''
                 CREATE TABLE IF NOT EXISTS version(idVersion TEXT)
             ''')
+            # Plex DBs created by older PKC versions need an update
+            plex_db.migrate()
         # Create an index for actors to speed up sync
         create_actor_db_index()
 
     @log_time
-    def fullSync(self, repair=False):
+    def fullSync(self, repair=False, delta=False):
         """
         repair=True: force sync EVERY item
+        delta=True:  only ask the PMS for items that changed since the last
+                     successful full sync of a view (ignored if repair=True)
         """
         # Reset our keys
         self.sessionKeys = {}
+        # Watermark for the next delta sync, in PMS time. Use a safety margin
+        # since our time offset to the PMS is not exact
+        sync_start = int(unix_timestamp() - state.KODI_PLEX_TIME_OFFSET -
+                         DELTA_SYNC_MARGIN)
+        # A repair sync that got interrupted, e.g. by Kodi exiting, is resumed
+        # by the next full sync
+        with plexdb.Get_Plex_DB() as plex_db:
+            checkpoints = plex_db.get_sync_checkpoints()
+        if checkpoints and not repair:
+            log.info('Resuming the interrupted repair sync')
+            repair = True
+        # {stage: (position, plex_id, done)} for a repair sync, else None
+        self.checkpoints = None
+        if repair:
+            self.checkpoints = checkpoints
+            if checkpoints:
+                # We skip the stages that the interrupted sync finished - and
+                # thus items that changed since it started. Its start time is
+                # unknown if an older PKC version started it
+                started = checkpoints.get(REPAIR_STARTED, (None, ))[0]
+                sync_start = started or None
+            else:
+                with plexdb.Get_Plex_DB() as plex_db:
+                    plex_db.set_sync_checkpoint(REPAIR_STARTED, sync_start,
+                                                None)
         # self.compare == False: we're syncing EVERY item
         # True: we're syncing only the delta, e.g. different checksum
         self.compare = not repair
+        self.delta = delta and not repair
+        self.sync_crashed = False
 
-        self.new_items_only = True
-        # This will also update playstates and userratings!
-        log.info('Running fullsync for NEW PMS items with repair=%s' % repair)
-        if self._fullSync() is False:
-            return False
-        self.new_items_only = False
-        # This will NOT update playstates and userratings!
-        log.info('Running fullsync for CHANGED PMS items with repair=%s'
-                 % repair)
-        if self._fullSync() is False:
-            return False
+        sync_info.reset_telemetry()
+        # Look up genres, actors etc. in memory for the duration of the sync
+        kodidb.LOOKUP_CACHES.enable()
+        try:
+            # One pass syncs new and changed items as well as deletions,
+            # playstates and userratings
+            log.info('Running fullsync with repair=%s, delta=%s'
+                     % (repair, self.delta))
+            self.sync_plan = new_sync_plan()
+            if self._fullSync() is False:
+                return False
+        finally:
+            kodidb.LOOKUP_CACHES.disable()
+            sync_info.publish_telemetry()
+        if self.sync_crashed is False:
+            with plexdb.Get_Plex_DB() as plex_db:
+                if sync_start is not None:
+                    for view in self.views:
+                        plex_db.set_view_last_sync(view['id'], sync_start)
+                if self.checkpoints is not None:
+                    plex_db.clear_sync_checkpoints()
         return True
 
     def _fullSync(self):
-        if self.new_items_only is True:
-            # Set views. Abort if unsuccessful
-            if not self.maintainViews():
-                return False
-            # Delete all existing resume points first
-            with kodidb.GetKodiDB('video') as kodi_db:
-                # Setup the paths for addon-paths (even when using direct paths)
-                kodi_db.setup_path_table()
-                # Delete all resume points because we'll get new ones
-                kodi_db.delete_all_playstates()
+        # Set views. Abort if unsuccessful
+        if not self.maintainViews():
+            return False
+        # Delete all existing resume points first
+        with kodidb.GetKodiDB('video') as kodi_db:
+            # Setup the paths for addon-paths (even when using direct paths)
+            kodi_db.setup_path_table()
+            # Delete all resume points because we'll get new ones
+            kodi_db.delete_all_playstates()
 
         process = {
             'movies': self.PlexMovies,
@@ -274,6 +343,9 @@ class LibrarySync(Thread):
             xbmc.executebuiltin('UpdateLibrary(music)')
 
         window('plex_initialScan', clear=True)
+        if window('plex_scancrashed'):
+            # Don't rely on a delta sync next time, we might have missed items
+            self.sync_crashed = True
         if window('plex_scancrashed') == 'true':
             # Show warning if itemtypes.py crashed at some point
             dialog('ok', heading='{plex}', line1=lang(39408))
@@ -537,14 +609,21 @@ class LibrarySync(Thread):
                 music.remove(item['plex_id'])
 
     def GetUpdatelist(self, xml, itemType, method, viewName, viewId,
-                      get_children=False):
+                      get_children=False, parents=None):
         """
         THIS METHOD NEEDS TO BE FAST! => e.g. no API calls
 
-        Adds items to self.updatelist as well as self.allPlexElementsId dict
+        Adds items to self.updatelist as well as self.allPlexElementsId set.
+        Every PMS item is classified as new, changed or unchanged compared to
+        self.allKodiElementsId (counted in self.sync_plan) - only new and
+        changed items are synced, unless we're doing a repair sync
+
+        Returns False if xml is a stream of PMS items (see
+        PlexFunctions.stream_chunks) that could not be downloaded
 
         Input:
-            xml:                    PMS answer for section items
+            xml:                    PMS answer for section items, or a stream
+                                    of these
             itemType:               'Movies', 'TVShows', ...
             method:                 Method name to be called with this itemtype
                                     see itemtypes.py
@@ -552,100 +631,199 @@ class LibrarySync(Thread):
             viewId:                 Id/Key of Plex library (e.g. '1')
             get_children:           will get Plex children of the item if True,
                                     e.g. for music albums
+            parents:                optional set of Plex ids. Items with a
+                                    parentRatingKey in parents are updated
+                                    even if their checksum did not change
 
         Output: self.updatelist, self.allPlexElementsId
-            self.updatelist         APPENDED(!!) list itemids (Plex Keys as
-                                    as received from API.plex_id())
-            One item in this list is of the form:
-                'itemId': xxx,
-                'itemType': 'Movies','TVShows', ...
-                'method': 'add_update', 'add_updateSeason', ...
-                'viewName': xxx,
-                'viewId': xxx,
-                'title': xxx
-                'mediaType': xxx, e.g. 'movie', 'episode'
-
-            self.allPlexElementsId      APPENDED(!!) dict
-                = {itemid: checksum}
+            self.updatelist         APPENDED(!!) list of
+                                    library_sync.sync_item.SyncItem
+            self.allPlexElementsId      APPENDED(!!) set of all Plex ids
         """
-        if self.new_items_only is True:
-            # Only process Plex items that Kodi does not already have in lib
-            for item in xml:
-                itemId = item.attrib.get('ratingKey')
-                if not itemId:
-                    # Skipping items 'title=All episodes' without a 'ratingKey'
-                    continue
-                self.allPlexElementsId[itemId] = "K%s%s" % \
-                    (itemId, item.attrib.get('updatedAt', ''))
-                if itemId not in self.allKodiElementsId:
-                    self.updatelist.append({
-                        'itemId': itemId,
-                        'itemType': itemType,
-                        'method': method,
-                        'viewName': viewName,
-                        'viewId': viewId,
-                        'title': item.attrib.get('title', 'Missing Title'),
-                        'mediaType': item.attrib.get('type'),
-                        'get_children': get_children
-                    })
-            return
-        elif self.compare:
-            # Only process the delta - new or changed items
+        compare = self.compare
+        plan = self.sync_plan
+        try:
             for item in xml:
                 itemId = item.attrib.get('ratingKey')
                 if not itemId:
                     # Skipping items 'title=All episodes' without a 'ratingKey'
                     continue
-                plex_checksum = ("K%s%s"
-                                 % (itemId, item.attrib.get('updatedAt', '')))
-                self.allPlexElementsId[itemId] = plex_checksum
-                kodi_checksum = self.allKodiElementsId.get(itemId)
-                # Only update if movie is not in Kodi or checksum is
-                # different
-                if kodi_checksum != plex_checksum:
-                    self.updatelist.append({
-                        'itemId': itemId,
-                        'itemType': itemType,
-                        'method': method,
-                        'viewName': viewName,
-                        'viewId': viewId,
-                        'title': item.attrib.get('title', 'Missing Title'),
-                        'mediaType': item.attrib.get('type'),
-                        'get_children': get_children
-                    })
-        else:
-            # Initial or repair sync: get all Plex movies
-            for item in xml:
-                itemId = item.attrib.get('ratingKey')
-                if not itemId:
-                    # Skipping items 'title=All episodes' without a 'ratingKey'
+                # Same as PlexAPI.API.checksum()
+                plex_checksum = int(item.attrib.get('updatedAt') or 0)
+                self.allPlexElementsId.add(itemId)
+                if not compare:
+                    # Repair sync: get all Plex items
+                    plan['repair'] += 1
+                elif itemId not in self.allKodiElementsId:
+                    plan['new'] += 1
+                elif (self.allKodiElementsId[itemId] != plex_checksum or
+                        (parents and
+                         item.attrib.get('parentRatingKey') in parents)):
+                    plan['changed'] += 1
+                else:
+                    plan['unchanged'] += 1
                     continue
-                self.allPlexElementsId[itemId] = "K%s%s" \
-                    % (itemId, item.attrib.get('updatedAt', ''))
-                self.updatelist.append({
-                    'itemId': itemId,
-                    'itemType': itemType,
-                    'method': method,
-                    'viewName': viewName,
-                    'viewId': viewId,
-                    'title': item.attrib.get('title', 'Missing Title'),
-                    'mediaType': item.attrib.get('type'),
-                    'get_children': get_children
-                })
-
-    def GetAndProcessXMLs(self, itemType):
+                self.updatelist.append(SyncItem(
+                    itemId,
+                    itemType,
+                    method,
+                    viewName,
+                    viewId,
+                    item.attrib.get('title', 'Missing Title'),
+                    item.attrib.get('type'),
+                    get_children))
+        except DownloadChunksError:
+            log.error('Could not download the items of view %s' % viewName)
+            return False
+
+    def deleted_items(self, kind):
+        """
+        Returns the list of Plex ids in self.allKodiElementsId that the PMS
+        did not list (anymore), i.e. items deleted on the PMS
+        """
+        deleted = [plex_id for plex_id in self.allKodiElementsId
+                   if (plex_id not in self.allPlexElementsId and
+                       plex_id not in self.delta_plex_ids)]
+        log.info('%s %s items have been deleted on the PMS'
+                 % (len(deleted), kind))
+        return deleted
+
+    def delta_watermark(self, view):
+        """
+        Returns the PMS timestamp to get only the items of view that changed
+        since the last successful full sync - or None if we need to get ALL
+        items of view
+        """
+        if self.delta is True:
+            return view.get('last_sync')
+
+    def get_section_items(self, view, args=None, leaves=False):
+        """
+        Returns a stream of the PMS items of view (GetAllPlexLeaves for
+        leaves=True, GetPlexSectionResults otherwise) - either all of them or,
+        for a delta sync, only the ones that changed since the last full sync.
+        In the latter case, the ratingKeys of ALL the view's items of this
+        kind are added to self.delta_plex_ids to detect PMS deletions.
+
+            args:       optional dict to be urlencoded, e.g. {'type': 9}
+        """
+        updated_at = self.delta_watermark(view)
+        if updated_at is not None:
+            keys = GetPlexSectionKeys(view['id'], args=args)
+            if keys is None:
+                log.warn('Using a complete sync for view %s' % view['name'])
+                updated_at = None
+            else:
+                self.delta_plex_ids.update(keys)
+        if leaves is True:
+            return GetAllPlexLeaves(view['id'],
+                                    updatedAt=updated_at,
+                                    stream=True)
+        return GetPlexSectionResults(view['id'],
+                                     args=args,
+                                     updatedAt=updated_at,
+                                     stream=True)
+
+    def get_changed_children(self, view, parents):
+        """
+        For a delta sync, returns the list of the PMS children of the items
+        parents of view that get_section_items did not list already: their
+        updatedAt might not have changed, but we need to update them anyway.
+        Returns an empty list for a complete sync and None if the PMS children
+        could not be downloaded
+
+            parents:    set of Plex ids, e.g. of the changed TV shows
+        """
+        children = []
+        if self.delta_watermark(view) is None:
+            return children
+        for plex_id in parents:
+            xml = GetAllPlexChildren(plex_id)
+            try:
+                xml.attrib
+            except AttributeError:
+                log.error('Could not get the children of Plex id %s'
+                          % plex_id)
+                return None
+            children.extend(child for child in xml
+                            if child.attrib.get('ratingKey') not in
+                            self.allPlexElementsId)
+        return children
+
+    def checkpoint_stage(self, itemType, method):
+        """
+        Returns the name of the stage of a repair sync that syncs the items of
+        itemType with method, e.g. 'TVShows.add_updateEpisode'
+        """
+        return '%s.%s' % (itemType, method)
+
+    def stage_views(self, views, itemType, method):
+        """
+        Returns the views whose items we need to get from the PMS in order to
+        sync them with itemType's method - none at all if we're resuming a
+        repair sync that already finished this stage
+        """
+        if self.checkpoints:
+            checkpoint = self.checkpoints.get(
+                self.checkpoint_stage(itemType, method))
+            if checkpoint is not None and checkpoint[2] is True:
+                log.info('Repair sync already finished %s %s, skipping'
+                         % (itemType, method))
+                return []
+        return views
+
+    def resume_checkpoint(self, itemType, method):
+        """
+        Returns a library_sync.checkpoint.Sync_Checkpoint for self.updatelist
+        or None if we're not doing a repair sync. If we're resuming an
+        interrupted repair sync, the items of self.updatelist that have
+        already been synced are dropped
+        """
+        if self.checkpoints is None:
+            return None
+        for position, item in enumerate(self.updatelist):
+            item.position = position
+        total = len(self.updatelist)
+        stage = self.checkpoint_stage(itemType, method)
+        position, plex_id, done = self.checkpoints.get(stage,
+                                                       (0, None, False))
+        if done:
+            # stage_views() made sure that self.updatelist is empty
+            return None
+        if position and (position > total or
+                         self.updatelist[position - 1].plex_id != plex_id):
+            log.warn('PMS items changed since the repair sync got '
+                     'interrupted, syncing all items of %s again' % stage)
+            position = 0
+        elif position:
+            log.info('Resuming the repair sync of %s at item %s of %s'
+                     % (stage, position, total))
+            del self.updatelist[:position]
+        return Sync_Checkpoint(stage, position, total)
+
+    def GetAndProcessXMLs(self, itemType, method):
         """
         Downloads all XMLs for itemType (e.g. Movies, TV-Shows). Processes them
         by then calling itemtypes.<itemType>()
 
         Input:
             itemType:               'Movies', 'TVShows', ...
+            method:                 Method name the items of self.updatelist
+                                    are synced with, e.g. 'add_updateSeason'
             self.updatelist
             showProgress            If False, NEVER shows sync progress
         """
+        checkpoint = self.resume_checkpoint(itemType, method)
+        if self.compare:
+            log.info('Sync plan for %s %s: %s new, %s changed and %s '
+                     'unchanged items'
+                     % (itemType, method, self.sync_plan['new'],
+                        self.sync_plan['changed'],
+                        self.sync_plan['unchanged']))
+        self.sync_plan = new_sync_plan()
         # Some logging, just in case.
-        log.debug("self.updatelist: %s" % self.updatelist)
         itemNumber = len(self.updatelist)
+        log.debug("Number of items in self.updatelist: %s" % itemNumber)
         if itemNumber == 0:
             return
 
@@ -653,32 +831,55 @@ class LibrarySync(Thread):
         # Initiate threads
         log.info("Starting sync threads")
         getMetadataQueue = Queue.Queue()
-        processMetadataQueue = Queue.Queue(maxsize=100)
+        # Bound the downloaded metadata waiting in memory by its size
+        parseMetadataQueue = ByteBoundedQueue(state.SYNC_QUEUE_BYTES)
+        processMetadataQueue = ByteBoundedQueue(state.SYNC_QUEUE_BYTES)
         # To keep track
         sync_info.GET_METADATA_COUNT = 0
         sync_info.PROCESS_METADATA_COUNT = 0
         sync_info.PROCESSING_VIEW_NAME = ''
+        if not self.compare:
+            mode = 'repair'
+        else:
+            mode = 'delta' if self.delta else 'full'
+        stats = sync_info.Sync_Stats(
+            itemType, itemNumber, mode,
+            OrderedDict((('get', getMetadataQueue),
+                         ('parse', parseMetadataQueue),
+                         ('process', processMetadataQueue))))
+        stats.start()
+        sync_info.CHECKPOINT = checkpoint
         # Populate queue: GetMetadata
         for updateItem in self.updatelist:
             getMetadataQueue.put(updateItem)
-        # Spawn GetMetadata threads for downloading
+        # Spawn GetMetadata threads for downloading. The limiter decides how
+        # many of them may talk to the PMS at the same time
         threads = []
-        for i in range(min(state.SYNC_THREAD_NUMBER, itemNumber)):
+        thread_number = min(state.SYNC_THREAD_NUMBER, itemNumber)
+        limiter = Download_Limiter(thread_number)
+        for i in range(thread_number):
             thread = Threaded_Get_Metadata(getMetadataQueue,
-                                           processMetadataQueue)
+                                           parseMetadataQueue,
+                                           limiter)
             thread.setDaemon(True)
             thread.start()
             threads.append(thread)
         log.info("%s download threads spawned" % len(threads))
-        # Spawn one more thread to process Metadata, once downloaded
+        # Spawn threads to convert the XMLs in parallel to the DB writes
+        for i in range(min(state.SYNC_PARSE_THREAD_NUMBER, itemNumber)):
+            thread = Threaded_Parse_Metadata(parseMetadataQueue,
+                                             processMetadataQueue)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        # Spawn one more thread to process Metadata, once parsed
         thread = Threaded_Process_Metadata(processMetadataQueue,
                                            itemType)
         thread.setDaemon(True)
         thread.start()
         threads.append(thread)
-        # Start one thread to show sync progress ONLY for new PMS items
-        if self.new_items_only is True and (state.SYNC_DIALOG is True or
-                                            self.force_dialog is True):
+        # Start one thread to show sync progress
+        if state.SYNC_DIALOG is True or self.force_dialog is True:
             thread = sync_info.Threaded_Show_Sync_Info(itemNumber, itemType)
             thread.setDaemon(True)
             thread.start()
@@ -686,6 +887,7 @@ class LibrarySync(Thread):
 
         # Wait until finished
         getMetadataQueue.join()
+        parseMetadataQueue.join()
         processMetadataQueue.join()
         # Kill threads
         log.info("Waiting to kill threads")
@@ -702,14 +904,17 @@ class LibrarySync(Thread):
                 thread.join(1.0)
             except:
                 pass
-        log.info("Sync threads finished")
+        log.info("Sync threads finished. Parallel PMS requests at the end: %s"
+                 % limiter.limit)
+        stats.finish()
+        sync_info.CHECKPOINT = None
         if (settings('FanartTV') == 'true' and
                 itemType in ('Movies', 'TVShows')):
             for item in self.updatelist:
-                if item['mediaType'] in (v.PLEX_TYPE_MOVIE, v.PLEX_TYPE_SHOW):
+                if item.plex_type in (v.PLEX_TYPE_MOVIE, v.PLEX_TYPE_SHOW):
                     self.fanartqueue.put({
-                        'plex_id': item['itemId'],
-                        'plex_type': item['mediaType'],
+                        'plex_id': item.plex_id,
+                        'plex_type': item.plex_type,
                         'refresh': False
                     })
         self.updatelist = []
@@ -717,7 +922,8 @@ class LibrarySync(Thread):
     @log_time
     def PlexMovies(self):
         # Initialize
-        self.allPlexElementsId = {}
+        self.allPlexElementsId = set()
+        self.delta_plex_ids = set()
 
         itemType = 'Movies'
 
@@ -737,7 +943,7 @@ class LibrarySync(Thread):
 
         # PROCESS MOVIES #####
         self.updatelist = []
-        for view in views:
+        for view in self.stage_views(views, itemType, 'add_update'):
             if self.installSyncDone is not True:
                 state.PATH_VERIFIED = False
             if self.stopped() or self.suspended():
@@ -745,19 +951,15 @@ class LibrarySync(Thread):
             # Get items per view
             viewId = view['id']
             viewName = view['name']
-            all_plexmovies = GetPlexSectionResults(viewId, args=None)
-            if all_plexmovies is None:
-                log.info("Couldnt get section items, aborting for view.")
-                continue
-            elif all_plexmovies == 401:
-                return False
+            all_plexmovies = self.get_section_items(view)
             # Populate self.updatelist and self.allPlexElementsId
-            self.GetUpdatelist(all_plexmovies,
-                               itemType,
-                               'add_update',
-                               viewName,
-                               viewId)
-        self.GetAndProcessXMLs(itemType)
+            if self.GetUpdatelist(all_plexmovies,
+                                  itemType,
+                                  'add_update',
+                                  viewName,
+                                  viewId) is False:
+                return False
+        self.GetAndProcessXMLs(itemType, 'add_update')
         # Update viewstate for EVERY item
         for view in views:
             if self.stopped() or self.suspended():
@@ -768,9 +970,8 @@ class LibrarySync(Thread):
         if self.compare:
             # Manual sync, process deletes
             with itemtypes.Movies() as Movie:
-                for kodimovie in self.allKodiElementsId:
-                    if kodimovie not in self.allPlexElementsId:
-                        Movie.remove(kodimovie)
+                for kodimovie in self.deleted_items(itemType):
+                    Movie.remove(kodimovie)
         log.info("%s sync is finished." % itemType)
         return True
 
@@ -781,35 +982,34 @@ class LibrarySync(Thread):
         also updates resume times.
         This is done by downloading one XML for ALL elements with viewId
         """
-        if self.new_items_only is False:
-            # Only do this once for fullsync: the first run where new items are
-            # added to Kodi
-            return
-        xml = GetAllPlexLeaves(viewId,
-                               lastViewedAt=lastViewedAt,
-                               updatedAt=updatedAt)
-        # Return if there are no items in PMS reply - it's faster
-        try:
-            xml[0].attrib
-        except (TypeError, AttributeError, IndexError):
-            log.error('Error updating watch status. Could not get viewId: '
-                      '%s of itemType %s with lastViewedAt: %s, updatedAt: '
-                      '%s' % (viewId, itemType, lastViewedAt, updatedAt))
-            return
-
         if itemType in ('Movies', 'TVShows'):
             self.updateKodiVideoLib = True
         elif itemType in ('Music'):
             self.updateKodiMusicLib = True
 
+        # Stream the PMS items - we might get a LOT of them
+        xml = GetAllPlexLeaves(viewId,
+                               lastViewedAt=lastViewedAt,
+                               updatedAt=updatedAt,
+                               stream=True)
         itemMth = getattr(itemtypes, itemType)
         with itemMth() as method:
-            method.updateUserdata(xml)
+            # Items.__exit__ swallows exceptions - catch them in here
+            try:
+                method.updateUserdata(xml)
+            except DownloadChunksError:
+                log.error('Error updating watch status. Could not get viewId: '
+                          '%s of itemType %s with lastViewedAt: %s, '
+                          'updatedAt: %s'
+                          % (viewId, itemType, lastViewedAt, updatedAt))
+                # Don't commit the playstates of only some of the items
+                method.rollback()
 
     @log_time
     def PlexTVShows(self):
         # Initialize
-        self.allPlexElementsId = {}
+        self.allPlexElementsId = set()
+        self.delta_plex_ids = set()
         itemType = 'TVShows'
 
         views = [x for x in self.views if x['itemtype'] == 'show']
@@ -831,7 +1031,7 @@ class LibrarySync(Thread):
 
         # PROCESS TV Shows #####
         self.updatelist = []
-        for view in views:
+        for view in self.stage_views(views, itemType, 'add_update'):
             if self.installSyncDone is not True:
                 state.PATH_VERIFIED = False
             if self.stopped() or self.suspended():
@@ -839,87 +1039,82 @@ class LibrarySync(Thread):
             # Get items per view
             viewId = view['id']
             viewName = view['name']
-            allPlexTvShows = GetPlexSectionResults(viewId)
-            if allPlexTvShows is None:
-                log.error("Error downloading show xml for view %s" % viewId)
-                continue
-            elif allPlexTvShows == 401:
-                return False
+            allPlexTvShows = self.get_section_items(view)
             # Populate self.updatelist and self.allPlexElementsId
-            self.GetUpdatelist(allPlexTvShows,
-                               itemType,
-                               'add_update',
-                               viewName,
-                               viewId)
+            if self.GetUpdatelist(allPlexTvShows,
+                                  itemType,
+                                  'add_update',
+                                  viewName,
+                                  viewId) is False:
+                return False
             log.debug("Analyzed view %s with ID %s" % (viewName, viewId))
 
-        # COPY for later use
-        allPlexTvShowsId = self.allPlexElementsId.copy()
+        # Seasons of new or changed TV shows need to be refreshed, too
+        changed_shows = set(item.plex_id for item in self.updatelist)
+        # Changed TV shows per view
+        view_shows = {}
+        for item in self.updatelist:
+            view_shows.setdefault(item.view_id, set()).add(item.plex_id)
 
         # Process self.updatelist
-        self.GetAndProcessXMLs(itemType)
+        self.GetAndProcessXMLs(itemType, 'add_update')
         log.debug("GetAndProcessXMLs completed for tv shows")
 
         # PROCESS TV Seasons #####
-        # Cycle through tv shows
-        for tvShowId in allPlexTvShowsId:
+        # Get all seasons of a library with one (chunked) PMS request
+        for view in self.stage_views(views, itemType, 'add_updateSeason'):
             if self.stopped() or self.suspended():
                 return False
-            # Grab all seasons to tvshow from PMS
-            seasons = GetAllPlexChildren(tvShowId)
+            seasons = self.get_section_items(view, args={'type': 3})
+            # Populate self.updatelist and self.allPlexElementsId
+            if self.GetUpdatelist(seasons,
+                                  itemType,
+                                  'add_updateSeason',
+                                  view['name'],
+                                  view['id'],
+                                  parents=changed_shows) is False:
+                return False
+            # A delta sync only got the seasons that changed themselves
+            seasons = self.get_changed_children(
+                view, view_shows.get(view['id'], ()))
             if seasons is None:
-                log.error("Error download season xml for show %s" % tvShowId)
-                continue
-            elif seasons == 401:
                 return False
-            # Populate self.updatelist and self.allPlexElementsId
             self.GetUpdatelist(seasons,
                                itemType,
                                'add_updateSeason',
-                               viewName,
-                               viewId)
-            log.debug("Analyzed all seasons of TV show with Plex Id %s"
-                      % tvShowId)
+                               view['name'],
+                               view['id'],
+                               parents=changed_shows)
+            log.debug("Analyzed all seasons of view %s with ID %s"
+                      % (view['name'], view['id']))
 
         # Process self.updatelist
-        self.GetAndProcessXMLs(itemType)
+        self.GetAndProcessXMLs(itemType, 'add_updateSeason')
         log.debug("GetAndProcessXMLs completed for seasons")
 
         # PROCESS TV Episodes #####
         # Cycle through tv shows
-        for view in views:
+        for view in self.stage_views(views, itemType, 'add_updateEpisode'):
             if self.stopped() or self.suspended():
                 return False
             # Grab all episodes to tvshow from PMS
-            episodes = GetAllPlexLeaves(view['id'])
-            if episodes is None:
-                log.error("Error downloading episod xml for view %s"
-                          % view.get('name'))
-                continue
-            elif episodes == 401:
-                return False
+            episodes = self.get_section_items(
+                view,
+                args={'type': 4},
+                leaves=True)
             # Populate self.updatelist and self.allPlexElementsId
-            self.GetUpdatelist(episodes,
-                               itemType,
-                               'add_updateEpisode',
-                               viewName,
-                               viewId)
+            if self.GetUpdatelist(episodes,
+                                  itemType,
+                                  'add_updateEpisode',
+                                  view['name'],
+                                  view['id']) is False:
+                return False
             log.debug("Analyzed all episodes of TV show with Plex Id %s"
                       % view['id'])
 
         # Process self.updatelist
-        self.GetAndProcessXMLs(itemType)
+        self.GetAndProcessXMLs(itemType, 'add_updateEpisode')
         log.debug("GetAndProcessXMLs completed for episodes")
-        # Refresh season info
-        # Cycle through tv shows
-        with itemtypes.TVShows() as TVshow:
-            for tvShowId in allPlexTvShowsId:
-                XMLtvshow = GetPlexMetadata(tvShowId)
-                if XMLtvshow is None or XMLtvshow == 401:
-                    log.error('Could not download XMLtvshow')
-                    continue
-                TVshow.refreshSeasonEntry(XMLtvshow, tvShowId)
-        log.debug("Season info refreshed")
 
         # Update viewstate:
         for view in views:
@@ -930,9 +1125,8 @@ class LibrarySync(Thread):
         if self.compare:
             # Manual sync, process deletes
             with itemtypes.TVShows() as TVShow:
-                for kodiTvElement in self.allKodiElementsId:
-                    if kodiTvElement not in self.allPlexElementsId:
-                        TVShow.remove(kodiTvElement)
+                for kodiTvElement in self.deleted_items(itemType):
+                    TVShow.remove(kodiTvElement)
         log.info("%s sync is finished." % itemType)
         return True
 
@@ -964,7 +1158,8 @@ class LibrarySync(Thread):
                 return False
             log.debug("Start processing music %s" % kind)
             self.allKodiElementsId = {}
-            self.allPlexElementsId = {}
+            self.allPlexElementsId = set()
+            self.delta_plex_ids = set()
             self.updatelist = []
             if self.ProcessMusic(views,
                                  kind,
@@ -972,7 +1167,7 @@ class LibrarySync(Thread):
                                  methods[kind]) is False:
                 return False
             log.debug("Processing of music %s done" % kind)
-            self.GetAndProcessXMLs(itemType)
+            self.GetAndProcessXMLs(itemType, methods[kind])
             log.debug("GetAndProcessXMLs for music %s completed" % kind)
 
         # Update viewstate for EVERY item
@@ -983,7 +1178,7 @@ class LibrarySync(Thread):
 
         # reset stuff
         self.allKodiElementsId = {}
-        self.allPlexElementsId = {}
+        self.allPlexElementsId = set()
         self.updatelist = []
         log.info("%s sync is finished." % itemType)
         return True
@@ -1001,31 +1196,26 @@ class LibrarySync(Thread):
                 # Yet empty/nothing yet synched
                 except ValueError:
                     pass
-        for view in views:
+        for view in self.stage_views(views, 'Music', method):
             if self.installSyncDone is not True:
                 state.PATH_VERIFIED = False
             if self.stopped() or self.suspended():
                 return False
             # Get items per view
-            itemsXML = GetPlexSectionResults(view['id'], args=urlArgs)
-            if itemsXML is None:
-                log.error("Error downloading xml for view %s" % view['id'])
-                continue
-            elif itemsXML == 401:
-                return False
+            itemsXML = self.get_section_items(view, args=urlArgs)
             # Populate self.updatelist and self.allPlexElementsId
-            self.GetUpdatelist(itemsXML,
-                               'Music',
-                               method,
-                               view['name'],
-                               view['id'],
-                               get_children=get_children)
+            if self.GetUpdatelist(itemsXML,
+                                  'Music',
+                                  method,
+                                  view['name'],
+                                  view['id'],
+                                  get_children=get_children) is False:
+                return False
         if self.compare:
             # Manual sync, process deletes
             with itemtypes.Music() as Music:
-                for itemid in self.allKodiElementsId:
-                    if itemid not in self.allPlexElementsId:
-                        Music.remove(itemid)
+                for itemid in self.deleted_items(kind):
+                    Music.remove(itemid)
 
     def processMessage(self, message):
         """
@@ -1051,16 +1241,6 @@ class LibrarySync(Thread):
                 log.error('Received invalid PMS message for activity: %s'
                           % message)
 
-    def multi_delete(self, liste, deleteListe):
-        """
-        Deletes the list items of liste at the positions in deleteListe
-        (which can be in any arbitrary order)
-        """
-        indexes = sorted(deleteListe, reverse=True)
-        for index in indexes:
-            del liste[index]
-        return liste
-
     def processItems(self):
         """
         Periodically called to process new/updated PMS items
@@ -1089,41 +1269,14 @@ class LibrarySync(Thread):
         """
         self.videoLibUpdate = False
         self.musicLibUpdate = False
-        now = unix_timestamp()
-        deleteListe = []
-        for i, item in enumerate(self.itemsToProcess):
-            if self.stopped() or self.suspended():
-                # Chances are that Kodi gets shut down
-                break
-            if item['state'] == 9:
-                successful = self.process_deleteditems(item)
-            elif now - item['timestamp'] < state.BACKGROUNDSYNC_SAFTYMARGIN:
-                # We haven't waited long enough for the PMS to finish
-                # processing the item. Do it later (excepting deletions)
-                continue
-            else:
-                successful = self.process_newitems(item)
-                if successful and settings('FanartTV') == 'true':
-                    if item['type'] in (v.PLEX_TYPE_MOVIE, v.PLEX_TYPE_SHOW):
-                        self.fanartqueue.put({
-                            'plex_id': item['ratingKey'],
-                            'plex_type': item['type'],
-                            'refresh': False
-                        })
-            if successful is True:
-                deleteListe.append(i)
-            else:
-                # Safety net if we can't process an item
-                item['attempt'] += 1
-                if item['attempt'] > 3:
-                    log.error('Repeatedly could not process item %s, abort'
-                              % item)
-                    deleteListe.append(i)
-
-        # Get rid of the items we just processed
-        if len(deleteListe) > 0:
-            self.itemsToProcess = self.multi_delete(
-                self.itemsToProcess, deleteListe)
+        # Deletions are processed immediately. For everything else, we need
+        # to wait until the PMS finished processing the item
+        deletions, updates = self.itemsToProcess.due(
+            unix_timestamp(), state.BACKGROUNDSYNC_SAFTYMARGIN)
+        if deletions:
+            self.process_deleteditems(deletions)
+        if updates:
+            self.process_newitems(updates)
         # Let Kodi know of the change
         if self.videoLibUpdate is True:
             log.info("Doing Kodi Video Lib update")
@@ -1132,63 +1285,116 @@ class LibrarySync(Thread):
             log.info("Doing Kodi Music Lib update")
             xbmc.executebuiltin('UpdateLibrary(music)')
 
-    def process_newitems(self, item):
-        xml = GetPlexMetadata(item['ratingKey'])
-        try:
-            mediatype = xml[0].attrib['type']
-        except (IndexError, KeyError, TypeError):
-            log.error('Could not download metadata for %s' % item['ratingKey'])
-            return False
-        log.debug("Processing new/updated PMS item: %s" % item['ratingKey'])
-        viewtag = xml.attrib.get('librarySectionTitle')
-        viewid = xml.attrib.get('librarySectionID')
-        if mediatype == v.PLEX_TYPE_MOVIE:
-            self.videoLibUpdate = True
-            with itemtypes.Movies() as movie:
-                movie.add_update(xml[0],
-                                 viewtag=viewtag,
-                                 viewid=viewid)
-        elif mediatype == v.PLEX_TYPE_EPISODE:
-            self.videoLibUpdate = True
-            with itemtypes.TVShows() as show:
-                show.add_updateEpisode(xml[0],
-                                       viewtag=viewtag,
-                                       viewid=viewid)
-        elif mediatype == v.PLEX_TYPE_SONG:
-            self.musicLibUpdate = True
-            with itemtypes.Music() as music:
-                music.add_updateSong(xml[0],
-                                     viewtag=viewtag,
-                                     viewid=viewid)
-        return True
+    def process_newitems(self, items):
+        """
+        Downloads the metadata for the new/updated PMS items in batches and
+        writes all items of an itemtypes class with one DB transaction
+        """
+        batch_size = max(1, state.SYNC_METADATA_BATCH_SIZE)
+        for item_class, method, plex_type in (
+                (itemtypes.Movies, 'add_update', v.PLEX_TYPE_MOVIE),
+                (itemtypes.TVShows, 'add_updateEpisode', v.PLEX_TYPE_EPISODE),
+                (itemtypes.Music, 'add_updateSong', v.PLEX_TYPE_SONG)):
+            batch = [item for item in items if item['type'] == plex_type]
+            if not batch:
+                continue
+            log.debug('Processing %s new/updated PMS items of type %s'
+                      % (len(batch), plex_type))
+            if plex_type == v.PLEX_TYPE_SONG:
+                self.musicLibUpdate = True
+            else:
+                self.videoLibUpdate = True
+            with item_class() as item_fct:
+                item_method = getattr(item_fct, method)
+                for i in range(0, len(batch), batch_size):
+                    if self.stopped() or self.suspended():
+                        # Chances are that Kodi gets shut down
+                        return
+                    chunk = batch[i:i + batch_size]
+                    xmls = get_metadata_batch(
+                        [item['ratingKey'] for item in chunk],
+                        'sync_trailers')
+                    for item in chunk:
+                        try:
+                            xml = xmls[item['ratingKey']]
+                        except (TypeError, KeyError):
+                            log.error('Could not download metadata for %s'
+                                      % item['ratingKey'])
+                            self.itemsToProcess.failed(item)
+                            continue
+                        try:
+                            item_method(
+                                xml[0],
+                                viewtag=xml.attrib.get('librarySectionTitle'),
+                                viewid=xml.attrib.get('librarySectionID'))
+                            item_fct.flush()
+                        except Exception as err:
+                            # Don't let one item block the rest of the batch
+                            log.error('Could not process PMS item %s: %s'
+                                      % (item['ratingKey'], err))
+                            import traceback
+                            log.error("Traceback:\n%s"
+                                      % traceback.format_exc())
+                            self.itemsToProcess.failed(item)
+                            continue
+                        self.itemsToProcess.done(item)
+                        if (plex_type == v.PLEX_TYPE_MOVIE and
+                                settings('FanartTV') == 'true'):
+                            self.fanartqueue.put({
+                                'plex_id': item['ratingKey'],
+                                'plex_type': plex_type,
+                                'refresh': False
+                            })
+        # Nothing to do for the other items, e.g. refreshed TV shows
+        for item in items:
+            if item['type'] not in (v.PLEX_TYPE_MOVIE,
+                                    v.PLEX_TYPE_EPISODE,
+                                    v.PLEX_TYPE_SONG):
+                self.itemsToProcess.done(item)
+                if (item['type'] == v.PLEX_TYPE_SHOW and
+                        settings('FanartTV') == 'true'):
+                    self.fanartqueue.put({
+                        'plex_id': item['ratingKey'],
+                        'plex_type': item['type'],
+                        'refresh': False
+                    })
 
-    def process_deleteditems(self, item):
-        if item['type'] == v.PLEX_TYPE_MOVIE:
-            log.debug("Removing movie %s" % item['ratingKey'])
-            self.videoLibUpdate = True
-            with itemtypes.Movies() as movie:
-                movie.remove(item['ratingKey'])
-        elif item['type'] in (v.PLEX_TYPE_SHOW,
-                              v.PLEX_TYPE_SEASON,
-                              v.PLEX_TYPE_EPISODE):
-            log.debug("Removing episode/season/tv show %s" % item['ratingKey'])
-            self.videoLibUpdate = True
-            with itemtypes.TVShows() as show:
-                show.remove(item['ratingKey'])
-        elif item['type'] in (v.PLEX_TYPE_ARTIST,
-                              v.PLEX_TYPE_ALBUM,
-                              v.PLEX_TYPE_SONG):
-            log.debug("Removing song/album/artist %s" % item['ratingKey'])
-            self.musicLibUpdate = True
-            with itemtypes.Music() as music:
-                music.remove(item['ratingKey'])
-        return True
+    def process_deleteditems(self, items):
+        """
+        Removes the PMS items that have been deleted, using one DB transaction
+        per itemtypes class
+        """
+        for item_class, plex_types in (
+                (itemtypes.Movies, (v.PLEX_TYPE_MOVIE,)),
+                (itemtypes.TVShows, (v.PLEX_TYPE_SHOW,
+                                     v.PLEX_TYPE_SEASON,
+                                     v.PLEX_TYPE_EPISODE)),
+                (itemtypes.Music, (v.PLEX_TYPE_ARTIST,
+                                   v.PLEX_TYPE_ALBUM,
+                                   v.PLEX_TYPE_SONG))):
+            batch = [item for item in items if item['type'] in plex_types]
+            if not batch:
+                continue
+            log.debug('Removing %s PMS items of type %s'
+                      % (len(batch), '/'.join(plex_types)))
+            if item_class is itemtypes.Music:
+                self.musicLibUpdate = True
+            else:
+                self.videoLibUpdate = True
+            with item_class() as item_fct:
+                for item in batch:
+                    item_fct.remove(item['ratingKey'])
+                    self.itemsToProcess.done(item)
+        # Forget about deletions of anything else
+        for item in items:
+            self.itemsToProcess.done(item)
 
     def process_timeline(self, data):
         """
         PMS is messing with the library items, e.g. new or changed. Put in our
         "processing queue" for later
         """
+        now = unix_timestamp()
         for item in data:
             if 'tv.plex' in item.get('identifier', ''):
                 # Ommit Plex DVR messages - the Plex IDs are not corresponding
@@ -1200,39 +1406,22 @@ class LibrarySync(Thread):
                 # No need to process extras or trailers
                 continue
             status = int(item['state'])
-            if status == 9:
-                # Immediately and always process deletions (as the PMS will
-                # send additional message with other codes)
-                self.itemsToProcess.append({
-                    'state': status,
-                    'type': typus,
-                    'ratingKey': str(item['itemID']),
-                    'timestamp': unix_timestamp(),
-                    'attempt': 0
-                })
-            elif typus in (v.PLEX_TYPE_MOVIE,
-                           v.PLEX_TYPE_EPISODE,
-                           v.PLEX_TYPE_SONG) and status == 5:
-                plex_id = str(item['itemID'])
-                # Have we already added this element for processing?
-                for existingItem in self.itemsToProcess:
-                    if existingItem['ratingKey'] == plex_id:
-                        break
-                else:
-                    # Haven't added this element to the queue yet
-                    self.itemsToProcess.append({
-                        'state': status,
-                        'type': typus,
-                        'ratingKey': plex_id,
-                        'timestamp': unix_timestamp(),
-                        'attempt': 0
-                    })
+            # Always process deletions (the PMS will send additional messages
+            # with other codes)
+            if status == 9 or (typus in (v.PLEX_TYPE_MOVIE,
+                                         v.PLEX_TYPE_EPISODE,
+                                         v.PLEX_TYPE_SONG) and status == 5):
+                self.itemsToProcess.add(str(item['itemID']),
+                                        typus,
+                                        status,
+                                        now)
 
     def process_activity(self, data):
         """
         PMS is re-scanning an item, e.g. after having changed a movie poster.
         WATCH OUT for this if it's triggered by our PKC library scan!
         """
+        now = unix_timestamp()
         for item in data:
             if item['event'] != 'ended':
                 # Scan still going on, so skip for now
@@ -1247,31 +1436,28 @@ class LibrarySync(Thread):
             if plex_id == '':
                 # Likely a Plex id like /library/metadata/3/children
                 continue
+            if plex_id in self.itemsToProcess:
+                # Already know this element, no need to look it up
+                self.itemsToProcess.add(plex_id, None, None, now)
+                continue
             # We're only looking at existing elements - have we synced yet?
             with plexdb.Get_Plex_DB() as plex_db:
                 kodi_info = plex_db.getItem_byId(plex_id)
             if kodi_info is None:
                 log.debug('Plex id %s not synced yet - skipping' % plex_id)
                 continue
-            # Have we already added this element?
-            for existingItem in self.itemsToProcess:
-                if existingItem['ratingKey'] == plex_id:
-                    break
-            else:
-                # Haven't added this element to the queue yet
-                self.itemsToProcess.append({
-                    'state': None,  # Don't need a state here
-                    'type': kodi_info[5],
-                    'ratingKey': plex_id,
-                    'timestamp': unix_timestamp(),
-                    'attempt': 0
-                })
+            self.itemsToProcess.add(plex_id,
+                                    kodi_info[5],
+                                    None,  # Don't need a state here
+                                    now)
 
     def process_playing(self, data):
         """
         Someone (not necessarily the user signed in) is playing something some-
-        where
+        where. The playstates are written by flush_playstates - immediately if
+        playback stopped, otherwise periodically
         """
+        playback_stopped = False
         for item in data:
             status = item['state']
             if status == 'buffering':
@@ -1333,7 +1519,7 @@ class LibrarySync(Thread):
             # Get an up-to-date XML from the PMS because PMS will NOT directly
             # tell us: duration of item viewCount
             if session.get('duration') is None:
-                xml = GetPlexMetadata(plex_id)
+                xml = GetPlexMetadata(plex_id, 'sync')
                 if xml in (None, 401):
                     log.error('Could not get up-to-date xml for item %s',
                               plex_id)
@@ -1368,15 +1554,46 @@ class LibrarySync(Thread):
                 mark_played = False
             log.debug('Update playstate for user %s with id %s for plex id %s',
                       state.PLEX_USERNAME, state.PLEX_USER_ID, plex_id)
-            item_fkt = getattr(itemtypes,
-                               v.ITEMTYPE_FROM_KODITYPE[session['kodi_type']])
-            with item_fkt() as fkt:
-                fkt.updatePlaystate(mark_played,
-                                    session['viewCount'],
-                                    resume,
-                                    session['duration'],
-                                    session['file_id'],
-                                    unix_date_to_kodi(unix_timestamp()))
+            self.playstates.add(plex_id,
+                                session['kodi_type'],
+                                session['file_id'],
+                                mark_played,
+                                session['viewCount'],
+                                resume,
+                                session['duration'])
+            if status == 'stopped':
+                playback_stopped = True
+        if playback_stopped:
+            self.flush_playstates()
+
+    def flush_playstates(self):
+        """
+        Writes the playstates collected by process_playing with one
+        transaction per Kodi DB
+        """
+        if not self.playstates:
+            return
+        video_playstates = []
+        music_playstates = []
+        for playstate in self.playstates.pop_all():
+            if v.ITEMTYPE_FROM_KODITYPE[playstate['kodi_type']] == 'Music':
+                music_playstates.append(playstate)
+            else:
+                video_playstates.append(playstate)
+        # Movies and TV shows share the Kodi video DB
+        for item_fct, playstates in ((itemtypes.Items, video_playstates),
+                                     (itemtypes.Music, music_playstates)):
+            if not playstates:
+                continue
+            log.debug('Writing %s playstates' % len(playstates))
+            with item_fct() as fkt:
+                for playstate in playstates:
+                    fkt.updatePlaystate(playstate['mark_played'],
+                                        playstate['view_count'],
+                                        playstate['resume'],
+                                        playstate['duration'],
+                                        playstate['file_id'],
+                                        playstate['last_played'])
 
     def fanartSync(self, refresh=False):
         """
@@ -1605,7 +1822,8 @@ class LibrarySync(Thread):
                     log.info('Doing scheduled full library scan')
                     state.DB_SCAN = True
                     window('plex_dbScan', value="true")
-                    if fullSync() is False and not stopped():
+                    if (fullSync(delta=state.DELTA_SYNC) is False and
+                            not stopped()):
                         log.error('Could not finish scheduled full sync')
                         self.force_dialog = True
                         self.showKodiNote(lang(39410),
@@ -1630,21 +1848,29 @@ class LibrarySync(Thread):
                     if now - lastProcessing > 5:
                         lastProcessing = now
                         processItems()
-                    # See if there is a PMS message we need to handle
+                        self.flush_playstates()
+                    # Block until there is a PMS message we need to handle,
+                    # until it's time to process items again or until woken
+                    # up (e.g. to stop or to run a library scan)
                     try:
-                        message = queue.get(block=False)
+                        message = self.get_item(
+                            queue,
+                            timeout=max(0.1, lastProcessing + 5 - now))
                     except Queue.Empty:
-                        xbmc.sleep(100)
                         continue
-                    # Got a message from PMS; process it
-                    else:
+                    if message is not None:
+                        # Got a message from PMS; process it
                         processMessage(message)
                         queue.task_done()
-                        # NO sleep!
-                        continue
+                    # NO sleep!
+                    continue
                 else:
-                    # Still sleep if backgroundsync disabled
-                    xbmc.sleep(100)
+                    # Backgroundsync disabled; wait for a scheduled sync
+                    try:
+                        self.get_item(self.wakeup_queue, timeout=5)
+                    except Queue.Empty:
+                        pass
+                    continue
 
             xbmc.sleep(100)
 
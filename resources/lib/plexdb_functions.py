@@ -13,6 +13,67 @@ log = getLogger("PLEX."+__name__)
 ###############################################################################
 
 
+def _add_view_last_sync(cursor):
+    """
+    Column last_sync: when did we last successfully sync a view (delta sync)
+    """
+    cursor.execute('PRAGMA table_info(view)')
+    if 'last_sync' not in [x[1] for x in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE view ADD COLUMN last_sync INTEGER')
+
+
+def _add_plex_indexes(cursor):
+    """
+    Indexes for all the columns we look up Plex DB items by
+    """
+    for name, columns in (('ix_plex_kodi_id', 'kodi_id, kodi_type'),
+                          ('ix_plex_parent_id', 'parent_id, kodi_type'),
+                          ('ix_plex_plex_type', 'plex_type'),
+                          ('ix_plex_view_id', 'view_id'),
+                          ('ix_plex_fanart', 'fanart_synced, plex_type')):
+        cursor.execute('CREATE INDEX IF NOT EXISTS %s ON plex(%s)'
+                       % (name, columns))
+
+
+def _integer_checksums(cursor):
+    """
+    Checksums used to be strings 'K<plex_id><updatedAt>', now they're the
+    int updatedAt
+    """
+    cursor.execute('''
+        UPDATE plex
+        SET checksum = CAST(substr(checksum, length(plex_id) + 2) AS INTEGER)
+        WHERE typeof(checksum) = 'text'
+    ''')
+
+
+def _add_sync_checkpoint(cursor):
+    """
+    Table sync_checkpoint: how far an interrupted repair sync got, see
+    library_sync.checkpoint
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_checkpoint(
+            stage TEXT PRIMARY KEY,
+            position INTEGER,
+            plex_id TEXT,
+            done INTEGER)
+    ''')
+
+
+# Schema migrations of the Plex DB. The n-th entry brings the DB from
+# PRAGMA user_version n-1 to n. Only ever append new migrations - and make
+# sure they also work on a freshly created DB
+MIGRATIONS = (
+    _add_view_last_sync,
+    _add_plex_indexes,
+    _integer_checksums,
+    _add_sync_checkpoint
+)
+
+###############################################################################
+
+
 class Get_Plex_DB():
     """
     Usage: with Get_Plex_DB() as plex_db:
@@ -35,6 +96,19 @@ class Plex_DB_Functions():
     def __init__(self, plexcursor):
         self.plexcursor = plexcursor
 
+    def migrate(self):
+        """
+        Brings the Plex DB schema up to date, see MIGRATIONS
+        """
+        self.plexcursor.execute('PRAGMA user_version')
+        version = self.plexcursor.fetchone()[0]
+        for version in range(version, len(MIGRATIONS)):
+            log.info('Migrating the Plex DB to schema version %s'
+                     % (version + 1))
+            MIGRATIONS[version](self.plexcursor)
+            self.plexcursor.execute('PRAGMA user_version = %s'
+                                    % (version + 1))
+
     def getViews(self):
         """
         Returns a list of view_id
@@ -59,11 +133,16 @@ class Plex_DB_Functions():
             'itemtype': kodi_type
             'kodi_tagid'
             'sync_to_kodi'
+            'last_sync'             PMS timestamp of last successful full sync
         }
         """
         plexcursor = self.plexcursor
         views = []
-        query = '''SELECT * FROM view'''
+        query = '''
+            SELECT view_id, view_name, kodi_type, kodi_tagid, sync_to_kodi,
+                last_sync
+            FROM view
+        '''
         plexcursor.execute(query)
         rows = plexcursor.fetchall()
         for row in rows:
@@ -71,7 +150,8 @@ class Plex_DB_Functions():
                           'name': row[1],
                           'itemtype': row[2],
                           'kodi_tagid': row[3],
-                          'sync_to_kodi': row[4]})
+                          'sync_to_kodi': row[4],
+                          'last_sync': row[5]})
         return views
 
     def getView_byId(self, view_id):
@@ -153,6 +233,45 @@ class Plex_DB_Functions():
         '''
         self.plexcursor.execute(query, (view_name, kodi_tagid, view_id))
 
+    def set_view_last_sync(self, view_id, last_sync):
+        """
+        Sets the PMS timestamp last_sync of the last successful full sync for
+        view_id. Pass last_sync=None to force a complete sync next time
+        """
+        query = '''UPDATE view SET last_sync = ? WHERE view_id = ?'''
+        self.plexcursor.execute(query, (last_sync, view_id))
+
+    def get_sync_checkpoints(self):
+        """
+        Returns a dict with the checkpoints of an interrupted repair sync:
+            {stage: (position, plex_id, done)}
+        The dict is empty if no repair sync is pending
+        """
+        self.plexcursor.execute('''
+            SELECT stage, position, plex_id, done FROM sync_checkpoint
+        ''')
+        return dict((row[0], (row[1], row[2], row[3] == 1))
+                    for row in self.plexcursor.fetchall())
+
+    def set_sync_checkpoint(self, stage, position, plex_id, done=False):
+        """
+        Remembers that the first position items of stage have been synced,
+        plex_id being the last one of them
+        """
+        query = '''
+            INSERT OR REPLACE INTO sync_checkpoint(
+                stage, position, plex_id, done)
+            VALUES (?, ?, ?, ?)
+        '''
+        self.plexcursor.execute(query,
+                                (stage, position, plex_id, 1 if done else 0))
+
+    def clear_sync_checkpoints(self):
+        """
+        Call once a repair sync finished successfully
+        """
+        self.plexcursor.execute('DELETE FROM sync_checkpoint')
+
     def removeView(self, view_id):
         query = '''
             DELETE FROM view
@@ -278,7 +397,7 @@ class Plex_DB_Functions():
             SELECT plex_id, kodi_id, kodi_fileid
             FROM plex
             WHERE parent_id = ?
-            AND kodi_type = ?"
+            AND kodi_type = ?
         '''
         self.plexcursor.execute(query, (parent_id, kodi_type,))
         return self.plexcursor.fetchall()
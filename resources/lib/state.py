@@ -34,6 +34,8 @@ FETCH_PMS_ITEM_NUMBER = None
 # Stemming from the PKC settings.xml
 # Shall we show Kodi dialogs when synching?
 SYNC_DIALOG = True
+# Shall we dump the sync telemetry to a file after every full sync?
+SYNC_TELEMETRY_FILE = False
 # Have we already checked the Kodi DB on consistency?
 KODI_DB_CHECKED = False
 # Is synching of Plex music enabled?
@@ -42,11 +44,24 @@ ENABLE_MUSIC = True
 FULL_SYNC_INTERVALL = 0
 # Background Sync enabled at all?
 BACKGROUND_SYNC = True
+# Shall scheduled full syncs only get the PMS items that changed since the
+# last successful full sync?
+DELTA_SYNC = True
 # How long shall we wait with synching a new item to make sure Plex got all
 # metadata?
 BACKGROUNDSYNC_SAFTYMARGIN = 0
 # How many threads to download Plex metadata on sync?
 SYNC_THREAD_NUMBER = 0
+# For how many Plex items shall we download the metadata with one request?
+SYNC_METADATA_BATCH_SIZE = 1
+# How many threads to convert the downloaded Plex metadata before writing it
+# to the Kodi DB (always with one single writer thread)?
+SYNC_PARSE_THREAD_NUMBER = 2
+# After how many processed items shall we commit the DB changes on sync?
+DB_COMMIT_INTERVAL = 200
+# Max. estimated size in bytes of the PMS metadata waiting in each of the sync
+# queues for the parse and processing threads
+SYNC_QUEUE_BYTES = 16 * 1024 * 1024
 # What's the time offset between the PMS and Kodi?
 KODI_PLEX_TIME_OFFSET = 0.0
 
@@ -78,6 +93,9 @@ PLEX_TOKEN = None
 # Plex token for the active PMS for the active user
 # (might be diffent to PLEX_TOKEN)
 PMS_TOKEN = None
+# Address of the active PMS, e.g. 'https://192.168.1.2:32400'. Along with
+# window('pms_server')
+PMS_SERVER = None
 # Plex ID of that user (e.g. for plex.tv) as a STRING
 PLEX_USER_ID = None
 # Token passed along, e.g. if playback initiated by Plex Companion. Might be
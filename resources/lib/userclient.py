@@ -7,7 +7,8 @@ from xbmc import sleep, executebuiltin, translatePath
 import xbmcaddon
 from xbmcvfs import exists
 
-from utils import window, settings, language as lang, thread_methods, dialog
+from utils import window, settings, language as lang, thread_methods, \
+    dialog, wake_up_threads
 from downloadutils import DownloadUtils as DU
 import plex_tv
 import PlexFunctions as PF
@@ -151,6 +152,7 @@ class UserClient(Thread):
         state.RESTRICTED_USER = True \
             if settings('plex_restricteduser') == 'true' else False
         window('pms_server', value=self.currServer)
+        state.PMS_SERVER = self.currServer
         window('plex_machineIdentifier', value=self.machineIdentifier)
         window('plex_servername', value=self.servername)
         window('plex_authenticated', value='true')
@@ -268,6 +270,7 @@ class UserClient(Thread):
         state.PMS_TOKEN = None
         window('plex_token', clear=True)
         window('pms_server', clear=True)
+        state.PMS_SERVER = None
         window('plex_machineIdentifier', clear=True)
         window('plex_servername', clear=True)
         state.PLEX_USER_ID = None
@@ -324,6 +327,7 @@ class UserClient(Thread):
                         LOG.info("Current userId: %s", state.PLEX_USER_ID)
                         self.retry = 0
                         state.SUSPEND_LIBRARY_THREAD = False
+                        wake_up_threads()
                         window('plex_serverStatus', clear=True)
                         state.PMS_STATUS = False
 
@@ -6,10 +6,12 @@ Various functions and decorators for PKC
 from logging import getLogger
 from cProfile import Profile
 from pstats import Stats
-from sqlite3 import connect, OperationalError
+from sqlite3 import connect, OperationalError, Error
+from threading import local, Lock
+from Queue import Queue, Empty, Full
 from datetime import datetime, timedelta
 from StringIO import StringIO
-from time import localtime, strftime
+from time import localtime, strftime, time
 from unicodedata import normalize
 import xml.etree.ElementTree as etree
 from functools import wraps, partial
@@ -18,6 +20,8 @@ from os.path import join
 from os import remove, walk, makedirs
 from shutil import rmtree
 from urllib import quote_plus
+from collections import OrderedDict
+from re import compile as re_compile, IGNORECASE
 
 import xbmc
 import xbmcaddon
@@ -34,6 +38,22 @@ LOG = getLogger("PLEX." + __name__)
 WINDOW = xbmcgui.Window(10000)
 ADDON = xbmcaddon.Addon(id='plugin.video.plexkodiconnect')
 
+# Used by BufferedCursor to find the table an SQL statement writes to/reads
+REGEX_SQL_WRITE = re_compile(
+    r'''^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|'''
+    r'''UPDATE(?:\s+OR\s+\w+)?)\s+(\w+)''', IGNORECASE)
+REGEX_SQL_READ = re_compile(r'''\b(?:FROM|JOIN)\s+(\w+)''', IGNORECASE)
+
+# Put into a queue to wake up a thread blocking in get_item(), see
+# thread_methods
+SENTINEL = object()
+# {queue: number of threads blocking in get_item() on that queue}
+WAITING = {}
+WAITING_LOCK = Lock()
+# Functions that wake up threads waiting on something else than a queue, e.g.
+# on a socket. Called by wake_up_threads()
+WAKE_UP_CALLBACKS = []
+
 ###############################################################################
 # Main methods
 
@@ -334,9 +354,82 @@ def unix_timestamp(seconds_into_the_future=None):
     return timegm(future.timetuple())
 
 
+class PooledConnection(object):
+    """
+    An sqlite3 connection borrowed from a DBConnectionPool. Use it like any
+    sqlite3 connection; close() hands it back to the pool instead of closing
+    it. Uncommitted changes are rolled back, just like on a real close()
+    """
+    def __init__(self, connection, idle):
+        self.connection = connection
+        self.idle = idle
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def close(self):
+        if self.connection is None:
+            return
+        connection = self.connection
+        self.connection = None
+        try:
+            # Also resets all statements, releasing any DB locks
+            connection.rollback()
+        except Error:
+            connection.close()
+            return
+        if len(self.idle) < DBConnectionPool.MAX_IDLE:
+            self.idle.append(connection)
+        else:
+            connection.close()
+
+
+class DBConnectionPool(object):
+    """
+    Keeps sqlite3 connections open for reuse instead of opening the DB file
+    again and again. sqlite3 connections may only be used by the thread that
+    created them, hence every thread gets its own connections per DB. They
+    are closed automatically once the thread has finished.
+    """
+    # Idle connections to keep per thread and DB
+    MAX_IDLE = 2
+    # Number of prepared statements sqlite3 caches per connection
+    CACHED_STATEMENTS = 200
+
+    def __init__(self):
+        self.local = local()
+
+    def borrow(self, db_path):
+        """
+        Returns a PooledConnection to the DB at db_path
+        """
+        idle = self.local.__dict__.setdefault(db_path, [])
+        try:
+            connection = idle.pop()
+        except IndexError:
+            connection = self.connect(db_path)
+        return PooledConnection(connection, idle)
+
+    @classmethod
+    def connect(cls, db_path):
+        connection = connect(db_path,
+                             timeout=60.0,
+                             cached_statements=cls.CACHED_STATEMENTS)
+        if db_path == v.DB_PLEX_PATH:
+            # Our very own DB - we may choose how SQLite writes to it. Don't
+            # touch Kodi's DBs, Kodi might not be able to cope
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+
+DB_POOL = DBConnectionPool()
+
+
 def kodi_sql(media_type=None):
     """
-    Open a connection to the Kodi database.
+    Open a connection to the Kodi database. The connection is borrowed from
+    DB_POOL; close() hands it back.
         media_type: 'video' (standard if not passed), 'plex', 'music', 'texture'
     """
     if media_type == "plex":
@@ -347,7 +440,133 @@ def kodi_sql(media_type=None):
         db_path = v.DB_TEXTURE_PATH
     else:
         db_path = v.DB_VIDEO_PATH
-    return connect(db_path, timeout=60.0)
+    return DB_POOL.borrow(db_path)
+
+
+class BufferedCursor(object):
+    """
+    Wraps an sqlite3 cursor. INSERTs and UPDATEs are not executed right away
+    but gathered per DB table. Writes to the same table using the same SQL
+    statement are later executed with one executemany, e.g. all the actor
+    links of a movie.
+
+    Writes to one table are executed in their original order, tables in the
+    order they were first written to. DELETEs (which fire Kodi's triggers,
+    e.g. delete_tag), writes containing a sub-SELECT and any other statement
+    are never buffered but executed immediately, after all pending writes. A
+    SELECT flushes all pending writes only if it reads from a table (or
+    view) with pending writes - hence reads always see the previous writes.
+
+    Call flush() after every item (see itemtypes.Items.flush), so that writes
+    are only ever reordered within one item and an SQL error is raised for
+    the item that caused it. Also call flush() before committing the
+    cursor's connection!
+
+    statements counts the SQL statements passed in by the caller, sql_time
+    the seconds spent executing them in SQLite
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.statements = 0
+        self.sql_time = 0.0
+        # {table: [[query, [args, args, ...]], ...]}, in order of first write
+        self.pending = OrderedDict()
+        # SQL error of a failed flush, until raise_error() or discard()
+        self.error = None
+
+    def execute(self, query, args=()):
+        """
+        Same as sqlite3's cursor.execute(), but buffers writes
+        """
+        self.statements += 1
+        write = REGEX_SQL_WRITE.match(query)
+        if write and 'SELECT' not in query.upper():
+            runs = self.pending.setdefault(write.group(1).lower(), [])
+            if runs and runs[-1][0] == query:
+                runs[-1][1].append(args)
+            else:
+                runs.append([query, [args]])
+            return self
+        if self.pending:
+            tables = REGEX_SQL_READ.findall(query)
+            if (not tables or
+                    query.lstrip()[:6].upper() != 'SELECT' or
+                    any(table.lower() in self.pending or
+                        table.lower().endswith('_view')
+                        for table in tables)):
+                self.flush()
+        started = time()
+        self.cursor.execute(query, args)
+        self.sql_time += time() - started
+        return self
+
+    def executemany(self, query, args):
+        """
+        Same as sqlite3's cursor.executemany(), flushes pending writes first
+        """
+        self.statements += 1
+        self.flush()
+        started = time()
+        self.cursor.executemany(query, args)
+        self.sql_time += time() - started
+        return self
+
+    def flush(self):
+        """
+        Executes all pending writes, with one executemany per run of the same
+        SQL statement
+        """
+        pending = self.pending
+        self.pending = OrderedDict()
+        started = time()
+        try:
+            for runs in pending.itervalues():
+                for query, args in runs:
+                    if len(args) == 1:
+                        self.cursor.execute(query, args[0])
+                    else:
+                        self.cursor.executemany(query, args)
+        except Exception as err:
+            # Our caller might swallow the error, e.g. with catch_exceptions
+            if self.error is None:
+                self.error = err
+            raise
+        finally:
+            self.sql_time += time() - started
+
+    def raise_error(self):
+        """
+        Raises the SQL error of a failed flush() since the last call, if any
+        """
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def discard(self):
+        """
+        Forgets all pending writes, e.g. on rollback
+        """
+        self.pending = OrderedDict()
+        self.error = None
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchmany(self, *args):
+        return self.cursor.fetchmany(*args)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def close(self):
+        """
+        Flushes pending writes and closes the underlying cursor
+        """
+        self.flush()
+        self.cursor.close()
 
 
 def create_actor_db_index():
@@ -437,6 +656,8 @@ def reset():
             cursor.execute("DELETE FROM %s" % tablename)
     cursor.execute('DROP table IF EXISTS plex')
     cursor.execute('DROP table IF EXISTS view')
+    # Tables will be recreated - along with all the schema migrations
+    cursor.execute('PRAGMA user_version = 0')
     connection.commit()
     cursor.close()
 
@@ -1028,6 +1249,114 @@ def log_time(func):
     return wrapper
 
 
+def _wake_up(queue, number):
+    """
+    Puts number SENTINELs into queue
+    """
+    for _ in range(number):
+        try:
+            queue.put_nowait(SENTINEL)
+        except Full:
+            # Nobody can be blocking on a full queue
+            break
+
+
+def wake_up_threads():
+    """
+    Wakes up all threads blocking in get_item() or registered with
+    register_wake_up(). Call after setting a state.py variable that stops
+    threads, e.g. state.STOP_SYNC
+    """
+    with WAITING_LOCK:
+        waiting = WAITING.items()
+        callbacks = list(WAKE_UP_CALLBACKS)
+    for queue, number in waiting:
+        _wake_up(queue, number)
+    for callback in callbacks:
+        callback()
+
+
+def register_wake_up(callback):
+    """
+    Let wake_up_threads() call callback, e.g. to wake up a thread waiting on
+    a socket
+    """
+    with WAITING_LOCK:
+        WAKE_UP_CALLBACKS.append(callback)
+
+
+def unregister_wake_up(callback):
+    """
+    Undoes register_wake_up(callback)
+    """
+    with WAITING_LOCK:
+        WAKE_UP_CALLBACKS.remove(callback)
+
+
+def purge_queue(queue):
+    """
+    Empties queue and calls task_done() for every item, e.g. in order to not
+    block the threads waiting on queue.join(). SENTINELs are put back for the
+    threads still blocking on queue since they were meant for them
+    """
+    sentinels = 0
+    while True:
+        try:
+            item = queue.get(block=False)
+        except Empty:
+            break
+        if item is SENTINEL:
+            sentinels += 1
+        queue.task_done()
+    with WAITING_LOCK:
+        sentinels = min(sentinels, WAITING.get(queue, 0))
+    _wake_up(queue, sentinels)
+
+
+class ByteBoundedQueue(Queue):
+    """
+    Queue.Queue that is bounded by the total size in bytes of its items
+    instead of their number. An item's size is taken from its attribute size
+    (0 if missing, e.g. for SENTINEL). put() blocks while adding the item
+    would exceed max_bytes - unless the queue is empty, so that a single
+    large item can always pass
+    """
+    def __init__(self, max_bytes):
+        Queue.__init__(self)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+
+    def _is_full(self, size):
+        return (size and self.bytes and
+                self.bytes + size > self.max_bytes)
+
+    def put(self, item, block=True, timeout=None):
+        size = getattr(item, 'size', 0)
+        with self.not_full:
+            if not block:
+                if self._is_full(size):
+                    raise Full
+            elif timeout is None:
+                while self._is_full(size):
+                    self.not_full.wait()
+            else:
+                endtime = time() + timeout
+                while self._is_full(size):
+                    remaining = endtime - time()
+                    if remaining <= 0.0:
+                        raise Full
+                    self.not_full.wait(remaining)
+            self._put(item)
+            self.bytes += size
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def _get(self):
+        item = Queue._get(self)
+        self.bytes -= getattr(item, 'size', 0)
+        return item
+
+
 def thread_methods(cls=None, add_stops=None, add_suspends=None):
     """
     Decorator to add the following methods to a threading class:
@@ -1036,9 +1365,15 @@ def thread_methods(cls=None, add_stops=None, add_suspends=None):
     resume():           resumes the thread
     stop():             stopps/kills the thread
 
+    stop() and resume() also call the thread's wake_up() method, if it has
+    one, e.g. to interrupt a thread waiting on a socket
+
     suspended():        returns True if thread is suspended
     stopped():          returns True if thread is stopped (or should stop ;-))
                         ALSO returns True if PKC should exit
+    get_item(queue):    blocks until there is an item in queue, without
+                        polling. Returns None if the thread got woken up by
+                        stop() or wake_up_threads() instead
 
     Also adds the following class attributes:
         thread_stopped
@@ -1073,9 +1408,17 @@ def thread_methods(cls=None, add_stops=None, add_suspends=None):
     # Define new class methods and attach them to class
     def stop(self):
         """
-        Call to stop this thread
+        Call to stop this thread. Wakes the thread up if it is blocking in
+        get_item() on its queue self.queue
         """
         self.thread_stopped = True
+        queue = getattr(self, 'queue', None)
+        if queue is not None:
+            with WAITING_LOCK:
+                number = WAITING.get(queue, 0)
+            _wake_up(queue, number)
+        if hasattr(self, 'wake_up'):
+            self.wake_up()
     cls.stop = stop
 
     def suspend(self):
@@ -1090,6 +1433,8 @@ def thread_methods(cls=None, add_stops=None, add_suspends=None):
         Call to revive a suspended thread back to life
         """
         self.thread_suspended = False
+        if hasattr(self, 'wake_up'):
+            self.wake_up()
     cls.resume = resume
 
     def suspended(self):
@@ -1116,6 +1461,31 @@ def thread_methods(cls=None, add_stops=None, add_suspends=None):
         return False
     cls.stopped = stopped
 
+    def get_item(self, queue, timeout=None):
+        """
+        Blocks until an item is available in queue and returns it. Returns
+        None if the thread is stopped or got woken up by stop() or
+        wake_up_threads() - check stopped() and suspended() again in that
+        case. Raises Queue.Empty if timeout [s] passed without an item
+        """
+        # Register first so that a stop in between is sure to wake us up
+        with WAITING_LOCK:
+            WAITING[queue] = WAITING.get(queue, 0) + 1
+        try:
+            if self.stopped():
+                return None
+            item = queue.get(timeout=timeout)
+        finally:
+            with WAITING_LOCK:
+                WAITING[queue] -= 1
+                if WAITING[queue] == 0:
+                    del WAITING[queue]
+        if item is SENTINEL:
+            queue.task_done()
+            return None
+        return item
+    cls.get_item = get_item
+
     # Return class to render this a decorator
     return cls
 
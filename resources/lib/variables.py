@@ -115,6 +115,8 @@ DB_PLEX_PATH = try_decode(xbmc.translatePath("special://database/plex.db"))
 
 EXTERNAL_SUBTITLE_TEMP_PATH = try_decode(xbmc.translatePath(
     "special://profile/addon_data/%s/temp/" % ADDON_ID))
+SYNC_TELEMETRY_PATH = try_decode(xbmc.translatePath(
+    "special://profile/addon_data/%s/sync_telemetry.json" % ADDON_ID))
 
 
 # Multiply Plex time by this factor to receive Kodi time
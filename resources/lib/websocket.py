@@ -35,7 +35,6 @@ except ImportError:
 
 from urlparse import urlparse
 import os
-import array
 import struct
 import uuid
 import hashlib
@@ -211,6 +210,11 @@ _MAX_INTEGER = (1 << 32) -1
 _AVAILABLE_KEY_CHARS = range(0x21, 0x2f + 1) + range(0x3a, 0x7e + 1)
 _MAX_CHAR_BYTE = (1<<8) -1
 
+# Number of bytes to read ahead from the socket, saving syscalls
+_RECV_BUFFER_SIZE = 16384
+# Translation tables to xor every byte with a given byte, see ABNF.mask
+_XOR_TABLES = {}
+
 # ref. Websocket gets an update, and it breaks stuff.
 # http://axod.blogspot.com/2010/06/websocket-gets-update-and-it-breaks.html
 
@@ -308,27 +312,24 @@ class ABNF(object):
         if length >= ABNF.LENGTH_63:
             raise ValueError("data is too long")
 
-        frame_header = chr(self.fin << 7
-                           | self.rsv1 << 6 | self.rsv2 << 5 | self.rsv3 << 4
-                           | self.opcode)
+        b1 = (self.fin << 7 | self.rsv1 << 6 | self.rsv2 << 5 |
+              self.rsv3 << 4 | self.opcode)
+        b2 = self.mask << 7
         if length < ABNF.LENGTH_7:
-            frame_header += chr(self.mask << 7 | length)
+            frame_header = struct.pack("!BB", b1, b2 | length)
         elif length < ABNF.LENGTH_16:
-            frame_header += chr(self.mask << 7 | 0x7e)
-            frame_header += struct.pack("!H", length)
+            frame_header = struct.pack("!BBH", b1, b2 | 0x7e, length)
         else:
-            frame_header += chr(self.mask << 7 | 0x7f)
-            frame_header += struct.pack("!Q", length)
+            frame_header = struct.pack("!BBQ", b1, b2 | 0x7f, length)
 
         if not self.mask:
             return frame_header + self.data
         else:
             mask_key = self.get_mask_key(4)
-            return frame_header + self._get_masked(mask_key)
+            return "".join((frame_header, self._get_masked(mask_key)))
 
     def _get_masked(self, mask_key):
-        s = ABNF.mask(mask_key, self.data)
-        return mask_key + "".join(s)
+        return mask_key + ABNF.mask(mask_key, self.data)
 
     @staticmethod
     def mask(mask_key, data):
@@ -338,12 +339,19 @@ class ABNF(object):
         mask_key: 4 byte string(byte).
 
         data: data to mask/unmask.
+
+        Instead of looping over every byte in Python, every 4th byte is
+        translated in one go with a table for the according byte of mask_key
         """
-        _m = array.array("B", mask_key)
-        _d = array.array("B", data)
-        for i in xrange(len(_d)):
-            _d[i] ^= _m[i % 4]
-        return _d.tostring()
+        masked = bytearray(len(data))
+        for i in xrange(4):
+            key = ord(mask_key[i])
+            table = _XOR_TABLES.get(key)
+            if table is None:
+                table = str(bytearray(b ^ key for b in xrange(256)))
+                _XOR_TABLES[key] = table
+            masked[i::4] = data[i::4].translate(table)
+        return str(masked)
 
 
 class WebSocket(object):
@@ -386,8 +394,9 @@ class WebSocket(object):
         self.sslopt = sslopt
         self.get_mask_key = get_mask_key
         # Buffers over the packets from the layer beneath until desired amount
-        # bytes of bytes are received.
-        self._recv_buffer = []
+        # bytes of bytes are received. Bytes before _recv_offset are consumed
+        self._recv_buffer = ""
+        self._recv_offset = 0
         # These buffer over the build-up of a single frame.
         self._frame_header = None
         self._frame_length = None
@@ -397,6 +406,16 @@ class WebSocket(object):
     def fileno(self):
         return self.sock.fileno()
 
+    def has_buffered_data(self):
+        """
+        True if bytes have been read from the socket but not consumed yet,
+        e.g. by us or by SSL. select() does not know about them
+        """
+        if len(self._recv_buffer) > self._recv_offset:
+            return True
+        pending = getattr(self.sock, 'pending', None)
+        return pending is not None and pending() > 0
+
     def set_mask_key(self, func):
         """
         set function to create musk key. You can custumize mask key generator.
@@ -617,14 +636,15 @@ class WebSocket(object):
             elif frame.opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY, ABNF.OPCODE_CONT):
                 if frame.opcode == ABNF.OPCODE_CONT and not self._cont_data:
                     raise WebSocketException("Illegal frame")
+                # Collect the fragments and join them once we got them all
                 if self._cont_data:
-                    self._cont_data[1] += frame.data
+                    self._cont_data[1].append(frame.data)
                 else:
-                    self._cont_data = [frame.opcode, frame.data]
+                    self._cont_data = [frame.opcode, [frame.data]]
                 if frame.fin:
-                    data = self._cont_data
+                    opcode, fragments = self._cont_data
                     self._cont_data = None
-                    return data
+                    return opcode, "".join(fragments)
             elif frame.opcode == ABNF.OPCODE_CLOSE:
                 self.send_close()
                 return (frame.opcode, None)
@@ -754,18 +774,29 @@ class WebSocket(object):
 
 
     def _recv_strict(self, bufsize):
-        shortage = bufsize - sum(len(x) for x in self._recv_buffer)
-        while shortage > 0:
-            bytes_ = self._recv(shortage)
-            self._recv_buffer.append(bytes_)
-            shortage -= len(bytes_)
-        unified = "".join(self._recv_buffer)
-        if shortage == 0:
-            self._recv_buffer = []
-            return unified
-        else:
-            self._recv_buffer = [unified[bufsize:]]
-            return unified[:bufsize]
+        """
+        Returns exactly bufsize bytes. Reads ahead from the socket; the
+        buffer is only copied if it does not hold enough bytes anymore
+        """
+        buf = self._recv_buffer
+        offset = self._recv_offset
+        available = len(buf) - offset
+        if available < bufsize:
+            chunks = [buf[offset:]]
+            try:
+                while available < bufsize:
+                    bytes_ = self._recv(max(bufsize - available,
+                                            _RECV_BUFFER_SIZE))
+                    chunks.append(bytes_)
+                    available += len(bytes_)
+            finally:
+                # Keep what we got even if the socket timed out
+                buf = self._recv_buffer = "".join(chunks)
+                offset = self._recv_offset = 0
+        self._recv_offset = offset + bufsize
+        if offset == 0 and bufsize == len(buf):
+            return buf
+        return buf[offset:offset + bufsize]
 
 
     def _recv_line(self):
@@ -2,15 +2,19 @@
 
 ###############################################################################
 from logging import getLogger
+from re import compile as re_compile
 import websocket
 from json import loads
 import xml.etree.ElementTree as etree
 from threading import Thread
 from ssl import CERT_NONE
+from select import select, error as SelectError
+from random import uniform
+from time import time
+import socket
 
-from xbmc import sleep
-
-from utils import window, settings, thread_methods
+from utils import window, settings, thread_methods, register_wake_up, \
+    unregister_wake_up
 from companion import process_command
 import state
 import variables as v
@@ -19,14 +23,62 @@ import variables as v
 
 LOG = getLogger("PLEX." + __name__)
 
+# Matches PMS messages of a type we're interested in, see PMS_Websocket
+REGEX_MESSAGE_TYPE = re_compile(
+    r'''"type"\s*:\s*"(?:playing|timeline|activity)"''')
+
+# Seconds without any frame from the server after which we send a ping. If
+# we still didn't get anything after another PING_INTERVAL, we reconnect
+PING_INTERVAL = 30
+# Seconds to wait for the server while connecting or receiving a frame
+SOCKET_TIMEOUT = 5
+# Delay in seconds before reconnecting: BACKOFF_BASE * 2^(attempts - 1), at
+# most BACKOFF_MAX, randomly shortened by up to half (jitter)
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 60
+# Declare the connection dead after this many failed attempts to connect
+DEAD_AFTER_ATTEMPTS = 4
+
 ###############################################################################
 
 
+def _socketpair():
+    """
+    Returns a pair of connected sockets. We can't use os.pipe() since
+    select() only works with sockets on Windows
+    """
+    try:
+        return socket.socketpair()
+    except AttributeError:
+        # Not available on Windows
+        listener = socket.socket()
+        try:
+            listener.bind(('127.0.0.1', 0))
+            listener.listen(1)
+            sock = socket.create_connection(listener.getsockname())
+            peer = listener.accept()[0]
+        finally:
+            listener.close()
+        return sock, peer
+
+
 class WebSocket(Thread):
+    """
+    Waits for frames from the server with select() on the websocket and on
+    a shutdown pipe, so the thread neither polls nor needs socket timeouts
+    to notice that it should stop. Keeps the connection alive with pings
+    and reconnects with exponential backoff and jitter
+    """
     opcode_data = (websocket.ABNF.OPCODE_TEXT, websocket.ABNF.OPCODE_BINARY)
 
     def __init__(self):
         self.ws = None
+        # Shutdown pipe - wake_up() writes to it to interrupt select()
+        self.wakeup_receiver = None
+        self.wakeup_sender = None
+        # When we received the last frame and sent a ping since then
+        self.last_received = 0
+        self.ping_sent = None
         super(WebSocket, self).__init__()
 
     def process(self, opcode, message):
@@ -53,10 +105,80 @@ class WebSocket(Thread):
     def getUri(self):
         raise NotImplementedError
 
+    def wake_up(self):
+        """
+        Interrupts the thread waiting for the server or for reconnecting, e.g.
+        in order to stop it. Called by utils.wake_up_threads()
+        """
+        try:
+            self.wakeup_sender.send('x')
+        except (AttributeError, socket.error):
+            # Not running or pipe full, i.e. already woken up
+            pass
+
+    def wait(self, timeout, ws=None):
+        """
+        Blocks until the websocket ws (if given) is readable, until wake_up()
+        has been called or for timeout seconds.
+
+        Returns True if ws is readable
+        """
+        waiting_for = [self.wakeup_receiver]
+        if ws is not None:
+            waiting_for.append(ws)
+        try:
+            readable = select(waiting_for, [], [], timeout)[0]
+        except (SelectError, socket.error) as err:
+            # E.g. interrupted by a signal
+            LOG.debug('%s: select() failed: %s', self.__class__.__name__, err)
+            return False
+        if self.wakeup_receiver in readable:
+            try:
+                self.wakeup_receiver.recv(4096)
+            except socket.error:
+                pass
+        return ws is not None and ws in readable
+
+    def keepalive(self):
+        """
+        Pings the server if we didn't hear from it for PING_INTERVAL seconds.
+        Closes the connection if it didn't answer within PING_INTERVAL
+        """
+        now = time()
+        if self.ping_sent is not None:
+            if now - self.ping_sent >= PING_INTERVAL:
+                LOG.info('%s: server did not answer our ping, reconnecting',
+                         self.__class__.__name__)
+                self.close()
+        elif now - self.last_received >= PING_INTERVAL:
+            self.ws.ping()
+            self.ping_sent = now
+
+    def close(self):
+        """
+        Closes the websocket connection, if any
+        """
+        if self.ws is not None:
+            self.ws.close()
+            self.ws = None
+
     def run(self):
         LOG.info("----===## Starting %s ##===----", self.__class__.__name__)
+        self.wakeup_receiver, self.wakeup_sender = _socketpair()
+        register_wake_up(self.wake_up)
+        try:
+            self._run()
+        finally:
+            unregister_wake_up(self.wake_up)
+            # Close websocket connection on shutdown
+            self.close()
+            self.wakeup_receiver.close()
+            self.wakeup_sender.close()
+        LOG.info("##===---- %s Stopped ----===##", self.__class__.__name__)
 
-        counter = 0
+    def _run(self):
+        # Number of failed attempts to connect in a row
+        attempts = 0
         handshake_counter = 0
         stopped = self.stopped
         suspended = self.suspended
@@ -64,45 +186,43 @@ class WebSocket(Thread):
             # In the event the server goes offline
             while suspended():
                 # Set in service.py
-                if self.ws is not None:
-                    self.ws.close()
-                    self.ws = None
+                self.close()
                 if stopped():
                     # Abort was requested while waiting. We should exit
-                    LOG.info("##===---- %s Stopped ----===##",
-                             self.__class__.__name__)
                     return
-                sleep(1000)
-            try:
-                self.process(*self.receive(self.ws))
-            except websocket.WebSocketTimeoutException:
-                # No worries if read timed out
-                pass
-            except websocket.WebSocketConnectionClosedException:
+                # resume(), stop() and wake_up_threads() wake us up
+                self.wait(None)
+            if self.ws is None:
+                if attempts > 0:
+                    delay = min(BACKOFF_MAX,
+                                BACKOFF_BASE * 2 ** (attempts - 1))
+                    delay *= uniform(0.5, 1)
+                    LOG.info("%s: reconnecting in %.1f seconds",
+                             self.__class__.__name__, delay)
+                    self.wait(delay)
+                    if stopped() or suspended():
+                        continue
                 LOG.info("%s: connection closed, (re)connecting",
                          self.__class__.__name__)
                 uri, sslopt = self.getUri()
                 try:
-                    # Low timeout - let's us shut this thread down!
                     self.ws = websocket.create_connection(
                         uri,
-                        timeout=1,
+                        timeout=SOCKET_TIMEOUT,
                         sslopt=sslopt,
                         enable_multithread=True)
                 except IOError:
                     # Server is probably offline
                     LOG.info("%s: Error connecting", self.__class__.__name__)
                     self.ws = None
-                    counter += 1
-                    if counter > 3:
-                        counter = 0
+                    attempts += 1
+                    if attempts == DEAD_AFTER_ATTEMPTS:
                         self.IOError_response()
-                    sleep(1000)
                 except websocket.WebSocketTimeoutException:
                     LOG.info("%s: Timeout while connecting, trying again",
                              self.__class__.__name__)
                     self.ws = None
-                    sleep(1000)
+                    attempts += 1
                 except websocket.WebSocketException as e:
                     LOG.info('%s: WebSocketException: %s',
                              self.__class__.__name__, e)
@@ -114,7 +234,7 @@ class WebSocket(Thread):
                                      'Stopping now', self.__class__.__name__)
                             break
                     self.ws = None
-                    sleep(1000)
+                    attempts += 1
                 except Exception as e:
                     LOG.error('%s: Unknown exception encountered when '
                               'connecting: %s', self.__class__.__name__, e)
@@ -122,23 +242,39 @@ class WebSocket(Thread):
                     LOG.error("%s: Traceback:\n%s",
                               self.__class__.__name__, traceback.format_exc())
                     self.ws = None
-                    sleep(1000)
+                    attempts += 1
                 else:
-                    counter = 0
+                    attempts = 0
                     handshake_counter = 0
+                    self.last_received = time()
+                    self.ping_sent = None
+                continue
+            try:
+                # select() does not know about data that has already been
+                # read from the socket, e.g. by SSL
+                if self.ws.has_buffered_data() or self.wait(
+                        max(0, (self.ping_sent or self.last_received) +
+                            PING_INTERVAL - time()),
+                        self.ws):
+                    self.process(*self.receive(self.ws))
+                    self.last_received = time()
+                    self.ping_sent = None
+                else:
+                    self.keepalive()
+            except websocket.WebSocketTimeoutException:
+                # Only got a part of a frame yet
+                pass
+            except websocket.WebSocketConnectionClosedException:
+                LOG.info("%s: connection closed by the server",
+                         self.__class__.__name__)
+                self.close()
             except Exception as e:
                 LOG.error("%s: Unknown exception encountered: %s",
                           self.__class__.__name__, e)
                 import traceback
                 LOG.error("%s: Traceback:\n%s",
                           self.__class__.__name__, traceback.format_exc())
-                if self.ws is not None:
-                    self.ws.close()
-                self.ws = None
-        # Close websocket connection on shutdown
-        if self.ws is not None:
-            self.ws.close()
-        LOG.info("##===---- %s Stopped ----===##", self.__class__.__name__)
+                self.close()
 
 
 @thread_methods(add_suspends=['SUSPEND_LIBRARY_THREAD'])
@@ -167,6 +303,10 @@ class PMS_Websocket(WebSocket):
     def process(self, opcode, message):
         if opcode not in self.opcode_data:
             return
+        # Most PMS messages, e.g. transcodeSession.update or status, get
+        # dropped anyway - don't even decode them
+        if REGEX_MESSAGE_TYPE.search(message) is None:
+            return
 
         try:
             message = loads(message)
@@ -257,12 +397,14 @@ class Alexa_Websocket(WebSocket):
     # Path in thread_methods
     def stop(self):
         self.thread_stopped = True
+        self.wake_up()
 
     def suspend(self):
         self.thread_suspended = True
 
     def resume(self):
         self.thread_suspended = False
+        self.wake_up()
 
     def stopped(self):
         if self.thread_stopped is True:
@@ -28,7 +28,8 @@ sys_path.append(_BASE_RESOURCE)
 
 ###############################################################################
 
-from utils import settings, window, language as lang, dialog
+from utils import settings, window, language as lang, dialog, \
+    wake_up_threads
 from userclient import UserClient
 import initialsetup
 from kodimonitor import KodiMonitor, SpecialMonitor
@@ -214,6 +215,7 @@ class Service():
                             window('plex_online', value="false")
                             # Suspend threads
                             state.SUSPEND_LIBRARY_THREAD = True
+                            wake_up_threads()
                             LOG.error("Plex Media Server went offline")
                             if settings('show_pms_offline') == 'true':
                                 dialog('notification',
@@ -254,6 +256,7 @@ class Service():
                             # Server got offline when we were authenticated.
                             # Hence resume threads
                             state.SUSPEND_LIBRARY_THREAD = False
+                            wake_up_threads()
 
                         # Start the userclient thread
                         if not self.user_running:
@@ -273,6 +276,7 @@ class Service():
 
         # Tell all threads to terminate (e.g. several lib sync threads)
         state.STOP_PKC = True
+        wake_up_threads()
         window('plex_service_started', clear=True)
         LOG.info("======== STOP %s ========", v.ADDON_NAME)
 
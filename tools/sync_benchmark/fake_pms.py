@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+"""
+Local HTTP stand-in for a Plex Media Server with a generated library: a movie
+section, a TV show section and a music section. Serves just enough of the PMS
+API for PKC's library sync:
+
+    /library/sections
+    /library/sections/<id>/all          type, includeFields and updatedAt
+                                        filters as well as paging
+    /library/sections/<id>/allLeaves    same
+    /library/metadata/<id>[,<id>...]    metadata of one or several items
+    /library/metadata/<id>/children
+
+Run it on its own process, so its memory and CPU do not distort the
+benchmark:
+
+    python fake_pms.py --items 10000
+
+It prints "PORT <port>" once it is ready. The benchmark changes the library
+between its sync runs via /bench/change?touch=<fraction>&delete=<fraction>;
+/bench/stats returns the number of requests served per endpoint as JSON
+"""
+from argparse import ArgumentParser
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from urlparse import urlparse, parse_qsl
+from threading import Lock
+from random import Random
+from time import time
+from json import dumps
+import sys
+
+###############################################################################
+
+# Plex type numbers used by the section filter "type"
+TYPE_NUMBERS = {
+    'movie': 1,
+    'show': 2,
+    'season': 3,
+    'episode': 4,
+    'artist': 8,
+    'album': 9,
+    'track': 10
+}
+# XML tag of the PMS items
+TAGS = {
+    'movie': 'Video',
+    'show': 'Directory',
+    'season': 'Directory',
+    'episode': 'Video',
+    'artist': 'Directory',
+    'album': 'Directory',
+    'track': 'Track'
+}
+# Section id, title and Plex type of its toplevel items
+SECTIONS = (
+    ('1', 'Movies', 'movie'),
+    ('2', 'TV Shows', 'show'),
+    ('3', 'Music', 'artist')
+)
+# The item types of each section, toplevel first, leaves last
+SECTION_TYPES = {
+    '1': ('movie',),
+    '2': ('show', 'season', 'episode'),
+    '3': ('artist', 'album', 'track')
+}
+SEASONS_PER_SHOW = 4
+EPISODES_PER_SEASON = 10
+ALBUMS_PER_ARTIST = 4
+TRACKS_PER_ALBUM = 10
+# Sizes of the pools that genres, people etc. are picked from. Real libraries
+# share most of these between items
+GENRES = 30
+PEOPLE = 5000
+STUDIOS = 100
+COUNTRIES = 40
+COLLECTIONS = 200
+# PMS timestamp of all items that the benchmark did not touch: long before
+# any sync
+BASE_TIMESTAMP = int(time()) - 60 * 60 * 24 * 365
+
+###############################################################################
+
+
+class Library(object):
+    """
+    The generated PMS library. Items are tuples
+        (plex type, section id, parent ratingKey, grandparent ratingKey,
+         index, parent index)
+    with ratingKeys being ints. Roughly items_number leaves (movies, episodes
+    and tracks) are generated
+    """
+    def __init__(self, items_number, music=True, seed=0):
+        self.lock = Lock()
+        self.random = Random(seed)
+        # {ratingKey: item tuple}
+        self.items = {}
+        # {plex type: list of ratingKeys}, in the order the PMS lists them
+        self.keys = dict((typus, []) for typus in TYPE_NUMBERS)
+        # {ratingKey: list of the ratingKeys of its children}
+        self.children = {}
+        # {ratingKey: updatedAt} for items changed after BASE_TIMESTAMP
+        self.updated = {}
+        self.next_key = 1
+        if music:
+            movies = items_number * 2 // 10
+            episodes = items_number * 5 // 10
+            tracks = items_number - movies - episodes
+        else:
+            movies = items_number * 3 // 10
+            episodes = items_number - movies
+            tracks = 0
+        for _ in xrange(movies):
+            self._add('movie', '1')
+        self._add_tree('2', ('show', 'season', 'episode'),
+                       (SEASONS_PER_SHOW, EPISODES_PER_SEASON), episodes)
+        self._add_tree('3', ('artist', 'album', 'track'),
+                       (ALBUMS_PER_ARTIST, TRACKS_PER_ALBUM), tracks)
+
+    def _add(self, typus, section, parent=None, grandparent=None, index=None,
+             parent_index=None):
+        key = self.next_key
+        self.next_key += 1
+        self.items[key] = (typus, section, parent, grandparent, index,
+                           parent_index)
+        self.keys[typus].append(key)
+        if parent is not None:
+            self.children.setdefault(parent, []).append(key)
+        return key
+
+    def _add_tree(self, section, types, numbers, leaves):
+        """
+        Adds toplevel items with numbers[0] children with numbers[1] children
+        each until there are (at least) leaves leaves
+        """
+        added = 0
+        while added < leaves:
+            top = self._add(types[0], section)
+            for index in xrange(1, numbers[0] + 1):
+                middle = self._add(types[1], section, top, index=index)
+                for leaf_index in xrange(1, numbers[1] + 1):
+                    self._add(types[2], section, middle, top,
+                              index=leaf_index, parent_index=index)
+                    added += 1
+
+    def leaves(self):
+        """
+        Returns the number of movies, episodes and tracks
+        """
+        return sum(len(self.keys[typus])
+                   for typus in ('movie', 'episode', 'track'))
+
+    def updated_at(self, key):
+        return self.updated.get(key, BASE_TIMESTAMP)
+
+    def change(self, touch=0.0, delete=0.0):
+        """
+        Sets updatedAt to now for the fraction touch of all items and deletes
+        the fraction delete of all movies, episodes and tracks. Returns the
+        dict {'touched': number, 'deleted': number}
+        """
+        now = int(time())
+        touched = 0
+        deleted = 0
+        with self.lock:
+            for typus, keys in self.keys.iteritems():
+                number = int(round(len(keys) * touch))
+                for key in self.random.sample(keys, number):
+                    self.updated[key] = now
+                touched += number
+            for typus in ('movie', 'episode', 'track'):
+                keys = self.keys[typus]
+                number = int(round(len(keys) * delete))
+                for key in self.random.sample(keys, number):
+                    parent = self.items.pop(key)[2]
+                    keys.remove(key)
+                    if parent is not None:
+                        self.children[parent].remove(key)
+                    self.updated.pop(key, None)
+                deleted += number
+        return {'touched': touched, 'deleted': deleted}
+
+    def section_items(self, section, typus=None, leaves=False):
+        """
+        Returns the list of ratingKeys of section of Plex type typus - its
+        toplevel items if typus is None or its leaves for leaves=True
+        """
+        types = SECTION_TYPES[section]
+        if leaves:
+            typus = types[-1]
+        elif typus is None:
+            typus = types[0]
+        elif typus not in types:
+            return []
+        with self.lock:
+            return list(self.keys[typus])
+
+    def children_of(self, key):
+        with self.lock:
+            return list(self.children.get(key, ()))
+
+    def get(self, key):
+        with self.lock:
+            return self.items.get(key)
+
+    def attributes(self, key, item):
+        """
+        Returns the list of (name, value) XML attributes of the PMS item
+        """
+        typus, section, parent, grandparent, index, parent_index = item
+        updated_at = self.updated_at(key)
+        attributes = [
+            ('ratingKey', key),
+            ('key', '/library/metadata/%s' % key),
+            ('guid', 'com.plexapp.agents.none://%s?lang=en' % key),
+            ('type', typus),
+            ('title', '%s %s' % (typus.capitalize(), key)),
+            ('librarySectionID', section),
+            ('summary', 'Summary of %s %s' % (typus, key)),
+            ('thumb', '/library/metadata/%s/thumb/%s' % (key, updated_at)),
+            ('art', '/library/metadata/%s/art/%s' % (key, updated_at)),
+            ('addedAt', BASE_TIMESTAMP - key),
+            ('updatedAt', updated_at)
+        ]
+        if index is not None:
+            attributes.append(('index', index))
+        if parent is not None:
+            attributes.append(('parentRatingKey', parent))
+            attributes.append(('parentKey', '/library/metadata/%s' % parent))
+            attributes.append(('parentTitle', 'Parent %s' % parent))
+        if grandparent is not None:
+            attributes.append(('grandparentRatingKey', grandparent))
+            attributes.append(('grandparentKey',
+                               '/library/metadata/%s' % grandparent))
+            attributes.append(('grandparentTitle',
+                               'Grandparent %s' % grandparent))
+            attributes.append(('parentIndex', parent_index))
+        if typus in ('movie', 'episode', 'track'):
+            attributes.append(('duration', 1000 * (1200 + key % 6000)))
+            attributes.append(('year', 1950 + key % 70))
+            attributes.append(('originallyAvailableAt',
+                               '%s-01-01' % (1950 + key % 70)))
+            attributes.append(('rating', '%.1f' % (key % 100 / 10.0)))
+            if key % 7 == 0:
+                attributes.append(('viewCount', 1))
+                attributes.append(('lastViewedAt', BASE_TIMESTAMP + key))
+            elif key % 11 == 0:
+                attributes.append(('viewOffset', 1000 * (key % 1200)))
+        if typus in ('movie', 'show'):
+            attributes.append(('contentRating', 'PG-13'))
+            attributes.append(('studio', 'Studio %s' % (key % STUDIOS)))
+            attributes.append(('tagline', 'Tagline of %s' % key))
+        return attributes
+
+    def _tags(self, key, tag, pool, number):
+        return ''.join('<%s tag="%s %s" id="%s" />'
+                       % (tag, tag, (key * 7 + i * 13) % pool, i)
+                       for i in xrange(number))
+
+    def children_xml(self, key, item):
+        """
+        Returns the child elements of the PMS item's full metadata as XML
+        """
+        typus = item[0]
+        parts = []
+        if typus in ('movie', 'episode', 'track'):
+            if typus == 'track':
+                streams = ('<Stream id="%s" streamType="2" codec="flac" '
+                           'channels="2" />' % key)
+                container = 'flac'
+            else:
+                streams = (
+                    '<Stream id="%s1" streamType="1" codec="h264" '
+                    'height="1080" width="1920" />'
+                    '<Stream id="%s2" streamType="2" codec="ac3" '
+                    'channels="6" languageCode="eng" />'
+                    '<Stream id="%s3" streamType="3" codec="srt" '
+                    'languageCode="ger" />' % (key, key, key))
+                container = 'mkv'
+            parts.append(
+                '<Media id="%s" duration="%s" container="%s" '
+                'videoResolution="1080" aspectRatio="1.78">'
+                '<Part id="%s" key="/library/parts/%s/file.%s" '
+                'file="/media/%s/%s.%s" container="%s">%s</Part></Media>'
+                % (key, 1000 * (1200 + key % 6000), container, key, key,
+                   container, typus, key, container, container, streams))
+        parts.append(self._tags(key, 'Genre', GENRES, 2))
+        if typus in ('movie', 'episode'):
+            parts.append(self._tags(key, 'Director', PEOPLE, 1))
+            parts.append(self._tags(key, 'Writer', PEOPLE, 2))
+        if typus in ('movie', 'show', 'episode'):
+            parts.append(''.join(
+                '<Role tag="Actor %s" id="%s" role="Role %s" '
+                'thumb="http://127.0.0.1/actor/%s.jpg" />'
+                % ((key * 3 + i * 17) % PEOPLE, i, i, i) for i in xrange(5)))
+        if typus == 'movie':
+            parts.append(self._tags(key, 'Country', COUNTRIES, 1))
+            if key % 5 == 0:
+                parts.append(self._tags(key, 'Collection', COLLECTIONS, 1))
+        if typus == 'show':
+            parts.append('<Location path="/media/show/%s" />' % key)
+        return ''.join(parts)
+
+    def item_xml(self, key, item, fields=None, full=False):
+        typus = item[0]
+        attributes = self.attributes(key, item)
+        if fields is not None:
+            attributes = [(name, value) for name, value in attributes
+                          if name in fields]
+        attributes = ' '.join('%s="%s"' % attribute
+                              for attribute in attributes)
+        if full:
+            return '<%s %s>%s</%s>' % (TAGS[typus], attributes,
+                                       self.children_xml(key, item),
+                                       TAGS[typus])
+        return '<%s %s />' % (TAGS[typus], attributes)
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Keep-alive, just like the PMS
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        # Keeps e.g. 'updatedAt>' for 'updatedAt>=123'
+        args = dict(parse_qsl(url.query, keep_blank_values=True))
+        path = url.path.rstrip('/').split('/')[1:]
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            endpoint = '/'.join(part if not part[:1].isdigit() else '<id>'
+                                for part in path)
+            server.endpoints[endpoint] = server.endpoints.get(endpoint, 0) + 1
+        if path[:1] == ['bench']:
+            return self.bench(path[1:], args)
+        if path == ['library', 'sections']:
+            return self.reply(''.join(
+                '<Directory key="%s" title="%s" type="%s" agent="none" '
+                'scanner="none" language="en" uuid="%s" />'
+                % (key, title, typus, key)
+                for key, title, typus in SECTIONS), size=len(SECTIONS))
+        if (len(path) == 4 and path[:2] == ['library', 'sections'] and
+                path[3] in ('all', 'allLeaves')):
+            return self.section(path[2], path[3] == 'allLeaves', args)
+        if len(path) >= 3 and path[:2] == ['library', 'metadata']:
+            if len(path) == 4 and path[3] == 'children':
+                keys = server.library.children_of(int(path[2]))
+                return self.listing(keys, args, full=True)
+            keys = [int(key) for key in path[2].split(',')]
+            return self.reply(''.join(
+                server.library.item_xml(key, item, full=True)
+                for key, item in ((key, server.library.get(key))
+                                  for key in keys)
+                if item is not None), size=len(keys))
+        # Scrobbling, timeline and the like
+        return self.reply('')
+
+    def section(self, section, leaves, args):
+        library = self.server.library
+        if section not in SECTION_TYPES:
+            return self.reply('')
+        typus = None
+        if 'type' in args:
+            for name, number in TYPE_NUMBERS.iteritems():
+                if str(number) == args['type']:
+                    typus = name
+        keys = library.section_items(section, typus=typus, leaves=leaves)
+        if 'updatedAt>' in args:
+            updated_at = int(args['updatedAt>'])
+            keys = [key for key in keys
+                    if library.updated_at(key) >= updated_at]
+        if 'lastViewedAt>' in args:
+            viewed_at = int(args['lastViewedAt>'])
+            keys = [key for key in keys
+                    if key % 7 == 0 and BASE_TIMESTAMP + key >= viewed_at]
+        fields = None
+        if 'includeFields' in args:
+            fields = set(args['includeFields'].split(','))
+        return self.listing(keys, args, fields=fields)
+
+    def listing(self, keys, args, fields=None, full=False):
+        """
+        Replies with the chunk of the PMS items keys that args ask for
+        """
+        library = self.server.library
+        total = len(keys)
+        start = int(args.get('X-Plex-Container-Start', 0))
+        size = int(args.get('X-Plex-Container-Size', total))
+        keys = keys[start:start + size]
+        items = []
+        for key in keys:
+            item = library.get(key)
+            if item is not None:
+                items.append(library.item_xml(key, item, fields, full))
+        return self.reply(''.join(items), size=len(items), total=total,
+                          offset=start)
+
+    def bench(self, path, args):
+        server = self.server
+        if path == ['change']:
+            answer = server.library.change(
+                touch=float(args.get('touch', 0)),
+                delete=float(args.get('delete', 0)))
+        elif path == ['stats']:
+            with server.lock:
+                answer = {
+                    'requests': server.requests,
+                    'endpoints': dict(server.endpoints),
+                    'leaves': server.library.leaves()
+                }
+        else:
+            answer = {}
+        body = dumps(answer)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def reply(self, items, size=0, total=None, offset=0):
+        attributes = 'size="%s"' % size
+        if total is not None:
+            attributes += ' totalSize="%s" offset="%s"' % (total, offset)
+        body = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<MediaContainer %s allowSync="1" identifier='
+                '"com.plexapp.plugins.library">%s</MediaContainer>'
+                % (attributes, items))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml;charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakePMS(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+    def __init__(self, address, library):
+        HTTPServer.__init__(self, address, Handler)
+        self.library = library
+        self.lock = Lock()
+        self.requests = 0
+        # {endpoint with ids replaced by <id>: number of requests}
+        self.endpoints = {}
+
+
+def main():
+    parser = ArgumentParser(description='Fake PMS for the sync benchmark')
+    parser.add_argument('--items', type=int, default=10000,
+                        help='Number of movies, episodes and tracks')
+    parser.add_argument('--no-music', action='store_true',
+                        help='Leave the music section empty')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    library = Library(args.items, music=not args.no_music, seed=args.seed)
+    server = FakePMS(('127.0.0.1', args.port), library)
+    sys.stdout.write('PORT %s\n' % server.server_address[1])
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+Scratch copies of the Kodi Krypton (17) databases that PKC's library sync
+writes to: MyVideos107.db, MyMusic60.db and Textures13.db. Tables, indexes
+and triggers follow Kodi's VideoDatabase/MusicDatabase::CreateTables() -
+only the parts that are irrelevant for PKC (e.g. musicvideos or karaoke)
+are left out
+"""
+from sqlite3 import connect
+
+###############################################################################
+
+VIDEO_DB = 'MyVideos107.db'
+MUSIC_DB = 'MyMusic60.db'
+TEXTURE_DB = 'Textures13.db'
+
+_COLUMNS = ', '.join('c%02d text' % i for i in range(24))
+
+VIDEO_SCHEMA = '''
+CREATE TABLE version (idVersion integer, iCompressCount integer);
+INSERT INTO version VALUES (107, 0);
+CREATE TABLE bookmark (idBookmark integer primary key, idFile integer,
+    timeInSeconds double, totalTimeInSeconds double, thumbNailImage text,
+    player text, playerState text, type integer);
+CREATE INDEX ix_bookmark ON bookmark (idFile, type);
+CREATE TABLE settings (idFile integer, Deinterlace bool, ViewMode integer,
+    ZoomAmount float, PixelRatio float, VerticalShift float,
+    AudioStream integer, SubtitleStream integer, SubtitleDelay float,
+    SubtitlesOn bool, Brightness float, Contrast float, Gamma float,
+    VolumeAmplification float, AudioDelay float, ResumeTime integer,
+    Sharpness float, NoiseReduction float, NonLinStretch bool,
+    PostProcess bool, ScalingMethod integer, DeinterlaceMode integer,
+    StereoMode integer, StereoInvert bool, VideoStream integer);
+CREATE UNIQUE INDEX ix_settings ON settings (idFile);
+CREATE TABLE stacktimes (idFile integer, times text);
+CREATE UNIQUE INDEX ix_stacktimes ON stacktimes (idFile);
+CREATE TABLE genre (genre_id integer primary key, name TEXT);
+CREATE UNIQUE INDEX ix_genre_1 ON genre (name);
+CREATE TABLE genre_link (genre_id integer, media_id integer,
+    media_type TEXT);
+CREATE UNIQUE INDEX ix_genre_link_1 ON genre_link
+    (genre_id, media_type, media_id);
+CREATE UNIQUE INDEX ix_genre_link_2 ON genre_link
+    (media_id, media_type, genre_id);
+CREATE INDEX ix_genre_link_3 ON genre_link (media_type);
+CREATE TABLE country (country_id integer primary key, name TEXT);
+CREATE UNIQUE INDEX ix_country_1 ON country (name);
+CREATE TABLE country_link (country_id integer, media_id integer,
+    media_type TEXT);
+CREATE UNIQUE INDEX ix_country_link_1 ON country_link
+    (country_id, media_type, media_id);
+CREATE UNIQUE INDEX ix_country_link_2 ON country_link
+    (media_id, media_type, country_id);
+CREATE INDEX ix_country_link_3 ON country_link (media_type);
+CREATE TABLE movie (idMovie integer primary key, idFile integer, %(c)s,
+    idSet integer, userrating integer, premiered text);
+CREATE UNIQUE INDEX ix_movie_file_1 ON movie (idFile, idMovie);
+CREATE UNIQUE INDEX ix_movie_file_2 ON movie (idMovie, idFile);
+CREATE TABLE actor (actor_id INTEGER PRIMARY KEY, name TEXT,
+    art_urls TEXT);
+CREATE TABLE actor_link (actor_id INTEGER, media_id INTEGER,
+    media_type TEXT, role TEXT, cast_order INTEGER);
+CREATE UNIQUE INDEX ix_actor_link_1 ON actor_link
+    (actor_id, media_type, media_id, role);
+CREATE INDEX ix_actor_link_2 ON actor_link
+    (media_id, media_type, actor_id);
+CREATE INDEX ix_actor_link_3 ON actor_link (media_type);
+CREATE TABLE director_link (actor_id integer, media_id integer,
+    media_type TEXT);
+CREATE UNIQUE INDEX ix_director_link_1 ON director_link
+    (actor_id, media_type, media_id);
+CREATE UNIQUE INDEX ix_director_link_2 ON director_link
+    (media_id, media_type, actor_id);
+CREATE TABLE writer_link (actor_id integer, media_id integer,
+    media_type TEXT);
+CREATE UNIQUE INDEX ix_writer_link_1 ON writer_link
+    (actor_id, media_type, media_id);
+CREATE UNIQUE INDEX ix_writer_link_2 ON writer_link
+    (media_id, media_type, actor_id);
+CREATE TABLE path (idPath integer primary key, strPath text,
+    strContent text, strScraper text, strHash text, scanRecursive integer,
+    useFolderNames bool, strSettings text, noUpdate bool, exclude bool,
+    dateAdded text, idParentPath integer);
+CREATE UNIQUE INDEX ix_path ON path (strPath);
+CREATE INDEX ix_path2 ON path (idParentPath);
+CREATE TABLE files (idFile integer primary key, idPath integer,
+    strFilename text, playCount integer, lastPlayed text, dateAdded text);
+CREATE INDEX ix_files ON files (idPath, strFilename);
+CREATE TABLE tvshow (idShow integer primary key, %(c)s,
+    userrating integer, duration INTEGER);
+CREATE TABLE tvshowlinkpath (idShow integer, idPath integer);
+CREATE UNIQUE INDEX ix_tvshowlinkpath_1 ON tvshowlinkpath (idShow, idPath);
+CREATE UNIQUE INDEX ix_tvshowlinkpath_2 ON tvshowlinkpath (idPath, idShow);
+CREATE TABLE movielinktvshow (idMovie integer, IdShow integer);
+CREATE TABLE episode (idEpisode integer primary key, idFile integer,
+    %(c)s, idShow integer, userrating integer, idSeason integer);
+CREATE UNIQUE INDEX ix_episode_file_1 ON episode (idEpisode, idFile);
+CREATE UNIQUE INDEX id_episode_file_2 ON episode (idFile, idEpisode);
+CREATE INDEX ix_episode_season_episode ON episode (c12, c13);
+CREATE INDEX ix_episode_bookmark ON episode (c17);
+CREATE INDEX ix_episode_show1 ON episode (idEpisode, idShow);
+CREATE INDEX ix_episode_show2 ON episode (idShow, idEpisode);
+CREATE TABLE studio (studio_id integer primary key, name TEXT);
+CREATE UNIQUE INDEX ix_studio_1 ON studio (name);
+CREATE TABLE studio_link (studio_id integer, media_id integer,
+    media_type TEXT);
+CREATE UNIQUE INDEX ix_studio_link_1 ON studio_link
+    (studio_id, media_type, media_id);
+CREATE UNIQUE INDEX ix_studio_link_2 ON studio_link
+    (media_id, media_type, studio_id);
+CREATE INDEX ix_studio_link_3 ON studio_link (media_type);
+CREATE TABLE streamdetails (idFile integer, iStreamType integer,
+    strVideoCodec text, fVideoAspect float, iVideoWidth integer,
+    iVideoHeight integer, strAudioCodec text, iAudioChannels integer,
+    strAudioLanguage text, strSubtitleLanguage text, iVideoDuration integer,
+    strStereoMode text, strVideoLanguage text);
+CREATE INDEX ix_streamdetails ON streamdetails (idFile);
+CREATE TABLE sets (idSet integer primary key, strSet text,
+    strOverview text);
+CREATE TABLE seasons (idSeason integer primary key, idShow integer,
+    season integer, name text, userrating integer);
+CREATE INDEX ix_seasons ON seasons (idShow, season);
+CREATE TABLE art (art_id integer primary key, media_id integer,
+    media_type text, type text, url text);
+CREATE INDEX ix_art ON art (media_id, media_type, type);
+CREATE TABLE tag (tag_id integer primary key, name TEXT);
+CREATE UNIQUE INDEX ix_tag_1 ON tag (name);
+CREATE TABLE tag_link (tag_id integer, media_id integer, media_type TEXT);
+CREATE UNIQUE INDEX ix_tag_link_1 ON tag_link
+    (tag_id, media_type, media_id);
+CREATE UNIQUE INDEX ix_tag_link_2 ON tag_link
+    (media_id, media_type, tag_id);
+CREATE INDEX ix_tag_link_3 ON tag_link (media_type);
+CREATE TABLE rating (rating_id INTEGER PRIMARY KEY, media_id INTEGER,
+    media_type TEXT, rating_type TEXT, rating FLOAT, votes INTEGER);
+CREATE INDEX ix_rating ON rating (media_id, media_type);
+CREATE TABLE uniqueid (uniqueid_id INTEGER PRIMARY KEY, media_id INTEGER,
+    media_type TEXT, value TEXT, type TEXT);
+CREATE INDEX ix_uniqueid1 ON uniqueid (media_id, media_type, type);
+CREATE INDEX ix_uniqueid2 ON uniqueid (media_type, value);
+CREATE TRIGGER delete_movie AFTER DELETE ON movie FOR EACH ROW BEGIN
+    DELETE FROM genre_link WHERE media_id=old.idMovie
+        AND media_type='movie';
+    DELETE FROM actor_link WHERE media_id=old.idMovie
+        AND media_type='movie';
+    DELETE FROM director_link WHERE media_id=old.idMovie
+        AND media_type='movie';
+    DELETE FROM studio_link WHERE media_id=old.idMovie
+        AND media_type='movie';
+    DELETE FROM country_link WHERE media_id=old.idMovie
+        AND media_type='movie';
+    DELETE FROM writer_link WHERE media_id=old.idMovie
+        AND media_type='movie';
+    DELETE FROM art WHERE media_id=old.idMovie AND media_type='movie';
+    DELETE FROM tag_link WHERE media_id=old.idMovie AND media_type='movie';
+    DELETE FROM rating WHERE media_id=old.idMovie AND media_type='movie';
+    DELETE FROM uniqueid WHERE media_id=old.idMovie
+        AND media_type='movie';
+END;
+CREATE TRIGGER delete_tvshow AFTER DELETE ON tvshow FOR EACH ROW BEGIN
+    DELETE FROM actor_link WHERE media_id=old.idShow
+        AND media_type='tvshow';
+    DELETE FROM director_link WHERE media_id=old.idShow
+        AND media_type='tvshow';
+    DELETE FROM tvshowlinkpath WHERE idShow=old.idShow;
+    DELETE FROM genre_link WHERE media_id=old.idShow
+        AND media_type='tvshow';
+    DELETE FROM studio_link WHERE media_id=old.idShow
+        AND media_type='tvshow';
+    DELETE FROM art WHERE media_id=old.idShow AND media_type='tvshow';
+    DELETE FROM tag_link WHERE media_id=old.idShow AND media_type='tvshow';
+    DELETE FROM rating WHERE media_id=old.idShow AND media_type='tvshow';
+    DELETE FROM uniqueid WHERE media_id=old.idShow
+        AND media_type='tvshow';
+END;
+CREATE TRIGGER delete_episode AFTER DELETE ON episode FOR EACH ROW BEGIN
+    DELETE FROM actor_link WHERE media_id=old.idEpisode
+        AND media_type='episode';
+    DELETE FROM director_link WHERE media_id=old.idEpisode
+        AND media_type='episode';
+    DELETE FROM writer_link WHERE media_id=old.idEpisode
+        AND media_type='episode';
+    DELETE FROM art WHERE media_id=old.idEpisode
+        AND media_type='episode';
+    DELETE FROM rating WHERE media_id=old.idEpisode
+        AND media_type='episode';
+    DELETE FROM uniqueid WHERE media_id=old.idEpisode
+        AND media_type='episode';
+END;
+CREATE TRIGGER delete_season AFTER DELETE ON seasons FOR EACH ROW BEGIN
+    DELETE FROM art WHERE media_id=old.idSeason AND media_type='season';
+END;
+CREATE TRIGGER delete_set AFTER DELETE ON sets FOR EACH ROW BEGIN
+    DELETE FROM art WHERE media_id=old.idSet AND media_type='set';
+END;
+CREATE TRIGGER delete_person AFTER DELETE ON actor FOR EACH ROW BEGIN
+    DELETE FROM art WHERE media_id=old.actor_id AND media_type IN
+        ('actor','artist','writer','director');
+END;
+CREATE TRIGGER delete_tag AFTER DELETE ON tag_link FOR EACH ROW BEGIN
+    DELETE FROM tag WHERE tag_id=old.tag_id AND tag_id NOT IN
+        (SELECT DISTINCT tag_id FROM tag_link);
+END;
+CREATE VIEW tvshowcounts AS SELECT tvshow.idShow AS idShow,
+    MAX(files.lastPlayed) AS lastPlayed,
+    NULLIF(COUNT(episode.c12), 0) AS totalCount,
+    COUNT(files.playCount) AS watchedcount,
+    NULLIF(COUNT(DISTINCT(episode.c12)), 0) AS totalSeasons,
+    MAX(files.dateAdded) as dateAdded
+    FROM tvshow
+    LEFT JOIN episode ON episode.idShow=tvshow.idShow
+    LEFT JOIN files ON files.idFile=episode.idFile
+    GROUP BY tvshow.idShow;
+''' % {'c': _COLUMNS}
+
+MUSIC_SCHEMA = '''
+CREATE TABLE version (idVersion integer, iCompressCount integer);
+INSERT INTO version VALUES (60, 0);
+CREATE TABLE artist (idArtist integer primary key, strArtist varchar(256),
+    strMusicBrainzArtistID text, strBorn text, strFormed text,
+    strGenres text, strMoods text, strStyles text, strInstruments text,
+    strBiography text, strDied text, strDisbanded text, strYearsActive text,
+    strImage text, strFanart text, lastScraped varchar(20) default NULL);
+CREATE UNIQUE INDEX idxArtist ON artist (strArtist,
+    strMusicBrainzArtistID);
+CREATE TABLE album (idAlbum integer primary key, strAlbum varchar(256),
+    strMusicBrainzAlbumID text, strArtists text, strGenres text,
+    iYear integer, bCompilation integer not null default '0', strMoods text,
+    strStyles text, strThemes text, strReview text, strImage text,
+    strLabel text, strType text, fRating FLOAT NOT NULL DEFAULT 0,
+    iUserrating INTEGER NOT NULL DEFAULT 0,
+    lastScraped varchar(20) default NULL, strReleaseType text,
+    iVotes INTEGER NOT NULL DEFAULT 0);
+CREATE INDEX idxAlbum ON album (strAlbum);
+CREATE TABLE album_artist (idArtist integer, idAlbum integer,
+    iOrder integer, strArtist text);
+CREATE UNIQUE INDEX idxAlbumArtist_1 ON album_artist (idAlbum, idArtist);
+CREATE UNIQUE INDEX idxAlbumArtist_2 ON album_artist (idArtist, idAlbum);
+CREATE TABLE album_genre (idGenre integer, idAlbum integer,
+    iOrder integer);
+CREATE UNIQUE INDEX idxAlbumGenre_1 ON album_genre (idAlbum, idGenre);
+CREATE UNIQUE INDEX idxAlbumGenre_2 ON album_genre (idGenre, idAlbum);
+CREATE TABLE genre (idGenre integer primary key, strGenre varchar(256));
+CREATE INDEX idxGenre ON genre (strGenre);
+CREATE TABLE path (idPath integer primary key, strPath varchar(512),
+    strHash text);
+CREATE UNIQUE INDEX idxPath ON path (strPath);
+CREATE TABLE song (idSong integer primary key, idAlbum integer,
+    idPath integer, strArtists text, strGenres text,
+    strTitle varchar(512), iTrack integer, iDuration integer, iYear integer,
+    dwFileNameCRC text, strFileName text, strMusicBrainzTrackID text,
+    iTimesPlayed integer, iStartOffset integer, iEndOffset integer,
+    idThumb integer, lastplayed varchar(20) default NULL,
+    rating FLOAT NOT NULL DEFAULT 0, userrating INTEGER NOT NULL DEFAULT 0,
+    comment text, mood text, dateAdded text,
+    votes INTEGER NOT NULL DEFAULT 0);
+CREATE INDEX idxSong ON song (strTitle);
+CREATE INDEX idxSong1 ON song (iTimesPlayed);
+CREATE INDEX idxSong2 ON song (lastplayed);
+CREATE INDEX idxSong3 ON song (idAlbum);
+CREATE INDEX idxSong6 ON song (idPath, strFileName);
+CREATE TABLE song_artist (idArtist integer, idSong integer,
+    idRole integer, iOrder integer, strArtist text);
+CREATE UNIQUE INDEX idxSongArtist_1 ON song_artist
+    (idSong, idArtist, idRole);
+CREATE INDEX idxSongArtist_2 ON song_artist (idSong, idRole);
+CREATE INDEX idxSongArtist_3 ON song_artist (idArtist, idRole);
+CREATE INDEX idxSongArtist_4 ON song_artist (idRole);
+CREATE TABLE song_genre (idGenre integer, idSong integer, iOrder integer);
+CREATE UNIQUE INDEX idxSongGenre_1 ON song_genre (idSong, idGenre);
+CREATE UNIQUE INDEX idxSongGenre_2 ON song_genre (idGenre, idSong);
+CREATE TABLE role (idRole integer primary key, strRole text);
+INSERT INTO role (idRole, strRole) VALUES (1, 'Artist');
+CREATE TABLE albuminfosong (idAlbumInfoSong integer primary key,
+    idAlbumInfo integer, iTrack integer, strTitle text, iDuration integer);
+CREATE INDEX idxAlbumInfoSong_1 ON albuminfosong (idAlbumInfo);
+CREATE TABLE discography (idArtist integer, strAlbum text, strYear text);
+CREATE INDEX idxDiscography_1 ON discography (idArtist);
+CREATE TABLE art (art_id integer primary key, media_id integer,
+    media_type text, type text, url text);
+CREATE INDEX ix_art ON art (media_id, media_type, type);
+CREATE TRIGGER tgrDeleteAlbum AFTER DELETE ON album FOR EACH ROW BEGIN
+    DELETE FROM song WHERE song.idAlbum = old.idAlbum;
+    DELETE FROM album_artist WHERE album_artist.idAlbum = old.idAlbum;
+    DELETE FROM album_genre WHERE album_genre.idAlbum = old.idAlbum;
+    DELETE FROM albuminfosong WHERE albuminfosong.idAlbumInfo=old.idAlbum;
+    DELETE FROM art WHERE media_id=old.idAlbum AND media_type='album';
+END;
+CREATE TRIGGER tgrDeleteArtist AFTER DELETE ON artist FOR EACH ROW BEGIN
+    DELETE FROM album_artist WHERE album_artist.idArtist = old.idArtist;
+    DELETE FROM song_artist WHERE song_artist.idArtist = old.idArtist;
+    DELETE FROM discography WHERE discography.idArtist = old.idArtist;
+    DELETE FROM art WHERE media_id=old.idArtist AND media_type='artist';
+END;
+CREATE TRIGGER tgrDeleteSong AFTER DELETE ON song FOR EACH ROW BEGIN
+    DELETE FROM song_artist WHERE song_artist.idSong = old.idSong;
+    DELETE FROM song_genre WHERE song_genre.idSong = old.idSong;
+    DELETE FROM art WHERE media_id=old.idSong AND media_type='song';
+END;
+'''
+
+TEXTURE_SCHEMA = '''
+CREATE TABLE version (idVersion integer, iCompressCount integer);
+INSERT INTO version VALUES (13, 0);
+CREATE TABLE path (id integer primary key, url text, type text,
+    texture text);
+CREATE TABLE sizes (idtexture integer, size integer, width integer,
+    height integer, usecount integer, lastusetime text);
+CREATE TABLE texture (id integer primary key, url text, cachedurl text,
+    imagehash text, lasthashcheck text);
+CREATE INDEX idxTexture ON texture (url);
+'''
+
+SCHEMAS = (
+    (VIDEO_DB, VIDEO_SCHEMA),
+    (MUSIC_DB, MUSIC_SCHEMA),
+    (TEXTURE_DB, TEXTURE_SCHEMA)
+)
+
+###############################################################################
+
+
+def create_dbs(directory):
+    """
+    Creates empty Kodi DBs in directory, overwriting nothing
+    """
+    for filename, schema in SCHEMAS:
+        connection = connect('%s/%s' % (directory, filename))
+        connection.executescript(schema)
+        connection.commit()
+        connection.close()
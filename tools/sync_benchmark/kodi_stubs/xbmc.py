@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal stand-in for Kodi's xbmc module, just enough to run PKC's library
+sync outside of Kodi. special:// paths are mapped to KODI_HOME, which the
+benchmark sets before importing any PKC module
+"""
+from os.path import join
+from time import sleep as _sleep
+from logging import getLogger
+
+###############################################################################
+
+LOG = getLogger('xbmc')
+
+LOGDEBUG = 0
+LOGINFO = 1
+LOGNOTICE = 2
+LOGWARNING = 3
+LOGERROR = 4
+LOGSEVERE = 5
+LOGFATAL = 6
+LOGNONE = 7
+
+ISO_639_1 = 0
+ISO_639_2 = 1
+ENGLISH_NAME = 2
+
+PLAYLIST_MUSIC = 0
+PLAYLIST_VIDEO = 1
+
+# Scratch directory that special:// paths point to
+KODI_HOME = None
+# Kodi version the benchmark pretends to be, e.g. '17.6'
+BUILD_VERSION = '17.6 Git:20171114-a9a7a20'
+
+###############################################################################
+
+
+def translatePath(path):
+    if not path.startswith('special://'):
+        return path
+    return join(KODI_HOME, *path[len('special://'):].split('/'))
+
+
+def getInfoLabel(label):
+    if label == 'System.BuildVersion':
+        return BUILD_VERSION
+    return ''
+
+
+def getLanguage(format=ISO_639_1, region=False):
+    return 'en'
+
+
+def getLocalizedString(string_id):
+    return u'Kodi string %s' % string_id
+
+
+def getCondVisibility(condition):
+    return False
+
+
+def executebuiltin(function, wait=False):
+    LOG.debug('executebuiltin: %s', function)
+
+
+def executeJSONRPC(query):
+    return '{"id": 1, "jsonrpc": "2.0", "result": {}}'
+
+
+def sleep(milliseconds):
+    _sleep(milliseconds / 1000.0)
+
+
+def log(msg, level=LOGDEBUG):
+    LOG.debug(msg)
+
+
+class Player(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def isPlaying(self):
+        return False
+
+    def isPlayingVideo(self):
+        return False
+
+    def isPlayingAudio(self):
+        return False
+
+
+class PlayList(object):
+    def __init__(self, playlist):
+        self.playlist = playlist
+
+    def size(self):
+        return 0
+
+    def getposition(self):
+        return -1
+
+    def clear(self):
+        pass
+
+
+class Monitor(object):
+    def abortRequested(self):
+        return False
+
+    def waitForAbort(self, timeout=None):
+        if timeout:
+            _sleep(timeout)
+        return False
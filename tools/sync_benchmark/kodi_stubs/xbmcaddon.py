@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal stand-in for Kodi's xbmcaddon module. Settings default to the ones
+of PKC's resources/settings.xml; the benchmark overrides some of them via
+SETTINGS before importing any PKC module
+"""
+from os.path import dirname, join, abspath
+from threading import Lock
+import xml.etree.ElementTree as etree
+
+###############################################################################
+
+ADDON_PATH = abspath(join(dirname(__file__), '..', '..', '..'))
+ADDON_XML = etree.parse(join(ADDON_PATH, 'addon.xml')).getroot()
+
+# {setting id: value as string}, shared by all Addon instances
+SETTINGS = dict(
+    (setting.get('id'), setting.get('default', ''))
+    for setting in etree.parse(
+        join(ADDON_PATH, 'resources', 'settings.xml')).iter('setting')
+    if setting.get('id'))
+_LOCK = Lock()
+
+###############################################################################
+
+
+class Addon(object):
+    def __init__(self, id=None):
+        self.id = id or ADDON_XML.get('id')
+
+    def getSetting(self, setting_id):
+        with _LOCK:
+            return SETTINGS.get(setting_id, '')
+
+    def setSetting(self, setting_id, value):
+        with _LOCK:
+            SETTINGS[setting_id] = value
+
+    def getLocalizedString(self, string_id):
+        return u'PKC string %s' % string_id
+
+    def getAddonInfo(self, info):
+        if info == 'path':
+            return ADDON_PATH
+        if info == 'profile':
+            return 'special://profile/addon_data/%s/' % self.id
+        if info == 'id':
+            return self.id
+        return ADDON_XML.get(info, '')
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal stand-in for Kodi's xbmcgui module: window properties are kept in
+memory, dialogs never show up and return the "cancelled" answer
+"""
+from threading import Lock
+
+###############################################################################
+
+NOTIFICATION_INFO = 'info'
+NOTIFICATION_WARNING = 'warning'
+NOTIFICATION_ERROR = 'error'
+
+INPUT_ALPHANUM = 0
+INPUT_NUMERIC = 1
+INPUT_DATE = 2
+INPUT_TIME = 3
+INPUT_IPADDRESS = 4
+INPUT_PASSWORD = 5
+PASSWORD_VERIFY = 1
+ALPHANUM_HIDE_INPUT = 2
+
+# {window id: {property: value}}
+_PROPERTIES = {}
+_LOCK = Lock()
+
+###############################################################################
+
+
+class Window(object):
+    def __init__(self, windowId=10000):
+        with _LOCK:
+            self.properties = _PROPERTIES.setdefault(windowId, {})
+
+    def getProperty(self, key):
+        with _LOCK:
+            return self.properties.get(key, '')
+
+    def setProperty(self, key, value):
+        with _LOCK:
+            self.properties[key] = value
+
+    def clearProperty(self, key):
+        with _LOCK:
+            self.properties.pop(key, None)
+
+
+class Dialog(object):
+    def ok(self, *args, **kwargs):
+        return True
+
+    def yesno(self, *args, **kwargs):
+        return False
+
+    def notification(self, *args, **kwargs):
+        pass
+
+    def select(self, *args, **kwargs):
+        return -1
+
+    def input(self, *args, **kwargs):
+        return ''
+
+    def numeric(self, *args, **kwargs):
+        return ''
+
+
+class DialogProgressBG(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def create(self, *args, **kwargs):
+        pass
+
+    def update(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+class ListItem(object):
+    def __init__(self, label='', *args, **kwargs):
+        self.label = label
+        self.properties = {}
+
+    def setProperty(self, key, value):
+        self.properties[key] = value
+
+    def getProperty(self, key):
+        return self.properties.get(key, '')
+
+    def __getattr__(self, name):
+        # setInfo, setArt, addStreamInfo, ...
+        return lambda *args, **kwargs: None
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal stand-in for Kodi's xbmcplugin module - library sync never lists
+directories, so all of these do nothing
+"""
+
+SORT_METHOD_NONE = 0
+SORT_METHOD_LABEL = 1
+SORT_METHOD_DATE = 3
+
+
+def addDirectoryItem(*args, **kwargs):
+    return True
+
+
+def addDirectoryItems(*args, **kwargs):
+    return True
+
+
+def endOfDirectory(*args, **kwargs):
+    pass
+
+
+def setContent(*args, **kwargs):
+    pass
+
+
+def addSortMethod(*args, **kwargs):
+    pass
+
+
+def setPluginCategory(*args, **kwargs):
+    pass
+
+
+def setResolvedUrl(*args, **kwargs):
+    pass
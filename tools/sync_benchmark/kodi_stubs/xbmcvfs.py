@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal stand-in for Kodi's xbmcvfs module, working on the local file system
+"""
+import os
+import shutil
+
+###############################################################################
+
+
+def exists(path):
+    return os.path.exists(path)
+
+
+def mkdir(path):
+    try:
+        os.mkdir(path)
+    except OSError:
+        return False
+    return True
+
+
+def mkdirs(path):
+    try:
+        os.makedirs(path)
+    except OSError:
+        return False
+    return True
+
+
+def delete(path):
+    try:
+        os.remove(path)
+    except OSError:
+        return False
+    return True
+
+
+def rmdir(path, force=False):
+    try:
+        if force:
+            shutil.rmtree(path)
+        else:
+            os.rmdir(path)
+    except OSError:
+        return False
+    return True
+
+
+def copy(source, destination):
+    try:
+        shutil.copy(source, destination)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def listdir(path):
+    dirs = []
+    files = []
+    for name in os.listdir(path):
+        if os.path.isdir(os.path.join(path, name)):
+            dirs.append(name)
+        else:
+            files.append(name)
+    return dirs, files
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Times the Plex DB lookups of the library sync on a scratch Plex DB with
+synthetic rows (100000 by default), once on the schema without the lookup
+indexes and once after all plexdb_functions.MIGRATIONS have been applied:
+
+    python tools/sync_benchmark/plexdb_benchmark.py --rows 100000
+
+Uses PKC's own Plex_DB_Functions, so the measured queries are the ones the
+sync runs
+"""
+from argparse import ArgumentParser
+from os.path import dirname, join, abspath
+from shutil import rmtree
+from tempfile import mkdtemp
+from random import Random
+from sqlite3 import connect
+from time import time
+import sys
+
+###############################################################################
+
+HERE = dirname(abspath(__file__))
+PKC_LIB = abspath(join(HERE, '..', '..', 'resources', 'lib'))
+
+# Share of the rows per (plex_type, kodi_type), like a library with 60%
+# TV shows, 30% movies and 10% music. Parents come before their children
+SHARES = (
+    ('movie', 'movie', 0.3),
+    ('show', 'tvshow', 0.01),
+    ('season', 'season', 0.05),
+    ('episode', 'episode', 0.5),
+    ('artist', 'artist', 0.005),
+    ('album', 'album', 0.035),
+    ('track', 'song', 0.1)
+)
+PARENT_TYPE = {
+    'season': 'show',
+    'episode': 'season',
+    'album': 'artist',
+    'track': 'album'
+}
+VIEWS = 25
+
+###############################################################################
+
+
+def create_plex_db(path, rows, seed):
+    """
+    Creates the Plex DB at path as librarysync.initializeDBs() would, before
+    any migration, and fills it with rows synthetic items
+    """
+    random = Random(seed)
+    connection = connect(path)
+    cursor = connection.cursor()
+    cursor.execute('''
+        CREATE TABLE plex(
+        plex_id TEXT UNIQUE,
+        view_id TEXT,
+        plex_type TEXT,
+        kodi_type TEXT,
+        kodi_id INTEGER,
+        kodi_fileid INTEGER,
+        kodi_pathid INTEGER,
+        parent_id INTEGER,
+        checksum INTEGER,
+        fanart_synced INTEGER)
+    ''')
+    cursor.execute('''
+        CREATE TABLE view(
+        view_id TEXT UNIQUE,
+        view_name TEXT,
+        kodi_type TEXT,
+        kodi_tagid INTEGER)
+    ''')
+    kodi_ids = {}
+    plex_id = 0
+    for plex_type, kodi_type, share in SHARES:
+        kodi_ids[plex_type] = range(1, int(rows * share) + 1)
+        parents = kodi_ids.get(PARENT_TYPE.get(plex_type))
+        items = []
+        for kodi_id in kodi_ids[plex_type]:
+            plex_id += 1
+            fanart_synced = None
+            if plex_type in ('movie', 'show'):
+                fanart_synced = 0 if random.random() < 0.05 else 1
+            items.append((str(plex_id),
+                          str(random.randint(1, VIEWS)),
+                          plex_type,
+                          kodi_type,
+                          kodi_id,
+                          kodi_id,
+                          kodi_id,
+                          random.choice(parents) if parents else None,
+                          1500000000 + plex_id,
+                          fanart_synced))
+        cursor.executemany('INSERT INTO plex VALUES (?,?,?,?,?,?,?,?,?,?)',
+                           items)
+    connection.commit()
+    connection.close()
+    return plex_id, kodi_ids
+
+
+def lookups(plex_db, items, kodi_ids, seed):
+    """
+    Returns a list of (name, number of calls, function) of the lookups to
+    time; every function does all of its calls
+    """
+    random = Random(seed)
+    plex_ids = [str(random.randint(1, items)) for _ in xrange(2000)]
+    episodes = [random.choice(kodi_ids['episode']) for _ in xrange(2000)]
+    seasons = [random.choice(kodi_ids['season']) for _ in xrange(2000)]
+    views = [str(random.randint(1, VIEWS)) for _ in xrange(20)]
+    return (
+        ('getItem_byId', len(plex_ids),
+         lambda: [plex_db.getItem_byId(x) for x in plex_ids]),
+        ('getItem_byKodiId', len(episodes),
+         lambda: [plex_db.getItem_byKodiId(x, 'episode')
+                  for x in episodes]),
+        ('getItem_byParentId', len(seasons),
+         lambda: [plex_db.getItem_byParentId(x, 'episode')
+                  for x in seasons]),
+        ('checksum(episode)', 20,
+         lambda: [plex_db.checksum('episode') for _ in xrange(20)]),
+        ('checksum(show)', 20,
+         lambda: [plex_db.checksum('show') for _ in xrange(20)]),
+        ('get_items_by_viewid', len(views),
+         lambda: [plex_db.get_items_by_viewid(x) for x in views]),
+        ('get_missing_fanart', 20,
+         lambda: [plex_db.get_missing_fanart() for _ in xrange(20)])
+    )
+
+
+def time_lookups(path, items, kodi_ids, seed, migrate):
+    """
+    Returns a dict name: ms per call for all lookups. Applies the Plex DB
+    migrations first if migrate is True, otherwise only the ones that do not
+    add indexes
+    """
+    import plexdb_functions
+    connection = connect(path)
+    plex_db = plexdb_functions.Plex_DB_Functions(connection.cursor())
+    if migrate:
+        plex_db.migrate()
+    else:
+        plexdb_functions._add_view_last_sync(connection.cursor())
+    connection.commit()
+    results = {}
+    for name, calls, function in lookups(plex_db, items, kodi_ids, seed):
+        started = time()
+        function()
+        results[name] = (time() - started) * 1000.0 / calls
+    connection.close()
+    return results
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark of the Plex DB lookups')
+    parser.add_argument('--rows', type=int, default=100000,
+                        help='Number of rows of the Plex DB (default: 100000)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    sys.path.insert(0, join(HERE, 'kodi_stubs'))
+    sys.path.insert(0, PKC_LIB)
+    directory = mkdtemp(prefix='pkc_plexdb_benchmark_')
+    import xbmc
+    xbmc.KODI_HOME = directory
+    try:
+        path = join(directory, 'plex.db')
+        items, kodi_ids = create_plex_db(path, args.rows, args.seed)
+        before = time_lookups(path, items, kodi_ids, args.seed, False)
+        after = time_lookups(path, items, kodi_ids, args.seed, True)
+    finally:
+        rmtree(directory, ignore_errors=True)
+    print 'Plex DB with %s rows, ms per call' % items
+    print '%-20s %12s %12s %8s' % ('lookup', 'no indexes', 'indexes',
+                                   'speedup')
+    for name, _, _ in lookups(None, items, kodi_ids, args.seed):
+        print '%-20s %12.3f %12.3f %7.1fx' % (
+            name, before[name], after[name], before[name] / after[name])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks PKC's library sync (LibrarySync.fullSync and thus
+GetAndProcessXMLs and the itemtypes writers) outside of Kodi, against the
+generated library of a local fake PMS (see fake_pms.py) and scratch copies of
+the Kodi databases (see kodi_schema.py). Kodi's Python modules are replaced by
+the stubs in kodi_stubs/.
+
+Runs, one after the other on the same DBs:
+    initial     full sync into empty DBs
+    delta       delta sync after the fake PMS changed some of its items
+    repair      repair sync of all items
+
+and reports items/s, the number of PMS requests, the peak RSS and the SQL
+statements per item of each run. Needs Python 2.7 and the requests module:
+
+    python tools/sync_benchmark/sync_benchmark.py --items 10000
+
+Use --json to save the results and the telemetry of all sync threads, e.g.
+to compare two branches
+"""
+from argparse import ArgumentParser
+from os import makedirs
+from os.path import dirname, join, abspath
+from shutil import rmtree
+from subprocess import Popen, PIPE
+from tempfile import mkdtemp
+from time import time
+from json import dumps, loads
+from urllib2 import urlopen
+from sqlite3 import connect
+import logging
+import sys
+
+###############################################################################
+
+HERE = dirname(abspath(__file__))
+PKC_LIB = abspath(join(HERE, '..', '..', 'resources', 'lib'))
+
+# PKC settings that differ from the defaults of resources/settings.xml.
+# Nothing that needs Kodi or the internet, e.g. its texture cache
+SETTINGS = {
+    'FanartTV': 'false',
+    'enableTextureCache': 'false',
+    'dbSyncIndicator': 'false',
+    'SyncInstallRunDone': 'true',
+    'useDirectPaths': '0',
+    'kodiplextimeoffset': '0.0'
+}
+# (name, fullSync kwargs, library changes on the fake PMS before the run)
+RUNS = (
+    ('initial', {}, None),
+    ('delta', {'delta': True}, 'touch=%(touch)s&delete=%(delete)s'),
+    ('repair', {'repair': True}, None)
+)
+# Kodi DB tables whose rows we count after every run
+KODI_TABLES = (
+    ('MyVideos107.db', ('movie', 'tvshow', 'seasons', 'episode')),
+    ('MyMusic60.db', ('artist', 'album', 'song'))
+)
+
+###############################################################################
+
+
+def setup_kodi(home, music):
+    """
+    Points the Kodi stubs to the scratch directory home, creates the Kodi
+    DBs there and imports PKC
+    """
+    sys.path.insert(0, join(HERE, 'kodi_stubs'))
+    sys.path.insert(0, HERE)
+    sys.path.insert(0, PKC_LIB)
+    import xbmc
+    import xbmcaddon
+    import kodi_schema
+    xbmc.KODI_HOME = home
+    for directory in ('database',
+                      'profile/library/video',
+                      'profile/playlists/video',
+                      'profile/addon_data/plugin.video.plexkodiconnect'):
+        makedirs(join(home, *directory.split('/')))
+    kodi_schema.create_dbs(join(home, 'database'))
+    xbmcaddon.SETTINGS.update(SETTINGS)
+    xbmcaddon.SETTINGS['enableMusic'] = 'true' if music else 'false'
+
+
+def start_pms(args):
+    """
+    Starts fake_pms.py in its own process. Returns (process, url)
+    """
+    command = [sys.executable, join(HERE, 'fake_pms.py'),
+               '--items', str(args.items)]
+    if args.no_music:
+        command.append('--no-music')
+    process = Popen(command, stdout=PIPE)
+    line = process.stdout.readline()
+    if not line.startswith('PORT '):
+        process.kill()
+        raise RuntimeError('Could not start the fake PMS')
+    return process, 'http://127.0.0.1:%s' % line.split()[1]
+
+
+def pms_request(url):
+    return loads(urlopen(url).read())
+
+
+def count_rows(home):
+    """
+    Returns the OrderedDict-like list of (table, number of rows) of the
+    Kodi DBs
+    """
+    counts = []
+    for filename, tables in KODI_TABLES:
+        connection = connect(join(home, 'database', filename))
+        for table in tables:
+            counts.append((table, connection.execute(
+                'SELECT COUNT(*) FROM %s' % table).fetchone()[0]))
+        connection.close()
+    return counts
+
+
+def run_sync(name, kwargs, pms_url, home):
+    """
+    Runs one full sync and returns its results as a dict
+    """
+    import downloadutils
+    import librarysync
+    from library_sync import sync_info
+    requests_before = downloadutils.transfer_stats()[0]
+    pms_before = pms_request(pms_url + '/bench/stats')['requests']
+    library_sync = librarysync.LibrarySync()
+    library_sync.force_dialog = False
+    started = time()
+    success = library_sync.fullSync(**kwargs)
+    seconds = time() - started
+    runs = list(sync_info.RUNS)
+    items = sum(run['items'] for run in runs)
+    statements = sum(run['sql']['statements'] for run in runs)
+    return {
+        'run': name,
+        'success': success is not False,
+        'seconds': round(seconds, 2),
+        'items': items,
+        'items_per_second': round(items / seconds, 1),
+        'pms_requests': downloadutils.transfer_stats()[0] - requests_before,
+        # Including the requests for the deletion detection of delta syncs
+        # that transfer_stats() counts as well
+        'pms_requests_served': (pms_request(pms_url + '/bench/stats')[
+            'requests'] - pms_before - 1),
+        'sql_statements_per_item': (round(float(statements) / items, 1)
+                                    if items else None),
+        'peak_rss_mb': sync_info.peak_rss(),
+        'kodi_rows': dict(count_rows(home)),
+        'telemetry': runs
+    }
+
+
+def print_result(result):
+    print ('%-8s %7s items in %7.1fs = %7.1f items/s, %6s PMS requests, '
+           '%5s SQL statements/item, peak RSS %s MB'
+           % (result['run'], result['items'], result['seconds'],
+              result['items_per_second'], result['pms_requests'],
+              result['sql_statements_per_item'], result['peak_rss_mb']))
+    print ('         Kodi DB: %s'
+           % ', '.join('%s %s' % (count, table) for table, count in
+                       sorted(result['kodi_rows'].iteritems())))
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark of the PKC library sync')
+    parser.add_argument('--items', type=int, default=10000,
+                        help='Number of movies, episodes and tracks of the '
+                             'fake PMS (default: 10000)')
+    parser.add_argument('--no-music', action='store_true',
+                        help='Do not sync music')
+    parser.add_argument('--threads', type=int, default=10,
+                        help='Number of download threads (default: 10)')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='Number of items to get the metadata for with '
+                             'one PMS request (default: PKC setting)')
+    parser.add_argument('--touch', type=float, default=0.02,
+                        help='Fraction of the PMS items to change before the '
+                             'delta sync (default: 0.02)')
+    parser.add_argument('--delete', type=float, default=0.005,
+                        help='Fraction of the movies, episodes and tracks to '
+                             'delete before the delta sync (default: 0.005)')
+    parser.add_argument('--json', help='Save the results to this file')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the scratch Kodi directory')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='Log PKC debug messages')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.WARNING,
+        format='%(asctime)s %(threadName)s %(name)s: %(message)s')
+    home = mkdtemp(prefix='pkc_sync_benchmark_')
+    pms, pms_url = start_pms(args)
+    results = []
+    try:
+        setup_kodi(home, music=not args.no_music)
+        import state
+        import variables as v
+        from utils import window, settings
+        import librarysync
+        window('pms_server', value=pms_url)
+        state.PMS_SERVER = pms_url
+        state.SYNC_THREAD_NUMBER = args.threads
+        state.SYNC_METADATA_BATCH_SIZE = int(
+            args.batch_size or settings('syncMetadataBatchSize'))
+        state.SYNC_DIALOG = False
+        state.ENABLE_MUSIC = not args.no_music
+        print ('PKC %s, Kodi %s, fake PMS with %s items, %s download threads, '
+               'metadata batches of %s, scratch directory %s'
+               % (v.ADDON_VERSION, v.KODIVERSION,
+                  pms_request(pms_url + '/bench/stats')['leaves'],
+                  state.SYNC_THREAD_NUMBER, state.SYNC_METADATA_BATCH_SIZE,
+                  home))
+        librarysync.LibrarySync().initializeDBs()
+        for name, kwargs, change in RUNS:
+            if change:
+                changed = pms_request('%s/bench/change?%s' % (
+                    pms_url,
+                    change % {'touch': args.touch, 'delete': args.delete}))
+                print ('Fake PMS: changed %s and deleted %s items'
+                       % (changed['touched'], changed['deleted']))
+            result = run_sync(name, kwargs, pms_url, home)
+            results.append(result)
+            print_result(result)
+            if not result['success']:
+                print 'Sync failed, aborting'
+                break
+    finally:
+        pms.kill()
+        if not args.keep:
+            rmtree(home, ignore_errors=True)
+    if args.json:
+        with open(args.json, 'wb') as f:
+            f.write(dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the memory that LibrarySync.GetUpdatelist needs for a synthetic
+library: the updatelist of dicts and the dict allPlexElementsId of
+'K<plex_id><updatedAt>' checksums of PKC 2.0.4 versus today's updatelist of
+library_sync.sync_item.SyncItem and the set allPlexElementsId.
+
+    python tools/sync_benchmark/updatelist_benchmark.py --items 200000
+
+Python 2.7 has no tracemalloc, so sizes are the sys.getsizeof of all objects
+reachable from the containers, each object counted once. Strings shared by
+all items (e.g. the item type 'TVShows') thus count only once, as they do in
+PKC
+"""
+from argparse import ArgumentParser
+from os.path import dirname, join, abspath
+from random import Random
+from time import time
+import sys
+
+###############################################################################
+
+HERE = dirname(abspath(__file__))
+PKC_LIB = abspath(join(HERE, '..', '..', 'resources', 'lib'))
+
+###############################################################################
+
+
+def deep_size(obj, seen=None):
+    """
+    Returns the size in bytes of obj and of all the objects it references -
+    counting each object only once
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.iterkeys())
+            stack.extend(obj.itervalues())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, '__slots__'):
+            stack.extend(getattr(obj, name) for name in obj.__slots__
+                         if hasattr(obj, name))
+    return size
+
+
+def pms_items(number, seed):
+    """
+    Returns a list of (plex_id, title, updatedAt) as strings, like the
+    attributes of the PMS xml
+    """
+    random = Random(seed)
+    return [(str(100000 + i),
+             'Episode %s' % i,
+             str(1500000000 + random.randint(0, 10 ** 8)))
+            for i in xrange(number)]
+
+
+def old_updatelist(items):
+    """
+    GetUpdatelist of PKC 2.0.4
+    """
+    updatelist = []
+    all_plex_ids = {}
+    for plex_id, title, updated_at in items:
+        all_plex_ids[plex_id] = 'K%s%s' % (plex_id, updated_at)
+        updatelist.append({
+            'itemId': plex_id,
+            'itemType': 'TVShows',
+            'method': 'add_updateEpisode',
+            'viewName': 'TV Shows',
+            'viewId': '2',
+            'title': title,
+            'mediaType': 'episode',
+            'get_children': False
+        })
+    return updatelist, all_plex_ids
+
+
+def new_updatelist(items):
+    """
+    Today's GetUpdatelist
+    """
+    from library_sync.sync_item import SyncItem
+    updatelist = []
+    all_plex_ids = set()
+    for plex_id, title, updated_at in items:
+        # Not kept, but compared to the Plex DB's
+        int(updated_at)
+        all_plex_ids.add(plex_id)
+        updatelist.append(SyncItem(plex_id,
+                                   'TVShows',
+                                   'add_updateEpisode',
+                                   'TV Shows',
+                                   '2',
+                                   title,
+                                   'episode',
+                                   False))
+    return updatelist, all_plex_ids
+
+
+def measure(function, items):
+    """
+    Returns (seconds, bytes of updatelist, bytes of allPlexElementsId)
+    """
+    started = time()
+    updatelist, all_plex_ids = function(items)
+    seconds = time() - started
+    # The PMS item strings live in the xml anyway, count them only once
+    seen = set(id(x) for item in items for x in item)
+    seen.add(id(items))
+    return (seconds,
+            deep_size(updatelist, seen),
+            deep_size(all_plex_ids, seen))
+
+
+def main():
+    parser = ArgumentParser(description='Memory of the sync updatelist')
+    parser.add_argument('--items', type=int, default=200000,
+                        help='Number of PMS items (default: 200000)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    sys.path.insert(0, PKC_LIB)
+
+    items = pms_items(args.items, args.seed)
+    old = measure(old_updatelist, items)
+    new = measure(new_updatelist, items)
+    print '%s PMS items, MB (bytes per item)' % args.items
+    print '%-18s %20s %20s %8s' % ('', 'dicts and K-strings',
+                                   'SyncItems and ints', 'ratio')
+    for i, name in ((1, 'updatelist'), (2, 'allPlexElementsId')):
+        print '%-18s %11.1f (%5.0f) %11.1f (%5.0f) %7.2fx' % (
+            name,
+            old[i] / 1048576.0, float(old[i]) / args.items,
+            new[i] / 1048576.0, float(new[i]) / args.items,
+            float(old[i]) / new[i])
+    print '%-18s %20.2f %20.2f' % ('seconds to build', old[0], new[0])
+    checksum = 'K%s%s' % items[0][0:3:2]
+    print ('One checksum: %s bytes as the string %r, %s bytes as the int %s'
+           % (sys.getsizeof(checksum), checksum,
+              sys.getsizeof(int(items[0][2])), items[0][2]))
+
+
+if __name__ == '__main__':
+    main()